@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+CoAP endpoints driven by an :mod:`python:asyncio` event loop.
+
+An :class:`AsyncioEndpoint` exchanges datagrams through an asyncio
+datagram transport, and schedules the timeouts of its message caches
+on the event loop, so no thread or polling loop is needed to receive
+messages or to retransmit them.  :meth:`AsyncioEndpoint.send_async`
+and :meth:`AsyncioEndpoint.request` return futures that may be
+awaited by coroutines (or waited for with ``yield From(...)`` under
+`Trollius <https://pypi.python.org/pypi/trollius>`_).
+
+This module requires :mod:`python:asyncio`, or under Python 2 its
+backport Trollius, which are not otherwise dependencies of CoAPy;
+importing it raises :exc:`python:exceptions.ImportError` if neither
+is available.
+
+:copyright: Copyright 2013, Peter A. Bigot
+:license: Apache-2.0
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import os
+import socket
+import errno
+import collections
+import coapy
+import coapy.message
+import coapy.endpoint
+
+# ensure_future was named async before Python 3.4.4, and async is a
+# reserved word in later versions.
+_ensure_future = getattr(asyncio, 'ensure_future', None)
+if _ensure_future is None:
+    _ensure_future = getattr(asyncio, 'async')
+
+
+class RequestError (coapy.CoAPyException):
+    """Exception set on the future returned by
+    :meth:`AsyncioEndpoint.request` when no response is received.
+
+    The *args* are ``(diagnostic, cache_entry)`` where *diagnostic* is
+    one of the string values in this class and *cache_entry* is the
+    :class:`coapy.endpoint.SentMessageCacheEntry` for the request.
+    """
+
+    RESET = 'Request was reset'
+    """The destination rejected the request with a
+    :attr:`RST<coapy.message.Message.Type_RST>` message."""
+
+    TIMEOUT = 'No response received'
+    """The request was not acknowledged after all retransmissions, or
+    no response arrived before the request expired from the sent
+    message cache."""
+
+
+class _DatagramProtocol (asyncio.DatagramProtocol):
+    # Relay datagrams to the endpoint, holding any that arrive before
+    # the endpoint has been created.
+
+    def __init__(self):
+        self.endpoint = None
+        self.backlog = []
+
+    def datagram_received(self, data, addr):
+        if self.endpoint is None:
+            self.backlog.append((data, addr))
+        else:
+            self.endpoint._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        _log.warning('datagram error on {0!s}: {1!s}'.format(self.endpoint, exc))
+
+
+class AsyncioEndpoint (coapy.endpoint.LocalEndpoint):
+    """A :class:`coapy.endpoint.LocalEndpoint` that communicates
+    through an :mod:`python:asyncio` datagram transport.
+
+    Instances are created by :meth:`create_endpoint`.  Each datagram
+    delivered by the transport is processed by
+    :meth:`receive<coapy.endpoint.LocalEndpoint.receive>` as soon as
+    it arrives.  New messages that are not responses to a
+    :meth:`request` are passed to :attr:`handler`.  The endpoint keeps
+    a single timer on the event loop for the next
+    :meth:`deadline<coapy.endpoint.LocalEndpoint.next_deadline>` of
+    its :attr:`timer_wheel<coapy.endpoint.LocalEndpoint.timer_wheel>`,
+    through which messages queued by :meth:`send` are transmitted and
+    retransmitted.
+    """
+
+    handler = None
+    """A callable invoked with the
+    :class:`coapy.endpoint.RcvdMessageCacheEntry` of each new message
+    received by the endpoint, other than responses to requests made
+    through :meth:`request`.  The handler may
+    :meth:`reply<coapy.endpoint.RcvdMessageCacheEntry.reply>` to the
+    message.  If ``None``, such messages are ignored.
+    """
+
+    @property
+    def loop(self):
+        """The event loop that drives the endpoint."""
+        return self.__loop
+    __loop = None
+
+    @property
+    def transport(self):
+        """The datagram transport of the endpoint, or ``None`` if it
+        has been :meth:`closed<close>`."""
+        return self.__transport
+    __transport = None
+
+    @classmethod
+    def create_endpoint(cls, sockaddr=None, family=socket.AF_UNSPEC,
+                        security_mode=None,
+                        host=None, port=coapy.COAP_PORT,
+                        handler=None, loop=None):
+        """Create an endpoint with a datagram transport bound to it.
+
+        *sockaddr*, *family*, *security_mode*, *host*, and *port* are
+        as with :meth:`coapy.endpoint.SocketEndpoint.create_bound_endpoint`;
+        in particular *port* may be 0 to select an unused local port.
+        *handler* initializes :attr:`handler`.  *loop* defaults to
+        the current event loop.
+
+        Returns a future for the endpoint, which is available once the
+        transport has been created.
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        (family, sockaddr) = cls._canonical_sockinfo(sockaddr=sockaddr,
+                                                     family=family,
+                                                     security_mode=security_mode,
+                                                     host=host,
+                                                     port=port)
+        if (family is None) or (family is socket.AF_UNSPEC):
+            raise ValueError
+        protocol = _DatagramProtocol()
+        result = asyncio.Future(loop=loop)
+
+        def attach(task):
+            if result.cancelled():
+                if not task.cancelled() and (task.exception() is None):
+                    task.result()[0].close()
+                return
+            if task.cancelled():
+                result.cancel()
+                return
+            if task.exception() is not None:
+                result.set_exception(task.exception())
+                return
+            (transport, _) = task.result()
+            ep = cls(sockaddr=transport.get_extra_info('sockname'),
+                     family=family, security_mode=security_mode)
+            ep.__attach(loop, transport, protocol, handler)
+            result.set_result(ep)
+        task = _ensure_future(loop.create_datagram_endpoint(lambda: protocol,
+                                                            local_addr=sockaddr[:2],
+                                                            family=family),
+                              loop=loop)
+        task.add_done_callback(attach)
+        return result
+
+    def __attach(self, loop, transport, protocol, handler):
+        self.__loop = loop
+        self.__transport = transport
+        self.handler = handler
+        protocol.endpoint = self
+        for (data, addr) in protocol.backlog:
+            self._datagram_received(data, addr)
+        protocol.backlog = []
+
+    def close(self):
+        """Close the :attr:`transport` and cancel the timer of the
+        endpoint.  Pending requests are not affected, but will receive
+        no responses."""
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__transport is not None:
+            self.__transport.close()
+            self.__transport = None
+
+    def _reset(self):
+        self.close()
+        self.__inbox = collections.deque()
+        # Map from message ID to [entry, future, request_key] for
+        # exchanges initiated by send_async and request.
+        self.__exchanges = {}
+        # Map from (destination_endpoint, token) to the future of each
+        # request awaiting a response.
+        self.__requests = {}
+        self.__timer = None
+        self.__timer_deadline = None
+        super(AsyncioEndpoint, self)._reset()
+    __timer = None
+
+    def _rawsendto(self, data, destination_endpoint):
+        """Send *data* to *destination_endpoint* through the
+        :attr:`transport`."""
+        if self.__transport is None:
+            raise socket.error(errno.ENOTCONN, os.strerror(errno.ENOTCONN))
+        self.__transport.sendto(data, destination_endpoint.sockaddr)
+        return len(data)
+
+    def _rawrecvfrom(self, bufsize):
+        """Return the datagram being processed.  There is only one
+        while the transport delivers it, so a
+        :exc:`python:socket.error` with :data:`python:errno.EAGAIN` is
+        raised at other times."""
+        if not self.__inbox:
+            raise socket.error(errno.EAGAIN, os.strerror(errno.EAGAIN))
+        (data, addr) = self.__inbox.popleft()
+        return (data, coapy.endpoint.Endpoint(sockaddr=addr, family=self.family))
+
+    def _datagram_received(self, data, addr):
+        self.__inbox.append((data, addr))
+        hdr = coapy.message.peek_header(data)
+        try:
+            entry = self.receive()
+        except Exception:
+            _log.exception('receive')
+            entry = None
+        if entry is not None:
+            self.__message_received(entry)
+        elif (hdr is not None) and not coapy.message.Message.source_originates_type(hdr.type):
+            # An ACK or RST; see whether it completed an exchange.
+            record = self.__exchanges.get(hdr.messageID)
+            if (record is not None) and (record[0].ST_completed == record[0].state):
+                self.__exchange_completed(record)
+        self.__schedule_timeouts()
+
+    def __message_received(self, entry):
+        msg = entry.message
+        if isinstance(msg, coapy.message.Response):
+            future = self.__requests.pop((msg.source_endpoint, msg.token), None)
+            if future is not None:
+                if msg.is_confirmable():
+                    entry.reply()
+                if not future.done():
+                    future.set_result(msg)
+                return
+        if self.handler is not None:
+            self.handler(entry)
+
+    def __exchange_completed(self, record):
+        (entry, future, request_key) = record
+        if not future.done():
+            future.set_result(entry)
+        request = None
+        if request_key is not None:
+            request = self.__requests.get(request_key)
+        if request is not None:
+            reply = entry.reply_message
+            error = None
+            if reply is not None:
+                if reply.is_reset():
+                    error = RequestError(RequestError.RESET, entry)
+                elif isinstance(reply, coapy.message.Response):
+                    del self.__requests[request_key]
+                    request.set_result(reply)
+            elif entry.message.is_confirmable():
+                error = RequestError(RequestError.TIMEOUT, entry)
+            if error is not None:
+                del self.__requests[request_key]
+                request.set_exception(error)
+        if (request is None) or request.done():
+            self.__exchanges.pop(entry.message_id, None)
+
+    def __exchange_expired(self, record):
+        (entry, future, request_key) = record
+        self.__exchanges.pop(entry.message_id, None)
+        if not future.done():
+            future.set_result(entry)
+        if request_key is not None:
+            request = self.__requests.pop(request_key, None)
+            if (request is not None) and not request.done():
+                request.set_exception(RequestError(RequestError.TIMEOUT, entry))
+
+    def _process_timeout(self, entry):
+        super(AsyncioEndpoint, self)._process_timeout(entry)
+        record = self.__exchanges.get(entry.message_id)
+        if (record is None) or (record[0] is not entry):
+            return
+        if entry.cache is None:
+            self.__exchange_expired(record)
+        elif entry.ST_completed == entry.state:
+            self.__exchange_completed(record)
+
+    def __schedule_timeouts(self):
+        deadline = self.next_deadline()
+        if (self.__timer is not None) and (deadline == self.__timer_deadline):
+            return
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        self.__timer_deadline = deadline
+        if (deadline is not None) and (self.__loop is not None):
+            delay = max(0, deadline - coapy.clock())
+            self.__timer = self.__loop.call_later(delay, self.__timer_expired)
+
+    def __timer_expired(self):
+        self.__timer = None
+        self.process_timeouts()
+        self.__schedule_timeouts()
+
+    def send(self, msg, destination_endpoint=None):
+        """Extends :meth:`coapy.endpoint.LocalEndpoint.send` to
+        schedule the transmission of *msg* on the :attr:`loop`."""
+        ce = super(AsyncioEndpoint, self).send(msg, destination_endpoint)
+        self.__schedule_timeouts()
+        return ce
+
+    def __send_exchange(self, msg, destination_endpoint, request_key):
+        ce = self.send(msg, destination_endpoint)
+        future = asyncio.Future(loop=self.__loop)
+        self.__exchanges[ce.message_id] = [ce, future, request_key]
+        return (ce, future)
+
+    def send_async(self, msg, destination_endpoint=None):
+        """Send *msg* as with :meth:`send`, and return a future for
+        its :class:`coapy.endpoint.SentMessageCacheEntry`.
+
+        The future completes when the entry reaches its
+        :attr:`completed<coapy.endpoint.SentMessageCacheEntry.ST_completed>`
+        state: when a reply to a confirmable message is received or
+        all retransmissions have been made, or when a non-confirmable
+        message has been transmitted.  The reply, if any, is the
+        :attr:`reply_message<coapy.endpoint.SentMessageCacheEntry.reply_message>`
+        of the entry.
+        """
+        return self.__send_exchange(msg, destination_endpoint, None)[1]
+
+    def request(self, msg, destination_endpoint=None):
+        """Send the request *msg* as with :meth:`send`, and return a
+        future for its response.
+
+        A random token is assigned to *msg* if it has none, so that
+        separate responses can be matched to the request.  The future
+        completes with the :class:`coapy.message.Response` received in
+        a piggy-backed acknowledgement or in a separate message from
+        the destination.  If the request is reset, or no response is
+        received, a :exc:`RequestError` is set on the future instead.
+        """
+        if not isinstance(msg, coapy.message.Request):
+            raise TypeError(msg)
+        if not msg.token:
+            msg.token = os.urandom(4)
+        if destination_endpoint is None:
+            destination_endpoint = msg.destination_endpoint
+        key = (destination_endpoint, msg.token)
+        if key in self.__requests:
+            raise ValueError(msg)
+        future = asyncio.Future(loop=self.__loop)
+        self.__requests[key] = future
+        self.__send_exchange(msg, destination_endpoint, key)
+        return future
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Bulk statistics over large collections of CoAP datagrams.
+
+Decoding each datagram with :meth:`coapy.message.Message.from_packed`
+is too slow for captures with hundreds of millions of messages.  This
+module stores the datagrams in a single contiguous :class:`DatagramBatch`
+and decodes the fixed header and the option structure of all of them
+at once with `NumPy <http://www.numpy.org>`_ array operations,
+producing :class:`HeaderColumns` that agree with what
+:meth:`Message.from_packed<coapy.message.Message.from_packed>` would
+report for each datagram.
+
+This module requires NumPy, which is not otherwise a dependency of
+CoAPy; importing it raises :exc:`python:exceptions.ImportError` if
+NumPy is not available.
+
+:copyright: Copyright 2013, Peter A. Bigot
+:license: Apache-2.0
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import mmap
+import numpy
+import coapy.capture
+import coapy.message
+
+STATUS_OK = 0
+"""Value in :attr:`HeaderColumns.status` for datagrams from which
+:meth:`Message.from_packed<coapy.message.Message.from_packed>` would
+return a message."""
+
+STATUS_IGNORED = 1
+"""Value in :attr:`HeaderColumns.status` for datagrams for which
+:meth:`Message.from_packed<coapy.message.Message.from_packed>` would
+return ``None``."""
+
+STATUS_DIAGNOSTICS = (None, None,
+                      coapy.message.MessageFormatError.TOKEN_TOO_LONG,
+                      coapy.message.MessageFormatError.EMPTY_MESSAGE_NOT_EMPTY,
+                      coapy.message.MessageFormatError.TOKEN_TRUNCATED,
+                      coapy.message.MessageFormatError.INVALID_OPTION,
+                      coapy.message.MessageFormatError.ZERO_LENGTH_PAYLOAD,
+                      coapy.message.MessageFormatError.UNRECOGNIZED_CODE_CLASS,
+                      None)
+"""Map from other values in :attr:`HeaderColumns.status` to the
+*diagnostic* of the
+:exc:`MessageFormatError<coapy.message.MessageFormatError>` that
+:meth:`Message.from_packed<coapy.message.Message.from_packed>` would
+raise.  The entry for :data:`STATUS_INVALID_UTF8` is ``None``."""
+
+STATUS_INVALID_UTF8 = len(STATUS_DIAGNOSTICS) - 1
+"""Value in :attr:`HeaderColumns.status` for datagrams for which
+:meth:`Message.from_packed<coapy.message.Message.from_packed>` would
+raise :exc:`python:exceptions.UnicodeDecodeError` because the value
+of a string-format option is not valid UTF-8."""
+
+(_ST_TOKEN_TOO_LONG,
+ _ST_EMPTY_NOT_EMPTY,
+ _ST_TOKEN_TRUNCATED,
+ _ST_INVALID_OPTION,
+ _ST_ZERO_LENGTH_PAYLOAD,
+ _ST_UNRECOGNIZED_CODE_CLASS) = xrange(2, STATUS_INVALID_UTF8)
+
+
+class DatagramBatch (object):
+    """A collection of datagrams stored in one contiguous buffer.
+
+    *datagrams* is an iterable of ``(timestamp, src, dst, datagram)``
+    tuples as produced by :func:`coapy.capture.datagrams`.  A
+    *timestamp* of ``None`` is stored as NaN.
+    """
+
+    buffer = None
+    """A :class:`numpy:numpy.ndarray` of ``uint8`` holding the
+    concatenated datagrams."""
+
+    offsets = None
+    """An ``int64`` array of length ``len(self) + 1``.  Datagram *i*
+    is ``buffer[offsets[i]:offsets[i+1]]``."""
+
+    timestamps = None
+    """A ``float64`` array of the datagram timestamps."""
+
+    source = None
+    """An ``int32`` array giving for each datagram the index in
+    :attr:`peers` of its source."""
+
+    destination = None
+    """An ``int32`` array giving for each datagram the index in
+    :attr:`peers` of its destination."""
+
+    peers = None
+    """A list of the distinct ``(host, port)`` tuples in the batch."""
+
+    def __init__(self, datagrams):
+        data = bytearray()
+        offsets = [0]
+        timestamps = []
+        source = []
+        destination = []
+        peers = {}
+        for (ts, src, dst, datagram) in datagrams:
+            data.extend(datagram)
+            offsets.append(len(data))
+            timestamps.append(numpy.nan if ts is None else ts)
+            source.append(peers.setdefault(src, len(peers)))
+            destination.append(peers.setdefault(dst, len(peers)))
+        self.buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+        self.offsets = numpy.array(offsets, dtype=numpy.int64)
+        self.timestamps = numpy.array(timestamps, dtype=numpy.float64)
+        self.source = numpy.array(source, dtype=numpy.int32)
+        self.destination = numpy.array(destination, dtype=numpy.int32)
+        self.peers = [None] * len(peers)
+        for (peer, idx) in peers.iteritems():
+            self.peers[idx] = peer
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def datagram(self, i):
+        """Return datagram *i* as :class:`bytes`."""
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tostring()
+
+    @classmethod
+    def from_capture(cls, filename, ports=None):
+        """Create a batch from the UDP datagrams in the capture file
+        *filename* (see :mod:`coapy.capture`).
+
+        If *ports* is not ``None`` only datagrams with a source or
+        destination port in *ports* are included.
+        """
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                datagrams = coapy.capture.datagrams(mapped)
+                if ports is not None:
+                    datagrams = (_d for _d in datagrams
+                                 if (_d[1][1] in ports) or (_d[2][1] in ports))
+                return cls(datagrams)
+            finally:
+                mapped.close()
+
+
+class HeaderColumns (object):
+    """The header and option structure of the datagrams in a
+    :class:`DatagramBatch`, decoded by :func:`decode_headers`.
+
+    Per-datagram attributes are arrays with one element per datagram.
+    Values other than :attr:`status` are meaningful only where
+    :attr:`status` is :data:`STATUS_OK`, except that :attr:`type`,
+    :attr:`code`, and :attr:`messageID` are also set where
+    :meth:`Message.from_packed<coapy.message.Message.from_packed>`
+    would raise :exc:`MessageFormatError<coapy.message.MessageFormatError>`
+    or :exc:`python:exceptions.UnicodeDecodeError`.
+
+    Per-option attributes are arrays with one element for each option
+    of each datagram with status :data:`STATUS_OK`, in datagram order
+    and then option order.
+    """
+
+    status = None
+    """``uint8``: :data:`STATUS_OK`, :data:`STATUS_IGNORED`,
+    :data:`STATUS_INVALID_UTF8`, or an index into
+    :data:`STATUS_DIAGNOSTICS`."""
+
+    type = None
+    """``uint8``: the :attr:`Message.messageType<coapy.message.Message.messageType>`."""
+
+    code = None
+    """``uint8``: the :attr:`Message.packed_code<coapy.message.Message.packed_code>`."""
+
+    messageID = None
+    """``uint16``: the :attr:`Message.messageID<coapy.message.Message.messageID>`."""
+
+    token_length = None
+    """``uint8``: the length of the :attr:`Message.token<coapy.message.Message.token>`."""
+
+    option_count = None
+    """``int32``: the number of options."""
+
+    payload_length = None
+    """``int64``: the length of the :attr:`Message.payload<coapy.message.Message.payload>`,
+    zero if there is none."""
+
+    option_message = None
+    """``int64``: the index of the datagram containing the option."""
+
+    option_number = None
+    """``int64``: the :attr:`number<coapy.option.UrOption.number>` of the option."""
+
+    option_length = None
+    """``int64``: the length of the packed value of the option."""
+
+
+def _gather(buf, positions):
+    # Read one octet per position; positions past the end of buf are
+    # clamped, and the caller must not use those values.
+    return buf[numpy.minimum(positions, len(buf) - 1)].astype(numpy.int64)
+
+
+def _check_strings(buf, status, om, on, ob, ol):
+    # Set STATUS_INVALID_UTF8 for datagrams with a string-format
+    # option value that is not valid UTF-8.  om, on, ob, and ol give
+    # the datagram, number, value offset, and value length of each
+    # option.  Values that fail the length constraints of their
+    # option are decoded as UnrecognizedOption, and values that are
+    # entirely ASCII are valid, so only the rest are decoded.
+    (numbers, inverse) = numpy.unique(on, return_inverse=True)
+    is_string = numpy.zeros(len(numbers), dtype=bool)
+    min_length = numpy.zeros(len(numbers), dtype=numpy.int64)
+    max_length = numpy.zeros(len(numbers), dtype=numpy.int64)
+    for (i, number) in enumerate(numbers):
+        option_type = coapy.option.find_option(int(number))
+        if ((option_type is not None)
+                and isinstance(option_type.format, coapy.option.format_string)):
+            is_string[i] = True
+            min_length[i] = option_type.format.min_length
+            max_length[i] = option_type.format.max_length
+    candidate = (status[om] == STATUS_OK) & is_string[inverse]
+    candidate &= (min_length[inverse] <= ol) & (ol <= max_length[inverse])
+    if not candidate.any():
+        return
+    high = numpy.concatenate(([0], numpy.cumsum(buf >= 0x80)))
+    candidate &= high[ob + ol] > high[ob]
+    for i in numpy.flatnonzero(candidate):
+        if STATUS_OK != status[om[i]]:
+            continue
+        try:
+            buf[ob[i]:ob[i] + ol[i]].tostring().decode('utf-8')
+        except UnicodeDecodeError:
+            status[om[i]] = STATUS_INVALID_UTF8
+
+
+def decode_headers(batch):
+    """Decode the headers and option structure of every datagram in
+    *batch*, a :class:`DatagramBatch`.
+
+    The option structure is walked for all datagrams in parallel, one
+    option per step, so the number of array operations depends on the
+    largest number of options in a single message rather than on the
+    number of datagrams.
+
+    Returns a :class:`HeaderColumns` instance.
+    """
+    buf = numpy.concatenate((batch.buffer, numpy.zeros(1, dtype=numpy.uint8)))
+    starts = batch.offsets[:-1]
+    ends = batch.offsets[1:]
+    n = len(starts)
+    lengths = ends - starts
+
+    b0 = _gather(buf, starts)
+    code = _gather(buf, starts + 1)
+    mid = (_gather(buf, starts + 2) << 8) | _gather(buf, starts + 3)
+    tkl = b0 & 0x0F
+
+    status = numpy.zeros(n, dtype=numpy.uint8)
+
+    def fail(mask, value):
+        status[mask & (status == STATUS_OK)] = value
+
+    def fail_at(indices, value):
+        status[indices[status[indices] == STATUS_OK]] = value
+
+    fail((lengths < 4) | ((b0 >> 6) != coapy.message.Message.Ver), STATUS_IGNORED)
+    fail(tkl >= 9, _ST_TOKEN_TOO_LONG)
+    fail((code == 0) & ((tkl != 0) | (lengths > 4)), _ST_EMPTY_NOT_EMPTY)
+    fail((4 + tkl) > lengths, _ST_TOKEN_TRUNCATED)
+
+    option_count = numpy.zeros(n, dtype=numpy.int32)
+    payload_length = numpy.zeros(n, dtype=numpy.int64)
+    option_message = []
+    option_number = []
+    option_start = []
+    option_length = []
+
+    # Walk the options of all still-valid datagrams in lock step.
+    idx = numpy.flatnonzero(status == STATUS_OK)
+    pos = starts[idx] + 4 + tkl[idx]
+    number = numpy.zeros(len(idx), dtype=numpy.int64)
+    while len(idx):
+        end = ends[idx]
+        b = _gather(buf, pos)
+        # Messages without a payload stop at the end of the data.
+        done = pos >= end
+        marker = (~done) & (b == 0xFF)
+        if marker.any():
+            plen = end[marker] - pos[marker] - 1
+            payload_length[idx[marker]] = plen
+            fail_at(idx[marker][plen == 0], _ST_ZERO_LENGTH_PAYLOAD)
+        done |= marker
+        od = b >> 4
+        ol = b & 0x0F
+        bad = (~done) & ((od == 15) | (ol == 15))
+        p = pos + 1
+        values = []
+        for nibble in (od, ol):
+            value = nibble.copy()
+            ext1 = nibble == 13
+            ext2 = nibble == 14
+            value[ext1] = 13 + _gather(buf, p[ext1])
+            value[ext2] = 269 + ((_gather(buf, p[ext2]) << 8) | _gather(buf, p[ext2] + 1))
+            p = p + ext1 + 2 * ext2
+            values.append(value)
+        (delta, length) = values
+        vend = p + length
+        # Extension octets and values must lie within the datagram.
+        bad |= (~done) & (vend > end)
+        fail_at(idx[bad], _ST_INVALID_OPTION)
+        live = ~(done | bad)
+        number = number[live] + delta[live]
+        option_message.append(idx[live])
+        option_number.append(number)
+        option_start.append(p[live])
+        option_length.append(length[live])
+        option_count[idx[live]] += 1
+        idx = idx[live]
+        pos = vend[live]
+
+    if option_message:
+        om = numpy.concatenate(option_message)
+        on = numpy.concatenate(option_number)
+        ob = numpy.concatenate(option_start)
+        ol = numpy.concatenate(option_length)
+        # Options were collected step by step; order them by datagram
+        # (stable, so each datagram's options stay in sequence).
+        order = numpy.argsort(om, kind='mergesort')
+        (om, on, ob, ol) = (om[order], on[order], ob[order], ol[order])
+    else:
+        om = on = ob = ol = numpy.zeros(0, dtype=numpy.int64)
+
+    # Message.from_packed decodes the options, failing on string
+    # values that are not UTF-8, before it checks the code.
+    _check_strings(buf, status, om, on, ob, ol)
+    has_ctor = numpy.array([coapy.message.Message._type_for_code(_c) is not None
+                            for _c in xrange(256)], dtype=bool)
+    fail(~has_ctor[code], _ST_UNRECOGNIZED_CODE_CLASS)
+
+    # Drop the options of datagrams that failed after the walk.
+    keep = status[om] == STATUS_OK
+    (om, on, ol) = (om[keep], on[keep], ol[keep])
+
+    hc = HeaderColumns()
+    hc.status = status
+    hc.type = ((b0 >> 4) & 0x03).astype(numpy.uint8)
+    hc.code = code.astype(numpy.uint8)
+    hc.messageID = mid.astype(numpy.uint16)
+    hc.token_length = tkl.astype(numpy.uint8)
+    hc.option_count = option_count
+    hc.payload_length = payload_length
+    hc.option_message = om.astype(numpy.int64)
+    hc.option_number = on.astype(numpy.int64)
+    hc.option_length = ol.astype(numpy.int64)
+    return hc
+
+
+def _selection(columns, select):
+    ok = columns.status == STATUS_OK
+    if select is not None:
+        ok &= select
+    return ok
+
+
+def type_counts(columns, select=None):
+    """Return an array of length 4 with the number of valid messages
+    of each :attr:`Message.messageType<coapy.message.Message.messageType>`.
+
+    *columns* is a :class:`HeaderColumns`.  *select*, if not ``None``,
+    is a boolean array that further restricts the datagrams counted,
+    e.g. ``batch.source == k`` for those from peer *k*.  The same
+    applies to the other statistics functions.
+    """
+    return numpy.bincount(columns.type[_selection(columns, select)], minlength=4)
+
+
+def code_counts(columns, select=None):
+    """Return an array of length 256 with the number of valid messages
+    with each packed code."""
+    return numpy.bincount(columns.code[_selection(columns, select)], minlength=256)
+
+
+def token_length_counts(columns, select=None):
+    """Return an array of length 9 with the number of valid messages
+    with each token length."""
+    return numpy.bincount(columns.token_length[_selection(columns, select)], minlength=9)
+
+
+def option_number_counts(columns, select=None):
+    """Return ``(numbers, counts)`` where *numbers* is the sorted
+    array of option numbers occurring in valid messages and *counts*
+    the number of occurrences of each."""
+    keep = _selection(columns, select)[columns.option_message]
+    (numbers, inverse) = numpy.unique(columns.option_number[keep], return_inverse=True)
+    return (numbers, numpy.bincount(inverse, minlength=len(numbers)))
+
+
+def messageID_reuse_intervals(columns, batch, select=None):
+    """Return the time since the same source last used each Message ID.
+
+    For each datagram in *batch* this is the difference between its
+    timestamp and that of the previous valid message from the same
+    source with the same :attr:`messageID<HeaderColumns.messageID>`
+    and a :meth:`source-defined<coapy.message.Message.source_defines_messageID>`
+    type; it is NaN for the first use and for datagrams that are not
+    such messages.
+    """
+    sel = _selection(columns, select) & (columns.type < 2)
+    idx = numpy.flatnonzero(sel)
+    intervals = numpy.full(len(columns.status), numpy.nan)
+    if 0 == len(idx):
+        return intervals
+    src = batch.source[idx]
+    mid = columns.messageID[idx]
+    ts = batch.timestamps[idx]
+    order = numpy.lexsort((ts, mid, src))
+    (src, mid, ts, idx) = (src[order], mid[order], ts[order], idx[order])
+    same = (src[1:] == src[:-1]) & (mid[1:] == mid[:-1])
+    intervals[idx[1:][same]] = (ts[1:] - ts[:-1])[same]
+    return intervals
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Support for reading CoAP messages from captured network traffic.
+
+Three file formats are supported:
+
+* `pcap <http://wiki.wireshark.org/Development/LibpcapFileFormat>`_
+  as written by ``tcpdump``, in either byte order and with microsecond
+  or nanosecond timestamps;
+* `pcapng <http://www.winpcap.org/ntar/draft/PCAP-DumpFileFormat.html>`_
+  as written by Wireshark;
+* a simple length-prefixed CoAPy capture format, written by
+  :class:`CaptureWriter`.
+
+For pcap and pcapng only UDP datagrams carried over IPv4 or IPv6 are
+used; other packets (including IP fragments) are skipped.  Supported
+link types are Ethernet (with or without VLAN tags), raw IP, Linux
+cooked capture, and BSD loopback.
+
+Captures are processed incrementally: :func:`read_capture` maps the
+file into memory and decodes each datagram as it is reached, so
+arbitrarily large captures are processed in constant memory.
+
+:copyright: Copyright 2013, Peter A. Bigot
+:license: Apache-2.0
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import mmap
+import socket
+import struct
+import coapy
+import coapy.message
+
+
+class CaptureFormatError (coapy.CoAPyException):
+    """Exception raised when capture data cannot be interpreted.
+    :attr:`args` will be ``(diagnostic, offset)`` where *diagnostic*
+    is a human-readable description of the failure cause matching one
+    of the codes in this class, and *offset* is the position in the
+    capture data at which the problem was detected.
+    """
+
+    UNRECOGNIZED_FORMAT = 'unrecognized capture format'
+    """*diagnostic* value when the data does not begin with a pcap,
+    pcapng, or CoAPy capture header."""
+
+    TRUNCATED = 'truncated capture'
+    """*diagnostic* value when a header or record extends past the
+    end of the data."""
+
+    INVALID_BLOCK = 'invalid pcapng block'
+    """*diagnostic* value when a pcapng block has an impossible length
+    or references an undefined interface."""
+
+
+_PCAP_MAGIC = 0xa1b2c3d4
+_PCAP_NSEC_MAGIC = 0xa1b23c4d
+_PCAPNG_SHB = 0x0a0d0d0a
+_PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+COAPY_CAPTURE_MAGIC = b'CoAPyCap'
+"""The first eight octets of a file in CoAPy capture format.
+
+The magic is followed by a 16-bit version (currently 1) and 16 bits
+of zero.  Each record then comprises a header described by
+:data:`COAPY_RECORD_FORMAT`, the source and destination addresses in
+network byte order, and the datagram."""
+
+COAPY_RECORD_FORMAT = str('!dBBHHH')
+"""The :mod:`python:struct` format of the header of each record in a
+CoAPy capture: the timestamp in seconds since the POSIX epoch, the
+lengths of the source and destination addresses (4 for IPv4, 16 for
+IPv6), the source and destination ports, and the length of the
+datagram."""
+
+_coapy_header = struct.Struct(str('!8sHH'))
+_coapy_record = struct.Struct(COAPY_RECORD_FORMAT)
+
+# Link-layer header types from http://www.tcpdump.org/linktypes.html
+_LINKTYPE_NULL = 0
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = 101
+_LINKTYPE_LOOP = 108
+_LINKTYPE_LINUX_SLL = 113
+_LINKTYPE_IPV4 = 228
+_LINKTYPE_IPV6 = 229
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86dd
+_ETHERTYPE_VLANS = (0x8100, 0x88a8)
+
+_IPPROTO_UDP = 17
+# IPv6 extension headers that are skipped to locate a UDP header.
+# Fragment headers (44) are not skipped: fragments are ignored.
+_IPV6_SKIPPED_HEADERS = (0, 43, 60)
+
+_unpack_B = struct.Struct(str('B')).unpack_from
+_unpack_H = struct.Struct(str('!H')).unpack_from
+
+
+def _address(family, data, start, end):
+    octets = data[start:end]
+    if isinstance(octets, memoryview):
+        octets = octets.tobytes()
+    return socket.inet_ntop(family, bytes(octets)).decode('ascii')
+
+
+def _ip_udp(data, offset, end):
+    """Locate the UDP payload in the IP packet at *offset* in *data*.
+
+    Returns ``(src, dst, start, end)`` with the source and destination
+    ``(host, port)`` and the location of the payload, or ``None`` if
+    the packet is not an unfragmented UDP datagram.
+    """
+    if offset >= end:
+        return None
+    version = _unpack_B(data, offset)[0] >> 4
+    if 4 == version:
+        if (offset + 20) > end:
+            return None
+        ihl = 4 * (0x0F & _unpack_B(data, offset)[0])
+        (total_length,) = _unpack_H(data, offset + 2)
+        (fragment,) = _unpack_H(data, offset + 6)
+        if (0x3FFF & fragment) or (_IPPROTO_UDP != _unpack_B(data, offset + 9)[0]):
+            return None
+        family = socket.AF_INET
+        src = (offset + 12, offset + 16)
+        dst = (offset + 16, offset + 20)
+        end = min(end, offset + total_length)
+        offset += ihl
+    elif 6 == version:
+        if (offset + 40) > end:
+            return None
+        (payload_length,) = _unpack_H(data, offset + 4)
+        next_header = _unpack_B(data, offset + 6)[0]
+        family = socket.AF_INET6
+        src = (offset + 8, offset + 24)
+        dst = (offset + 24, offset + 40)
+        end = min(end, offset + 40 + payload_length)
+        offset += 40
+        while next_header in _IPV6_SKIPPED_HEADERS:
+            if (offset + 2) > end:
+                return None
+            next_header = _unpack_B(data, offset)[0]
+            offset += 8 * (1 + _unpack_B(data, offset + 1)[0])
+        if _IPPROTO_UDP != next_header:
+            return None
+    else:
+        return None
+    if (offset + 8) > end:
+        return None
+    (sport, dport, length) = struct.unpack_from(str('!HHH'), data, offset)
+    if 8 > length:
+        return None
+    return ((_address(family, data, *src), sport),
+            (_address(family, data, *dst), dport),
+            offset + 8, min(end, offset + length))
+
+
+def _link_udp(linktype, data, offset, end):
+    """Locate the UDP payload in the link-layer frame at *offset* in
+    *data*, as with :func:`_ip_udp`."""
+    if _LINKTYPE_ETHERNET == linktype:
+        if (offset + 14) > end:
+            return None
+        (ethertype,) = _unpack_H(data, offset + 12)
+        offset += 14
+        while ethertype in _ETHERTYPE_VLANS:
+            if (offset + 4) > end:
+                return None
+            (ethertype,) = _unpack_H(data, offset + 2)
+            offset += 4
+        if ethertype not in (_ETHERTYPE_IPV4, _ETHERTYPE_IPV6):
+            return None
+    elif _LINKTYPE_LINUX_SLL == linktype:
+        offset += 16
+    elif linktype in (_LINKTYPE_NULL, _LINKTYPE_LOOP):
+        # The address family is in the byte order of the capturing
+        # host; rely on the IP version instead.
+        offset += 4
+    elif linktype not in (_LINKTYPE_RAW, _LINKTYPE_IPV4, _LINKTYPE_IPV6):
+        return None
+    return _ip_udp(data, offset, end)
+
+
+def pcap_datagrams(data):
+    """Iterate over the UDP datagrams in pcap-format *data*.
+
+    *data* may be any object supporting slicing and the buffer
+    interface, such as :class:`bytes`, a :class:`python:bytearray`,
+    a :class:`python:memoryview`, or a :class:`python:mmap.mmap`.
+    Yields ``(timestamp, src, dst, datagram)`` where *timestamp* is
+    the capture time in seconds since the POSIX epoch, *src* and *dst*
+    are ``(host, port)`` tuples with the host as text, and *datagram*
+    is a slice of *data* holding the UDP payload.
+    """
+    end = len(data)
+    if 24 > end:
+        raise CaptureFormatError(CaptureFormatError.TRUNCATED, 0)
+    for order in (str('<'), str('>')):
+        (magic,) = struct.unpack_from(order + str('I'), data, 0)
+        if magic in (_PCAP_MAGIC, _PCAP_NSEC_MAGIC):
+            break
+    else:
+        raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, 0)
+    divisor = 1e9 if (_PCAP_NSEC_MAGIC == magic) else 1e6
+    (linktype,) = struct.unpack_from(order + str('I'), data, 20)
+    record = struct.Struct(order + str('IIII'))
+    offset = 24
+    while offset < end:
+        if (offset + record.size) > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        (ts_sec, ts_frac, incl_len, _) = record.unpack_from(data, offset)
+        offset += record.size
+        rend = offset + incl_len
+        if rend > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        udp = _link_udp(linktype, data, offset, rend)
+        if udp is not None:
+            (src, dst, pstart, pend) = udp
+            yield (ts_sec + ts_frac / divisor, src, dst, data[pstart:pend])
+        offset = rend
+
+
+def _pcapng_tsdivisor(order, data, offset, end):
+    # Walk the options of an Interface Description Block looking for
+    # if_tsresol (9).  The default resolution is microseconds.
+    while (offset + 4) <= end:
+        (code, length) = struct.unpack_from(order + str('HH'), data, offset)
+        if 0 == code:
+            break
+        if (9 == code) and (1 <= length):
+            resol = _unpack_B(data, offset + 4)[0]
+            if 0x80 & resol:
+                return float(2 ** (0x7F & resol))
+            return float(10 ** resol)
+        offset += 4 + ((length + 3) & ~3)
+    return 1e6
+
+
+def pcapng_datagrams(data):
+    """Iterate over the UDP datagrams in pcapng-format *data*.
+
+    *data* and the yielded values are as with :func:`pcap_datagrams`.
+    Enhanced and Simple Packet Blocks are processed; all other blocks
+    except those describing interfaces are skipped.
+    """
+    end = len(data)
+    offset = 0
+    order = str('<')
+    interfaces = []
+    while offset < end:
+        if (offset + 12) > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        (block_type,) = struct.unpack_from(order + str('I'), data, offset)
+        if _PCAPNG_SHB == block_type:
+            # The byte order can change at each section header.
+            for order in (str('<'), str('>')):
+                (magic,) = struct.unpack_from(order + str('I'), data, offset + 8)
+                if _PCAPNG_BYTE_ORDER_MAGIC == magic:
+                    break
+            else:
+                raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, offset)
+            interfaces = []
+        elif 0 == offset:
+            raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, offset)
+        (block_length,) = struct.unpack_from(order + str('I'), data, offset + 4)
+        bend = offset + block_length
+        if (12 > block_length) or (0 != (block_length % 4)):
+            raise CaptureFormatError(CaptureFormatError.INVALID_BLOCK, offset)
+        if bend > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        body_end = bend - 4
+        if 1 == block_type:
+            if (offset + 16) > body_end:
+                raise CaptureFormatError(CaptureFormatError.INVALID_BLOCK, offset)
+            (linktype, _, snaplen) = struct.unpack_from(order + str('HHI'), data, offset + 8)
+            interfaces.append((linktype, snaplen,
+                               _pcapng_tsdivisor(order, data, offset + 16, body_end)))
+        elif 6 == block_type:
+            if (offset + 28) > body_end:
+                raise CaptureFormatError(CaptureFormatError.INVALID_BLOCK, offset)
+            (ifid, ts_high, ts_low, caplen, _) = struct.unpack_from(order + str('IIIII'),
+                                                                    data, offset + 8)
+            if ifid >= len(interfaces):
+                raise CaptureFormatError(CaptureFormatError.INVALID_BLOCK, offset)
+            (linktype, _, divisor) = interfaces[ifid]
+            pstart = offset + 28
+            pend = min(pstart + caplen, body_end)
+            udp = _link_udp(linktype, data, pstart, pend)
+            if udp is not None:
+                (src, dst, ustart, uend) = udp
+                yield (((ts_high << 32) | ts_low) / divisor, src, dst, data[ustart:uend])
+        elif 3 == block_type:
+            # Simple packets carry no timestamp and belong to the first
+            # interface.
+            if not interfaces:
+                raise CaptureFormatError(CaptureFormatError.INVALID_BLOCK, offset)
+            (linktype, snaplen, _) = interfaces[0]
+            (origlen,) = struct.unpack_from(order + str('I'), data, offset + 8)
+            caplen = origlen
+            if snaplen:
+                caplen = min(caplen, snaplen)
+            pstart = offset + 12
+            pend = min(pstart + caplen, body_end)
+            udp = _link_udp(linktype, data, pstart, pend)
+            if udp is not None:
+                (src, dst, ustart, uend) = udp
+                yield (None, src, dst, data[ustart:uend])
+        offset = bend
+
+
+def coapy_datagrams(data):
+    """Iterate over the datagrams in CoAPy capture format *data*.
+
+    *data* and the yielded values are as with :func:`pcap_datagrams`.
+    """
+    end = len(data)
+    if _coapy_header.size > end:
+        raise CaptureFormatError(CaptureFormatError.TRUNCATED, 0)
+    (magic, version, _) = _coapy_header.unpack_from(data, 0)
+    if (COAPY_CAPTURE_MAGIC != magic) or (1 != version):
+        raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, 0)
+    offset = _coapy_header.size
+    families = {4: socket.AF_INET, 16: socket.AF_INET6}
+    while offset < end:
+        if (offset + _coapy_record.size) > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        (ts, slen, dlen, sport, dport, length) = _coapy_record.unpack_from(data, offset)
+        if (slen not in families) or (dlen not in families):
+            raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, offset)
+        astart = offset + _coapy_record.size
+        pstart = astart + slen + dlen
+        pend = pstart + length
+        if pend > end:
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, offset)
+        src = (_address(families[slen], data, astart, astart + slen), sport)
+        dst = (_address(families[dlen], data, astart + slen, pstart), dport)
+        yield (ts, src, dst, data[pstart:pend])
+        offset = pend
+
+
+def datagrams(data):
+    """Iterate over the datagrams in *data*, which may be in any
+    supported capture format.
+
+    The format is identified from the first octets of *data*.  *data*
+    and the yielded values are as with :func:`pcap_datagrams`.
+    """
+    if 4 > len(data):
+        raise CaptureFormatError(CaptureFormatError.UNRECOGNIZED_FORMAT, 0)
+    (magic,) = struct.unpack_from(str('<I'), data, 0)
+    if magic == _PCAPNG_SHB:
+        return pcapng_datagrams(data)
+    if ((_coapy_header.size <= len(data))
+            and (COAPY_CAPTURE_MAGIC == _coapy_header.unpack_from(data, 0)[0])):
+        return coapy_datagrams(data)
+    return pcap_datagrams(data)
+
+
+def messages(data, lazy=True, ports=None):
+    """Iterate over the CoAP messages in capture *data*.
+
+    *data* is as with :func:`datagrams`.  Yields ``(timestamp, src,
+    dst, message)`` where *message* is the
+    :class:`coapy.message.Message` decoded from each datagram using
+    :meth:`coapy.message.Message.from_packed` with *lazy*.
+
+    If *ports* is not ``None`` it must be a collection of UDP port
+    numbers, and only datagrams with a source or destination port in
+    *ports* are decoded.  Datagrams that are not valid CoAP messages
+    are skipped.
+    """
+    from_packed = coapy.message.Message.from_packed
+    for (ts, src, dst, datagram) in datagrams(data):
+        if (ports is not None) and not ((src[1] in ports) or (dst[1] in ports)):
+            continue
+        try:
+            m = from_packed(datagram, lazy=lazy)
+        except coapy.message.MessageFormatError as e:
+            _log.debug('skipped invalid message from {0}: {1}'.format(src, e))
+            continue
+        if m is not None:
+            yield (ts, src, dst, m)
+
+
+def read_capture(filename, lazy=True, ports=None):
+    """Iterate over the CoAP messages in the capture file *filename*.
+
+    The file is memory-mapped and processed as with :func:`messages`,
+    which describes *lazy*, *ports*, and the yielded values.  Only the
+    datagram being decoded is copied out of the mapping, so memory use
+    does not depend on the size of the file.  The file remains open
+    until iteration completes or the iterator is closed.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(0, 2)
+        if 0 == f.tell():
+            raise CaptureFormatError(CaptureFormatError.TRUNCATED, 0)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for record in messages(mapped, lazy=lazy, ports=ports):
+                yield record
+        finally:
+            mapped.close()
+
+
+class CaptureWriter (object):
+    """Write datagrams to *stream* in CoAPy capture format.
+
+    *stream* must be a binary file-like object open for writing.  The
+    file header is written when the instance is created.
+    """
+
+    def __init__(self, stream):
+        self.__stream = stream
+        stream.write(_coapy_header.pack(COAPY_CAPTURE_MAGIC, 1, 0))
+
+    @staticmethod
+    def __packed_address(host):
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                return socket.inet_pton(family, host)
+            except socket.error:
+                pass
+        raise ValueError(host)
+
+    def write(self, timestamp, src, dst, message):
+        """Append a record.
+
+        *timestamp* is the time in seconds since the POSIX epoch.  *src*
+        and *dst* are ``(host, port)`` tuples where *host* is a numeric
+        IPv4 or IPv6 address.  *message* is a
+        :class:`coapy.message.Message` or the :class:`bytes` of a
+        datagram.
+        """
+        if isinstance(message, coapy.message.Message):
+            message = message.to_packed()
+        saddr = self.__packed_address(src[0])
+        daddr = self.__packed_address(dst[0])
+        self.__stream.write(_coapy_record.pack(timestamp, len(saddr), len(daddr),
+                                               src[1], dst[1], len(message)))
+        self.__stream.write(saddr)
+        self.__stream.write(daddr)
+        self.__stream.write(message)
@@ -25,7 +25,13 @@ from __future__ import division
 import logging
 _log = logging.getLogger(__name__)
 
+import os
+import sys
 import socket
+import select
+import errno
+import math
+import struct
 import urlparse
 import urllib
 import random
@@ -40,6 +46,15 @@ urlparse.uses_relative.extend(['coap', 'coaps'])
 urlparse.uses_netloc.extend(['coap', 'coaps'])
 urlparse.uses_query.extend(['coap', 'coaps'])
 
+_pack_header = struct.Struct(str('!BBH')).pack
+_VTTKL_ACK = (coapy.message.Message.Ver << 6) | (coapy.message.Message.Type_ACK << 4)
+_VTTKL_RST = (coapy.message.Message.Ver << 6) | (coapy.message.Message.Type_RST << 4)
+
+
+def _pack_empty_reply(message_id, reset=False):
+    """Return the packed empty ACK (or RST if *reset*) for *message_id*."""
+    return _pack_header(_VTTKL_RST if reset else _VTTKL_ACK, 0, message_id)
+
 
 class URIError (coapy.CoAPyException):
     pass
@@ -97,7 +112,11 @@ class MessageCache (object):
     based on :attr:`time_due<MessageCacheEntry.time_due>`.  Items in
     the cache for which no
     :attr:`time_due<MessageCacheEntry.time_due>` has been specified
-    are held on a :meth:`pending` FIFO.
+    are held on a :meth:`pending` FIFO.  If *timer_wheel* is provided
+    it replaces the queue: entries are scheduled only in the wheel,
+    which is shared with other caches so that the timeouts of all of
+    them are processed together; see
+    :meth:`LocalEndpoint.process_timeouts`.
 
     Cache entries are placed in a cache when they are created.  It
     is an error to create a new cache entry when one with the same
@@ -128,13 +147,21 @@ class MessageCache (object):
         cache."""
         return self.__is_sent_cache
 
-    def __init__(self, endpoint, is_sent_cache):
+    @property
+    def timer_wheel(self):
+        """The :class:`coapy.util.TimerWheel` in which entries are
+        scheduled in place of the :meth:`queue`, or ``None``."""
+        return self.__timer_wheel
+
+    def __init__(self, endpoint, is_sent_cache, timer_wheel=None):
         if not isinstance(endpoint, Endpoint):
             raise ValueError(endpoint)
         self.__endpoint = endpoint
         self.__is_sent_cache = is_sent_cache
+        self.__timer_wheel = timer_wheel
         self.__pending = []
-        self.__queue = []
+        if timer_wheel is None:
+            self.__queue = coapy.util.TimeDueQueue()
         self.__dict = {}
         self.keys = self.__dict.keys
         self.values = self.__dict.values
@@ -166,22 +193,36 @@ class MessageCache (object):
         return self.__pending
 
     def queue(self):
-        """The queue of cache entries sorted by
-        :attr:`MessageCacheEntry.time_due`.
+        """The :class:`coapy.util.TimeDueQueue` of cache entries
+        ordered by :attr:`MessageCacheEntry.time_due`, or ``None`` if
+        the entries are scheduled in a :attr:`timer_wheel`.
 
         .. warning::
 
-           This method returns a reference to the underlying sorted
-           list.  Callers are expected to refrain from changing the
-           list in any way other than through methods exposed on the
-           cache itself.
+           This method returns a reference to the underlying queue.
+           Callers are expected to refrain from changing the queue in
+           any way other than through methods exposed on the cache
+           itself.
         """
         return self.__queue
 
     def clear(self):
-        """Remove all entries in the cache."""
-        while self.__queue:
-            self._remove(self.__queue[0])
+        """Remove all entries in the cache that are not :meth:`pending`."""
+        queue = self.__queue
+        if queue is not None:
+            while queue:
+                self._remove(queue[0])
+            return
+        pending = set(id(_e) for _e in self.__pending)
+        for entry in self.__dict.values():
+            if id(entry) not in pending:
+                self._remove(entry)
+
+    def __schedule(self, entry):
+        if self.__queue is None:
+            self.__timer_wheel.schedule(entry)
+        else:
+            self.__queue.insert(entry)
 
     def _add(self, entry):
         """Add *entry* to the cache.
@@ -195,7 +236,7 @@ class MessageCache (object):
         if entry.time_due is None:
             self.__pending.append(entry)
         else:
-            entry.queue_insert(self.__queue)
+            self.__schedule(entry)
         self.__dict[entry.message_id] = entry
 
     def _remove(self, entry):
@@ -203,7 +244,10 @@ class MessageCache (object):
         """
         if not isinstance(entry, MessageCacheEntry):
             raise ValueError(entry)
-        entry.queue_remove(self.__queue)
+        if self.__queue is None:
+            self.__timer_wheel.cancel(entry)
+        else:
+            self.__queue.remove(entry)
         del self.__dict[entry.message_id]
         entry._dissociate()
         return entry
@@ -216,7 +260,7 @@ class MessageCache (object):
         :attr:`coapy.util.TimeDueOrdinal.time_due` attribute value is
         first assigned."""
         self.__pending.remove(entry)
-        entry.queue_insert(self.__queue)
+        self.__schedule(entry)
 
     def _reposition(self, entry):
         """Re-place *entry* at its correct location in the queue.
@@ -224,10 +268,14 @@ class MessageCache (object):
         This will be invoked whenever the underlying
         :attr:`coapy.util.TimeDueOrdinal.time_due` attribute value is
         changed."""
-        entry.queue_reposition(self.__queue)
+        if self.__queue is None:
+            self.__timer_wheel.schedule(entry)
+        else:
+            self.__queue.reposition(entry)
 
     def __len__(self):
-        return len(self.__queue)
+        # The number of entries that are not pending.
+        return len(self.__dict) - len(self.__pending)
 
     def __getitem__(self, key):
         if isinstance(key, coapy.message.Message):
@@ -587,8 +635,13 @@ class RcvdMessageCacheEntry (MessageCacheEntry):
         :meth:`reset<coapy.message.Message.is_reset>` message.  A
         non-confirmable message may have no response at all.
         """
+        if (self.__reply_message is None) and (self.__reply_packed is not None):
+            self.__reply_message = self.message.create_reply(reset=self.__reply_reset)
         return self.__reply_message
     __reply_message = None
+    __reply_given = False
+    __reply_reset = False
+    __reply_packed = None
 
     def reply(self, reset=False, message=None):
         """Create the :attr:`reply_message` for the reception in this entry.
@@ -602,7 +655,9 @@ class RcvdMessageCacheEntry (MessageCacheEntry):
         :attr:`ACK<coapy.message.Message.Type_ACK>` (*reset* is
         ``False``) or
         :attr:`RST<coapy.message.Message.Type_RST>` (*reset* is
-        ``True``) message.
+        ``True``) message.  This is done without creating a
+        :class:`coapy.message.Message` instance unless
+        :attr:`reply_message` is later used.
 
         The reply message will be transmitted to the source endpoint
         of the received message.
@@ -610,10 +665,21 @@ class RcvdMessageCacheEntry (MessageCacheEntry):
         Erroneous use will raise :exc:`ReplyMessageError`.
         """
 
-        if self.__reply_message is not None:
+        if self.__reply_given:
             raise ReplyMessageError(ReplyMessageError.ALREADY_GIVEN, self, message)
         if message is None:
-            message = self.message.create_reply(reset=reset)
+            # Empty ACK and RST replies are packed directly from the
+            # received Message ID; the reply_message is created only if
+            # somebody asks for it.
+            rm = self.message
+            if (not reset) and not rm.is_confirmable():
+                raise coapy.message.MessageReplyError(coapy.message.MessageReplyError.ACK_FOR_NON,
+                                                      rm)
+            self.__reply_given = True
+            self.__reply_reset = reset
+            self.__reply_packed = _pack_empty_reply(rm.messageID, reset)
+            self._transmit_reply()
+            return
         if message.messageID is None:
             message.messageID = self.message.messageID
         if message.messageID != self.message.messageID:
@@ -629,13 +695,25 @@ class RcvdMessageCacheEntry (MessageCacheEntry):
             message.source_endpoint = self.message.destination_endpoint
         if message.destination_endpoint is None:
             message.destination_endpoint = self.message.source_endpoint
+        self.__reply_given = True
         self.__reply_message = message
         self._transmit_reply()
 
     def _transmit_reply(self):
+        if self.__reply_packed is not None:
+            rm = self.message
+            rm.destination_endpoint.rawsendto(self.__reply_packed, rm.source_endpoint)
+            return
         rm = self.__reply_message
         rm.source_endpoint.rawsendto(rm.to_packed(), rm.destination_endpoint)
 
+    def _process_duplicate(self):
+        # Another copy of the message arrived.  Per :coapsect:`4.5`
+        # repeat whatever reply was given to the original.
+        self.__reception_count += 1
+        if self.__reply_given:
+            self._transmit_reply()
+
     def __init__(self, cache, message):
         if not isinstance(message, coapy.message.Message):
             raise ValueError(message)
@@ -650,6 +728,11 @@ class RcvdMessageCacheEntry (MessageCacheEntry):
         self.cache._remove(self)
 
 
+# The options that contribute to Endpoint.uri_from_options.
+_URI_OPTION_TYPES = (coapy.option.UriHost, coapy.option.UriPort,
+                     coapy.option.UriPath, coapy.option.UriQuery)
+
+
 class Endpoint (object):
     """A CoAP endpoint.
 
@@ -800,6 +883,36 @@ class Endpoint (object):
         return self.__base_uri
     __base_uri = None
 
+    @property
+    def uri_options_cache(self):
+        """The :class:`coapy.util.LRUCache` used by
+        :meth:`uri_to_options`.  Keys are ``(uri, base_uri)`` pairs
+        and values are tuples of :func:`interned
+        <coapy.option.intern_option>` options.  The cache is created
+        when first used."""
+        if self.__uri_options_cache is None:
+            self.__uri_options_cache = coapy.util.LRUCache(self.URI_CACHE_CAPACITY)
+        return self.__uri_options_cache
+    __uri_options_cache = None
+
+    @property
+    def uri_text_cache(self):
+        """The :class:`coapy.util.LRUCache` used by
+        :meth:`uri_from_options`.  Keys are tuples of the ``(number,
+        value)`` pairs of the URI options in canonical order, and
+        values are URI text.  The cache is created when first used."""
+        if self.__uri_text_cache is None:
+            self.__uri_text_cache = coapy.util.LRUCache(self.URI_CACHE_CAPACITY)
+        return self.__uri_text_cache
+    __uri_text_cache = None
+
+    URI_CACHE_CAPACITY = 256
+    """The initial :attr:`capacity<coapy.util.LRUCache.capacity>` of
+    :attr:`uri_options_cache` and :attr:`uri_text_cache`.  Most
+    endpoints, such as those of the remote peers of a
+    :class:`LocalEndpoint`, never convert URIs and so never create
+    these caches."""
+
     __EndpointRegistry = {}
 
     @staticmethod
@@ -946,7 +1059,8 @@ class Endpoint (object):
            This method uses cooperative super-calling for subclass
            extension.
         """
-        pass
+        self.__uri_options_cache = None
+        self.__uri_text_cache = None
 
     def __init__(self, sockaddr=None, family=socket.AF_UNSPEC,
                  security_mode=None,
@@ -956,8 +1070,8 @@ class Endpoint (object):
         super(Endpoint, self).__init__()
         # Note: Only re-initialize if the instance was newly created.
         if self.__base_uri is None:
-            self.__base_uri = self.uri_from_options([])
             self._reset()
+            self.__base_uri = self.__uri_from_options([])
 
     def get_peer_endpoint(self, sockaddr=None, host=None, port=coapy.COAP_PORT):
         """Find the endpoint at *sockaddr* that this endpoint can talk to.
@@ -1025,10 +1139,25 @@ class Endpoint (object):
         * :class:`coapy.option.UriQuery`, absent if there is no query
           part, otherwise occurs once per ``&``-separated query
           element.
+
+        The options are :func:`interned<coapy.option.intern_option>`
+        and cannot be modified.  The result for each *uri* and
+        *base_uri* is retained in :attr:`uri_options_cache`; a new
+        list is returned on each call.
         """
 
         if base_uri is None:
             base_uri = self.base_uri
+        key = (uri, base_uri)
+        cache = self.uri_options_cache
+        opts = cache.get(key)
+        if opts is None:
+            opts = self.__uri_to_options(uri, base_uri)
+            cache[key] = opts
+        return list(opts)
+
+    # Uncached implementation of uri_to_options, returning a tuple.
+    def __uri_to_options(self, uri, base_uri):
         if base_uri is not None:
             uri = urlparse.urljoin(base_uri, uri)
         res = urlparse.urlsplit(uri)
@@ -1053,7 +1182,7 @@ class Endpoint (object):
         if res.hostname:
             host = coapy.util.url_unquote(res.hostname)
             if not self.is_same_host(host):
-                opts.append(coapy.option.UriHost(host))
+                opts.append(coapy.option.UriHost.interned(host))
 
         # 6.4.6.  Set port from URI or default from scheme
         port = res.port
@@ -1062,7 +1191,7 @@ class Endpoint (object):
 
         # 6.4.7.
         if port != self.port:
-            opts.append(coapy.option.UriPort(port))
+            opts.append(coapy.option.UriPort.interned(port))
 
         # 6.4.8
         path = res.path
@@ -1071,15 +1200,15 @@ class Endpoint (object):
                 path = path[1:]
             for segment in path.split('/'):
                 segment = coapy.util.url_unquote(segment)
-                opts.append(coapy.option.UriPath(segment))
+                opts.append(coapy.option.UriPath.interned(segment))
 
         # 6.4.9
         query = res.query
         if query:
             for qseg in query.split('&'):
                 qseg = coapy.util.url_unquote(qseg)
-                opts.append(coapy.option.UriQuery(qseg))
-        return opts
+                opts.append(coapy.option.UriQuery.interned(qseg))
+        return tuple(opts)
 
     def uri_from_options(self, opts):
         """Create a URI from endpoint data and the options.
@@ -1096,7 +1225,22 @@ class Endpoint (object):
         The remainder of the URI is built up from
         :class:`UriPath<coapy.option.UriPath>` and
         :class:`UriQuery<coapy.option.UriQuery>` options in *opts*.
+
+        The result is retained in :attr:`uri_text_cache`, keyed by the
+        values of those options.
         """
+        key = tuple((_o.number, _o.value)
+                    for _o in coapy.option.sorted_options(opts)
+                    if isinstance(_o, _URI_OPTION_TYPES))
+        cache = self.uri_text_cache
+        uri = cache.get(key)
+        if uri is None:
+            uri = self.__uri_from_options(opts)
+            cache[key] = uri
+        return uri
+
+    # Uncached implementation of uri_from_options.
+    def __uri_from_options(self, opts):
         scheme = 'coap'
         if self.security_mode is not None:
             scheme = 'coaps'
@@ -1208,6 +1352,29 @@ class Endpoint (object):
         m.destination_endpoint = self
         return m
 
+    def create_request_template(self, uri,
+                                confirmable=False,
+                                code=coapy.message.Request.GET,
+                                options=None):
+        """Create and return a
+        :class:`RequestTemplate<coapy.message.RequestTemplate>` for
+        repeated requests for *uri* from this endpoint.
+
+        *uri*, *confirmable*, *code*, and *options* are as with
+        :meth:`create_request`.  The URI is converted to options and
+        the options encoded once, when the template is created.  The
+        template :attr:`destination_endpoint<coapy.message.RequestTemplate.destination_endpoint>`
+        is *self*.
+        """
+        uri_options = []
+        if uri is not None:
+            uri_options = self.uri_to_options(uri)
+        if options is not None:
+            uri_options.extend(options)
+        return coapy.message.RequestTemplate(confirmable=confirmable,
+                                             code=code, options=uri_options,
+                                             destination_endpoint=self)
+
     def __unicode__(self):
         return '{s.uri_host}:{s.port:d}'.format(s=self)
     __str__ = __unicode__
@@ -1250,6 +1417,25 @@ class RemoteEndpointState(object):
     duplicates.
     """
 
+    rx_duplicates = None
+    """The number of duplicate
+    :meth:`confirmable<coapy.message.Message.is_confirmable>` or
+    :meth:`non-confirmable<coapy.message.Message.is_non_confirmable>`
+    messages received from this endpoint.
+    """
+
+    rx_decodes_avoided = None
+    """The number of messages received from this endpoint that were
+    discarded based on their header without being decoded: the
+    :attr:`rx_duplicates` plus acknowledgements and resets that
+    match no sent message.
+    """
+
+    rx_malformed = None
+    """The number of messages received from this endpoint that were
+    discarded because they could not be decoded.
+    """
+
     tx_messages = None
     """The number of messages transmitted to this endpoint, including
     retransmissions.
@@ -1265,14 +1451,17 @@ class RemoteEndpointState(object):
     :attr:`last_heard_clk` was last updated.
     """
 
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, timer_wheel=None):
         if not isinstance(endpoint, Endpoint):
             raise ValueError(endpoint)
         self.__endpoint = endpoint
-        self.rcvd_cache = MessageCache(endpoint, False)
+        self.rcvd_cache = MessageCache(endpoint, False, timer_wheel)
         self.last_heard_clk = None
         self.rx_messages = 0
         self.rx_octets = 0
+        self.rx_duplicates = 0
+        self.rx_decodes_avoided = 0
+        self.rx_malformed = 0
         self.tx_messages = 0
         self.tx_octets = 0
         self.tx_octets_since_heard = 0
@@ -1318,15 +1507,71 @@ class LocalEndpoint(Endpoint):
         """
         rv = self.__remote_state.get(endpoint)
         if rv is None:
-            rv = RemoteEndpointState(endpoint)
+            rv = RemoteEndpointState(endpoint, self.__timer_wheel)
             self.__remote_state[endpoint] = rv
         return rv
 
+    TIMER_GRANULARITY = 0.1
+    """The :attr:`granularity<coapy.util.TimerWheel.granularity>` of
+    the :attr:`timer_wheel` of new endpoints.  Timeouts that fall
+    within the same interval of this length are processed together."""
+
+    @property
+    def timer_wheel(self):
+        """The :class:`coapy.util.TimerWheel` that schedules the
+        timeouts of all :class:`MessageCacheEntry` instances for
+        messages sent by this endpoint and messages received from
+        each of its :meth:`remote endpoints<remote_state>`."""
+        return self.__timer_wheel
+    __timer_wheel = None
+
+    def next_deadline(self):
+        """Return the :func:`coapy.clock` time at which
+        :meth:`process_timeouts` next has work to do, or ``None`` if
+        no timeouts are scheduled."""
+        return self.__timer_wheel.next_deadline()
+
+    def process_timeouts(self, now=None):
+        """Invoke :meth:`MessageCacheEntry.process_timeout` on each
+        cache entry of this endpoint that is due at *now*, which
+        defaults to :func:`coapy.clock`.
+
+        Transmissions made while processing the entries are sent
+        together by :meth:`rawsendto_many`.  Returns the number of
+        entries processed."""
+        entries = self.__timer_wheel.expire(now)
+        if not entries:
+            return 0
+        batched = self.__begin_tx_batch()
+        try:
+            for entry in entries:
+                if entry.cache is not None:
+                    self._process_timeout(entry)
+        finally:
+            if batched:
+                self.__flush_tx_batch()
+        return len(entries)
+
+    def _process_timeout(self, entry):
+        """Process the timeout of *entry*, which is due and is still
+        in its cache.
+
+        This is invoked by :meth:`process_timeouts`.  Subclasses may
+        extend it to observe the effect of the timeout on *entry*.
+        """
+        entry.process_timeout()
+        # An entry that remains in its cache without having been
+        # rescheduled is still due.
+        wheel = self.__timer_wheel
+        if (entry.cache is not None) and not (entry in wheel):
+            wheel.schedule(entry)
+
     def _reset(self):
         """Return all data to its initial state.
         """
         self._reset_next_messageID(random.randint(0, 65535))
-        self._sent_cache = MessageCache(self, True)
+        self.__timer_wheel = coapy.util.TimerWheel(self.TIMER_GRANULARITY)
+        self._sent_cache = MessageCache(self, True, self.__timer_wheel)
         self.__remote_state = {}
         super(LocalEndpoint, self)._reset()
 
@@ -1349,14 +1594,83 @@ class LocalEndpoint(Endpoint):
         instance of :class:`Endpoint`.
 
         This method delegates to a subclass implementation of
-        :meth:`_rawsendto`.
+        :meth:`_rawsendto`.  While :meth:`receive_many` or
+        :meth:`process_timeouts` is in progress *data* is instead
+        queued, to be sent with the rest of the batch by
+        :meth:`rawsendto_many` when that operation completes; failures
+        to send queued datagrams are logged rather than raised.
         """
+        batch = self.__tx_batch
+        if batch is not None:
+            batch.append((data, destination_endpoint))
+            return len(data)
         rv = self._rawsendto(data, destination_endpoint)
+        self.__count_sent(data, destination_endpoint)
+        return rv
+
+    def __count_sent(self, data, destination_endpoint):
         state = self.remote_state(destination_endpoint)
         state.tx_messages += 1
         state.tx_octets += len(data)
         state.tx_octets_since_heard += len(data)
-        return rv
+
+    def _rawsendto_many(self, datagrams):
+        """Send each ``(data, destination_endpoint)`` in the list
+        *datagrams* from this endpoint, in order.
+
+        Returns the number of datagrams sent, which are the leading
+        elements of *datagrams*.  An exception is raised only if none
+        could be sent.  The default implementation invokes
+        :meth:`_rawsendto` for each datagram; subclasses may override
+        this to send several datagrams in one operation.
+        """
+        for (sent, (data, destination_endpoint)) in enumerate(datagrams):
+            try:
+                self._rawsendto(data, destination_endpoint)
+            except Exception:
+                if 0 == sent:
+                    raise
+                return sent
+        return len(datagrams)
+
+    def rawsendto_many(self, datagrams):
+        """Send each ``(data, destination_endpoint)`` in *datagrams*
+        as with :meth:`rawsendto`, in order.
+
+        This method delegates to a subclass implementation of
+        :meth:`_rawsendto_many`.  Returns the number of datagrams
+        sent.
+        """
+        datagrams = list(datagrams)
+        sent = self._rawsendto_many(datagrams) if datagrams else 0
+        for (data, destination_endpoint) in datagrams[:sent]:
+            self.__count_sent(data, destination_endpoint)
+        return sent
+
+    # The list of datagrams queued by rawsendto during a batched
+    # operation, or None when none is in progress.
+    __tx_batch = None
+
+    def __begin_tx_batch(self):
+        if self.__tx_batch is not None:
+            return False
+        self.__tx_batch = []
+        return True
+
+    def __flush_tx_batch(self):
+        # Send the queued datagrams.  This runs as a batched operation
+        # completes, possibly while an exception propagates, so a
+        # datagram that cannot be sent is logged and dropped and the
+        # rest of the batch is still sent.
+        batch = self.__tx_batch
+        self.__tx_batch = None
+        while batch:
+            try:
+                sent = self.rawsendto_many(batch)
+            except Exception:
+                _log.exception('send to {0!s}'.format(batch[0][1]))
+                sent = 1
+            batch = batch[sent:]
 
     def _rawrecvfrom(self, bufsize):
         """Receive *data* from a *source_endpoint*.
@@ -1386,20 +1700,49 @@ class LocalEndpoint(Endpoint):
         :meth:`_rawrecvfrom`.
         """
         (data, source_endpoint) = self._rawrecvfrom(bufsize)
+        self.__count_received(data, source_endpoint)
+        return (data, source_endpoint)
+
+    def __count_received(self, data, source_endpoint):
         state = self.remote_state(source_endpoint)
         state.rx_messages += 1
         state.rx_octets += len(data)
         state.last_heard_clk = coapy.clock()
         state.tx_octets_since_heard = 0
-        return (data, source_endpoint)
+
+    def _rawrecvfrom_many(self, bufsize, max_batch):
+        """Receive up to *max_batch* datagrams.
+
+        Returns a list of ``(data, source_endpoint)`` tuples as from
+        :meth:`_rawrecvfrom`.  The first datagram is obtained as with
+        :meth:`_rawrecvfrom`, including its blocking and exception
+        behavior; subsequent datagrams are returned only if they are
+        available without waiting.  The default implementation returns
+        only the first datagram, and subclasses that can tell whether
+        more are available should override it.
+        """
+        return [self._rawrecvfrom(bufsize)]
+
+    def rawrecvfrom_many(self, max_batch=32, bufsize=2048):
+        """Receive up to *max_batch* datagrams from other endpoints.
+
+        Returns a list of ``(data, source_endpoint)`` tuples as from
+        :meth:`rawrecvfrom`, of which there is at least one.  This
+        method delegates to a subclass implementation of
+        :meth:`_rawrecvfrom_many`.
+        """
+        datagrams = self._rawrecvfrom_many(bufsize, max_batch)
+        for (data, source_endpoint) in datagrams:
+            self.__count_received(data, source_endpoint)
+        return datagrams
 
     def receive(self):
         """Receive and decode a message from another endpoint.
 
         Returns ``None`` if the message is so corrupt it should be
-        ignored, or if the received message is a duplicate.  Raises
-        :exc:`coapy.message.MessageFormatError` if the message cannot
-        be fully decoded.  Otherwise returns the message, in which
+        ignored, if it cannot be fully decoded (see
+        :attr:`RemoteEndpointState.rx_malformed`), or if the received
+        message is a duplicate.  Otherwise returns the message, in which
         :attr:`destination_endpoint<coapy.message.Message.destination_endpoint>`
         will be set to *self* and
         :attr:`source_endpoint<coapy.message.Message.source_endpoint>`
@@ -1408,51 +1751,102 @@ class LocalEndpoint(Endpoint):
         Any message-layer processing (e.g. re-sending duplicate ACK or
         RST, or sending a RST due to a message format error) will have
         been done before this call returns.
+
+        Duplicates and replies to unrecognized Message IDs are
+        identified from the :func:`header<coapy.message.peek_header>`
+        alone and are discarded without decoding the options or
+        payload; see
+        :attr:`RemoteEndpointState.rx_decodes_avoided`.
         """
-        m = None
-        dkw = None
         (data, source_endpoint) = self.rawrecvfrom(8192)
+        return self.__process_datagram(data, source_endpoint)
+
+    def receive_many(self, max_batch=32):
+        """Receive and decode up to *max_batch* messages.
+
+        The datagrams are obtained by :meth:`rawrecvfrom_many`, so at
+        least one is received and exceptions are as with
+        :meth:`rawrecvfrom`.  Each is processed as by :meth:`receive`,
+        and the :class:`RcvdMessageCacheEntry` instances for new
+        messages are returned in a list.  Message-layer replies made
+        while processing the batch are sent together by
+        :meth:`rawsendto_many` before this returns.
+
+        An exception raised while processing one datagram is logged,
+        and does not prevent processing of the rest of the batch.
+        """
+        datagrams = self.rawrecvfrom_many(max_batch, 8192)
+        entries = []
+        batched = self.__begin_tx_batch()
         try:
-            m = coapy.message.Message.from_packed(data)
-            m.destination_endpoint = self
-            m.source_endpoint = source_endpoint
-        except coapy.message.MessageFormatError as e:
-            _log.exception('receive')
-            dkw = e.args[1]
-        if m is None:
-            mid = dkw['messageID']
-            mtype = dkw['type']
-        else:
-            mid = m.messageID
-            mtype = m.messageType
-        local_origin = not coapy.message.Message.source_originates_type(mtype)
+            for (data, source_endpoint) in datagrams:
+                try:
+                    entry = self.__process_datagram(data, source_endpoint)
+                except Exception:
+                    _log.exception('receive from {0!s}'.format(source_endpoint))
+                    continue
+                if entry is not None:
+                    entries.append(entry)
+        finally:
+            if batched:
+                self.__flush_tx_batch()
+        return entries
+
+    def __process_datagram(self, data, source_endpoint):
+        hdr = coapy.message.peek_header(data)
+        if (hdr is None) or (hdr.version != coapy.message.Message.Ver):
+            # 3: silently ignore without decoding the rest
+            return None
+        # Everything that can be decided from the Message ID is
+        # decided before the options and payload are decoded.
+        mid = hdr.messageID
+        src_state = self.remote_state(source_endpoint)
+        local_origin = not coapy.message.Message.source_originates_type(hdr.type)
         if local_origin:
             # local_origin means ACK or RST; look in send cache.
             ce = self._sent_cache.get(mid)
             if ce is None:
                 _log.error('Reply to unrecognized message')
+                src_state.rx_decodes_avoided += 1
                 return None
-            if m is None:
-                _log.error('Invalid reply to message')
+        else:
+            # not local origin means CON or NON; look in received
+            # message cache from the source endpoint.
+            rx_cache = src_state.rcvd_cache
+            ce = rx_cache.get(mid)
+            if ce is not None:
+                _log.info('Received duplicate')
+                src_state.rx_duplicates += 1
+                src_state.rx_decodes_avoided += 1
+                ce._process_duplicate()
                 return None
-            ce.process_reply(m)
+        try:
+            m = coapy.message.Message.from_packed(data)
+        except (coapy.message.MessageFormatError, ValueError):
+            # ValueError includes UnicodeDecodeError from option
+            # values that are not valid UTF-8.
+            _log.exception('receive')
+            src_state.rx_malformed += 1
+            if local_origin:
+                _log.error('Invalid reply to message')
+            elif coapy.message.Message.Type_CON == hdr.type:
+                # 4.2: reject a malformed confirmable message
+                self.rawsendto(_pack_empty_reply(mid, True), source_endpoint)
             return None
-        # not local origin means CON or NON; look in received message cache
-        # from the source endpoint.
-        src_state = self.remote_state(source_endpoint)
-        rx_cache = src_state.rcvd_cache
-        ce = rx_cache.get(mid)
-        if ce is not None:
-            _log.error('Received duplicate')
+        m.destination_endpoint = self
+        m.source_endpoint = source_endpoint
+        if local_origin:
+            ce.process_reply(m)
             return None
-        if m is None:
-            _log.error('Need send RST')
         return RcvdMessageCacheEntry(rx_cache, m)
 
     def send(self, msg, destination_endpoint=None):
         """Send *msg* to *destination_endpoint*.
 
-        *msg* must be an instance of :class:`coapy.message.Message`.
+        *msg* must be an instance of :class:`coapy.message.Message`,
+        or a :class:`coapy.message.RequestTemplate` from which a
+        request with an empty token and no payload will be
+        :meth:`created<coapy.message.RequestTemplate.create_request>`.
 
         *destination_endpoint* specifies where the packed message will
         be sent and defaults to *msg*'s
@@ -1461,6 +1855,8 @@ class LocalEndpoint(Endpoint):
         The return value is the :class:`SentMessageCacheEntry` that
         has message-level transmission state.
         """
+        if isinstance(msg, coapy.message.RequestTemplate):
+            msg = msg.create_request()
         if not isinstance(msg, coapy.message.Message):
             raise TypeError(msg)
         if destination_endpoint is None:
@@ -1474,6 +1870,153 @@ class LocalEndpoint(Endpoint):
         return ce
 
 
+# Linux recvmmsg(2) and sendmmsg(2), through ctypes.  _recvmmsg and
+# _sendmmsg are None where these are unavailable, in which case
+# SocketEndpoint batches fall back to a loop over recvfrom and sendto.
+_recvmmsg = None
+_sendmmsg = None
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', None)
+try:
+    import ctypes
+    import ctypes.util
+
+    class _iovec (ctypes.Structure):
+        _fields_ = [(str('iov_base'), ctypes.c_void_p),
+                    (str('iov_len'), ctypes.c_size_t)]
+
+    class _msghdr (ctypes.Structure):
+        _fields_ = [(str('msg_name'), ctypes.c_void_p),
+                    (str('msg_namelen'), ctypes.c_uint32),
+                    (str('msg_iov'), ctypes.POINTER(_iovec)),
+                    (str('msg_iovlen'), ctypes.c_size_t),
+                    (str('msg_control'), ctypes.c_void_p),
+                    (str('msg_controllen'), ctypes.c_size_t),
+                    (str('msg_flags'), ctypes.c_int)]
+
+    class _mmsghdr (ctypes.Structure):
+        _fields_ = [(str('msg_hdr'), _msghdr),
+                    (str('msg_len'), ctypes.c_uint)]
+
+    if sys.platform.startswith('linux') and (_MSG_DONTWAIT is not None):
+        _libc = ctypes.CDLL(ctypes.util.find_library(str('c')), use_errno=True)
+        _recvmmsg = _libc.recvmmsg
+        _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                              ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        _recvmmsg.restype = ctypes.c_int
+        _sendmmsg = _libc.sendmmsg
+        _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                              ctypes.c_uint, ctypes.c_int]
+        _sendmmsg.restype = ctypes.c_int
+except (ImportError, OSError, AttributeError, TypeError):
+    _recvmmsg = None
+    _sendmmsg = None
+
+# Linux MSG_WAITFORONE: after the first datagram, recvmmsg does not
+# wait for more.
+_MSG_WAITFORONE = 0x10000
+# Room for a struct sockaddr_in6.
+_SOCKADDR_SIZE = 28
+# sa_family is in host order, the port and IPv4 address in network
+# order, and sin6_scope_id in host order.
+_sockaddr_family = struct.Struct(str('=H'))
+_sockaddr_in = struct.Struct(str('!H4s8x'))
+_sockaddr_in6 = struct.Struct(str('!HI16s'))
+_sockaddr_scope_id = struct.Struct(str('=I'))
+
+
+def _mmsg_error():
+    err = ctypes.get_errno()
+    return socket.error(err, os.strerror(err))
+
+
+def _pack_sockaddr(family, sockaddr):
+    addr = socket.inet_pton(family, sockaddr[0])
+    if socket.AF_INET == family:
+        return _sockaddr_family.pack(family) + _sockaddr_in.pack(sockaddr[1], addr)
+    flowinfo = scope_id = 0
+    if 4 <= len(sockaddr):
+        (flowinfo, scope_id) = sockaddr[2:4]
+    return (_sockaddr_family.pack(family)
+            + _sockaddr_in6.pack(sockaddr[1], flowinfo, addr)
+            + _sockaddr_scope_id.pack(scope_id))
+
+
+def _unpack_sockaddr(data):
+    (family,) = _sockaddr_family.unpack_from(data)
+    offset = _sockaddr_family.size
+    if socket.AF_INET == family:
+        (port, addr) = _sockaddr_in.unpack_from(data, offset)
+        return (socket.inet_ntop(family, addr), port)
+    (port, flowinfo, addr) = _sockaddr_in6.unpack_from(data, offset)
+    (scope_id,) = _sockaddr_scope_id.unpack_from(data, offset + _sockaddr_in6.size)
+    return (socket.inet_ntop(family, addr), port, flowinfo, scope_id)
+
+
+class _RecvmmsgBuffers (object):
+    # The recvmmsg arguments for up to count datagrams of at most
+    # bufsize octets, allocated once and reused for each call.
+
+    def __init__(self, count, bufsize):
+        self.count = count
+        self.bufsize = bufsize
+        self.__msgs = (_mmsghdr * count)()
+        self.__iovs = (_iovec * count)()
+        self.__data = ctypes.create_string_buffer(count * bufsize)
+        self.__names = ctypes.create_string_buffer(count * _SOCKADDR_SIZE)
+        data = ctypes.addressof(self.__data)
+        names = ctypes.addressof(self.__names)
+        for i in xrange(count):
+            self.__iovs[i].iov_base = data + i * bufsize
+            self.__iovs[i].iov_len = bufsize
+            hdr = self.__msgs[i].msg_hdr
+            hdr.msg_name = names + i * _SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self.__iovs[i])
+            hdr.msg_iovlen = 1
+
+    def recv(self, sock, count, flags):
+        """Receive up to *count* datagrams from *sock* in one recvmmsg
+        call.  Returns a list of ``(data, addr)``; raises
+        :exc:`python:socket.error` on failure."""
+        msgs = self.__msgs
+        for i in xrange(count):
+            msgs[i].msg_hdr.msg_namelen = _SOCKADDR_SIZE
+        rv = _recvmmsg(sock.fileno(), msgs, count, flags, None)
+        if 0 > rv:
+            raise _mmsg_error()
+        data = ctypes.addressof(self.__data)
+        names = ctypes.addressof(self.__names)
+        return [(ctypes.string_at(data + _i * self.bufsize, msgs[_i].msg_len),
+                 _unpack_sockaddr(ctypes.string_at(names + _i * _SOCKADDR_SIZE,
+                                                   _SOCKADDR_SIZE)))
+                for _i in xrange(rv)]
+
+
+def _sendmmsg_batch(sock, family, datagrams):
+    """Send the ``(data, sockaddr)`` pairs in *datagrams* from *sock*
+    in one sendmmsg call.  Returns the number sent; raises
+    :exc:`python:socket.error` if none could be sent."""
+    count = len(datagrams)
+    msgs = (_mmsghdr * count)()
+    iovs = (_iovec * count)()
+    keep = []
+    for (i, (data, sockaddr)) in enumerate(datagrams):
+        data = ctypes.create_string_buffer(data, len(data))
+        name = _pack_sockaddr(family, sockaddr)
+        name = ctypes.create_string_buffer(name, len(name))
+        keep.append((data, name))
+        iovs[i].iov_base = ctypes.cast(data, ctypes.c_void_p)
+        iovs[i].iov_len = len(data)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+        hdr.msg_namelen = len(name)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+    rv = _sendmmsg(sock.fileno(), msgs, count, 0)
+    if 0 > rv:
+        raise _mmsg_error()
+    return rv
+
+
 class SocketEndpoint (LocalEndpoint):
     """An endpoint that has a Python :func:`python:socket.socket`
     bound to it to be used for network communications.
@@ -1555,6 +2098,85 @@ class SocketEndpoint (LocalEndpoint):
         (data, addr) = self.bound_socket.recvfrom(bufsize)
         return (data, Endpoint(sockaddr=addr, family=self.family))
 
+    SENDMMSG_LIMIT = 1024
+    """The maximum number of datagrams passed to a single
+    :manpage:`sendmmsg(2)` call by :meth:`_rawsendto_many`."""
+
+    def __mmsg_socket(self):
+        # The bound socket if the batched system calls can be used on
+        # it, otherwise None.
+        sock = self.bound_socket
+        if ((_recvmmsg is None)
+                or not isinstance(sock, socket.socket)
+                or (self.family not in (socket.AF_INET, socket.AF_INET6))):
+            return None
+        return sock
+
+    def _rawsendto_many(self, datagrams):
+        """Send each ``(data, destination_endpoint)`` in *datagrams*.
+
+        On Linux this uses :manpage:`sendmmsg(2)` on
+        :attr:`bound_socket` to send up to :attr:`SENDMMSG_LIMIT`
+        datagrams per system call; elsewhere it falls back to
+        :meth:`_rawsendto` for each datagram.  Returns the number of
+        datagrams sent.  :exc:`python:socket.error` is raised only if
+        none could be sent.
+        """
+        sock = self.__mmsg_socket()
+        if sock is None:
+            return super(SocketEndpoint, self)._rawsendto_many(datagrams)
+        pending = [(_d, _ep.sockaddr) for (_d, _ep) in datagrams]
+        sent = 0
+        while sent < len(pending):
+            batch = pending[sent:sent + self.SENDMMSG_LIMIT]
+            try:
+                sent += _sendmmsg_batch(sock, self.family, batch)
+            except socket.error:
+                if 0 == sent:
+                    raise
+                break
+        return sent
+
+    # recvmmsg buffers reused across _rawrecvfrom_many calls.
+    __recv_buffers = None
+
+    def __recvmmsg(self, sock, bufsize, count, flags):
+        buffers = self.__recv_buffers
+        if (buffers is None) or (buffers.count < count) or (buffers.bufsize < bufsize):
+            buffers = self.__recv_buffers = _RecvmmsgBuffers(count, bufsize)
+        return buffers.recv(sock, count, flags)
+
+    def _rawrecvfrom_many(self, bufsize, max_batch):
+        """Receive up to *max_batch* datagrams from
+        :attr:`bound_socket`.
+
+        The first datagram is received subject to the blocking mode
+        and timeout of the socket, as with :meth:`_rawrecvfrom`; the
+        remainder are those already waiting.  On Linux these are read
+        with :manpage:`recvmmsg(2)`, in a single system call if the
+        socket is non-blocking, into buffers that are allocated once
+        and reused by later calls; elsewhere with a sequence of
+        non-blocking :meth:`recvfrom<python:socket.socket.recvfrom>`
+        calls.
+        """
+        sock = self.__mmsg_socket()
+        if (sock is not None) and (0.0 == sock.gettimeout()):
+            rv = self.__recvmmsg(sock, bufsize, max_batch, _MSG_WAITFORONE)
+        else:
+            sock = self.bound_socket
+            rv = [sock.recvfrom(bufsize)]
+            try:
+                if 1 >= max_batch:
+                    pass
+                elif self.__mmsg_socket() is not None:
+                    rv.extend(self.__recvmmsg(sock, bufsize, max_batch - 1, _MSG_DONTWAIT))
+                elif (_MSG_DONTWAIT is not None) and isinstance(sock, socket.socket):
+                    while len(rv) < max_batch:
+                        rv.append(sock.recvfrom(bufsize, _MSG_DONTWAIT))
+            except socket.error:
+                pass
+        return [(_d, Endpoint(sockaddr=_a, family=self.family)) for (_d, _a) in rv]
+
     @classmethod
     def create_bound_endpoint(cls, sockaddr=None, family=socket.AF_UNSPEC,
                               security_mode=None,
@@ -1599,4 +2221,201 @@ class SocketEndpoint (LocalEndpoint):
             except:
                 pass
             self.__bound_socket = None
+        self.__recv_buffers = None
         super(SocketEndpoint, self)._reset()
+
+
+# Wait for input on a set of file descriptors, using the most capable
+# mechanism available.  Timeouts are in seconds, with None meaning
+# wait indefinitely.
+class _Poller (object):
+    def __init__(self):
+        self.__fds = set()
+        if hasattr(select, 'epoll'):
+            self.__poll = select.epoll()
+            self.__wait = self.__wait_epoll
+        elif hasattr(select, 'poll'):
+            self.__poll = select.poll()
+            self.__wait = self.__wait_poll
+        else:
+            self.__poll = None
+            self.__wait = self.__wait_select
+
+    def register(self, fd):
+        if self.__poll is not None:
+            if hasattr(select, 'epoll'):
+                self.__poll.register(fd, select.EPOLLIN)
+            else:
+                self.__poll.register(fd, select.POLLIN)
+        self.__fds.add(fd)
+
+    def unregister(self, fd):
+        if self.__poll is not None:
+            self.__poll.unregister(fd)
+        self.__fds.discard(fd)
+
+    def wait(self, timeout):
+        """Return the registered descriptors that are readable."""
+        try:
+            return self.__wait(timeout)
+        except (select.error, IOError) as e:
+            if errno.EINTR != e.args[0]:
+                raise
+        return []
+
+    def __wait_epoll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        else:
+            # epoll.poll truncates its timeout to whole milliseconds,
+            # which would wake before the deadline.  Round up as in
+            # __wait_poll; the extra half millisecond keeps the
+            # truncated product from falling just short of it.
+            timeout = (math.ceil(1000 * timeout) + 0.5) / 1000
+        return [_fd for (_fd, _ev) in self.__poll.poll(timeout)]
+
+    def __wait_poll(self, timeout):
+        if timeout is not None:
+            timeout = int(math.ceil(1000 * timeout))
+        return [_fd for (_fd, _ev) in self.__poll.poll(timeout)]
+
+    def __wait_select(self, timeout):
+        return select.select(list(self.__fds), [], [], timeout)[0]
+
+
+class EndpointLoop (object):
+    """An event loop that drives message reception and timeouts for
+    any number of :class:`SocketEndpoint` instances.
+
+    Each pass through the loop (:meth:`run_once`) processes the
+    timeouts that are due on every endpoint, waits until a
+    :attr:`bound_socket<SocketEndpoint.bound_socket>` is readable or
+    the next timeout is due, then receives every datagram that is
+    waiting on each readable socket.  Waiting uses
+    :func:`python:select.epoll` where available, otherwise
+    :func:`python:select.poll` or :func:`python:select.select`, so an
+    idle loop does not consume processor time.
+
+    Messages are received in batches through
+    :meth:`LocalEndpoint.receive_many`, and each
+    :class:`RcvdMessageCacheEntry` it returns is passed to the handler
+    provided when the endpoint was :meth:`added<add>`.
+    Timeouts are processed through
+    :meth:`LocalEndpoint.process_timeouts`, which also transmits
+    messages queued by :meth:`LocalEndpoint.send`.
+
+    Deadlines are in the units of :func:`coapy.clock`, which are
+    assumed to be seconds.
+    """
+
+    def __init__(self):
+        self.__poller = _Poller()
+        self.__handlers = {}
+        self.__by_fd = {}
+        self.__running = False
+
+    @property
+    def endpoints(self):
+        """A list of the endpoints that have been :meth:`added<add>`."""
+        return list(self.__handlers)
+
+    def add(self, endpoint, handler=None):
+        """Add *endpoint* to the loop.
+
+        *endpoint* must be a :class:`SocketEndpoint` with a
+        :attr:`bound_socket<SocketEndpoint.bound_socket>`, which is
+        made non-blocking.  *handler*, if not ``None``, is invoked
+        with each :class:`RcvdMessageCacheEntry` received by the
+        endpoint."""
+        if not isinstance(endpoint, SocketEndpoint):
+            raise TypeError(endpoint)
+        sock = endpoint.bound_socket
+        if sock is None:
+            raise ValueError(endpoint)
+        if endpoint in self.__handlers:
+            raise ValueError(endpoint)
+        sock.setblocking(0)
+        fd = sock.fileno()
+        self.__poller.register(fd)
+        self.__by_fd[fd] = endpoint
+        self.__handlers[endpoint] = handler
+
+    def remove(self, endpoint):
+        """Remove *endpoint* from the loop.  Its socket is left
+        non-blocking."""
+        del self.__handlers[endpoint]
+        for (fd, ep) in list(self.__by_fd.items()):
+            if ep is endpoint:
+                self.__poller.unregister(fd)
+                del self.__by_fd[fd]
+
+    def next_deadline(self):
+        """Return the earliest :meth:`LocalEndpoint.next_deadline` of
+        the endpoints in the loop, or ``None`` if no timeouts are
+        scheduled."""
+        deadlines = [_d for _d in (_ep.next_deadline() for _ep in self.__handlers)
+                     if _d is not None]
+        if not deadlines:
+            return None
+        return min(deadlines)
+
+    def process_timeouts(self):
+        """Process the due timeouts of every endpoint.  Returns the
+        number of cache entries processed."""
+        return sum(_ep.process_timeouts() for _ep in list(self.__handlers))
+
+    def receive(self, endpoint):
+        """Receive every datagram waiting for *endpoint*, passing each
+        new message to its handler.  Returns the number of new
+        messages received."""
+        handler = self.__handlers[endpoint]
+        count = 0
+        while True:
+            try:
+                entries = endpoint.receive_many()
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    _log.warning('receive on {0!s}: {1!s}'.format(endpoint, e))
+                break
+            except Exception:
+                _log.exception('receive on {0!s}'.format(endpoint))
+                break
+            count += len(entries)
+            if handler is not None:
+                for entry in entries:
+                    try:
+                        handler(entry)
+                    except Exception:
+                        _log.exception('handler for {0!s}'.format(endpoint))
+        return count
+
+    def run_once(self, timeout=None):
+        """Perform one pass through the loop.
+
+        The wait for input is limited to the time until the next
+        deadline, and to *timeout* seconds if it is not ``None``.
+        Returns the number of new messages received."""
+        self.process_timeouts()
+        deadline = self.next_deadline()
+        if deadline is not None:
+            delay = max(0, deadline - coapy.clock())
+            if (timeout is None) or (delay < timeout):
+                timeout = delay
+        count = 0
+        for fd in self.__poller.wait(timeout):
+            endpoint = self.__by_fd.get(fd)
+            if endpoint is not None:
+                count += self.receive(endpoint)
+        self.process_timeouts()
+        return count
+
+    def run(self):
+        """Run the loop until :meth:`stop` is invoked or no endpoints
+        remain."""
+        self.__running = True
+        while self.__running and self.__handlers:
+            self.run_once()
+
+    def stop(self):
+        """Cause :meth:`run` to return after the current pass."""
+        self.__running = False
@@ -27,12 +27,40 @@ from __future__ import division
 import logging
 _log = logging.getLogger(__name__)
 
+import collections
 import random
 import struct
 import coapy
 import coapy.option
 import coapy.util
 
+# Pre-compiled accessor for the fixed four-octet message header.
+_unpack_header = struct.Struct(str('!BBH')).unpack_from
+_pack_header_into = struct.Struct(str('!BBH')).pack_into
+
+# The ``(class, detail)`` tuple for each packed code, so that decoding
+# a code is a simple index operation.
+_code_tuples = tuple((_c >> 5, _c & 0x1F) for _c in xrange(256))
+
+# coapy.endpoint imports this module, so its Endpoint class is
+# resolved on first use rather than when this module is loaded.
+_Endpoint = None
+
+
+def _endpoint_class():
+    global _Endpoint
+    if _Endpoint is None:
+        import coapy.endpoint
+        _Endpoint = coapy.endpoint.Endpoint
+    return _Endpoint
+
+# Numbers of options that may not appear in a request together with
+# coapy.option.ProxyUri.
+_proxy_conflict_numbers = frozenset((coapy.option.UriHost.number,
+                                     coapy.option.UriPort.number,
+                                     coapy.option.UriPath.number,
+                                     coapy.option.UriQuery.number))
+
 
 class MessageError (coapy.CoAPyException):
     pass
@@ -124,6 +152,11 @@ class MessageFormatError (MessageError):
     field.
     """
 
+    TOKEN_TRUNCATED = 'token truncated'
+    """*diagnostic* value when the message ends before the number of
+    token octets specified by the TKL field.
+    """
+
     UNRECOGNIZED_CODE_CLASS = 'unrecognized code class'
     """*diagnostic* when the :attr:`code<Message.code>` has no generic
     handler (e.g. the message code class is 1, 6, and 7 which are
@@ -174,6 +207,28 @@ class Message(object):
 
     __metaclass__ = coapy.util.ReadOnlyMeta
 
+    # Messages are held in large numbers by endpoint caches, so their
+    # instances have no __dict__.  Subclasses must also define
+    # __slots__.
+    #
+    # __packed_options: For messages decoded lazily, a tuple ``(block,
+    # index)`` where *block* is the packed option block as
+    # :class:`bytes` and *index* the result of
+    # coapy.option.index_options_from on *block*.  Set only while
+    # __options is None.
+    #
+    # __packed: Cached result of to_packed() as a tuple ``(packed,
+    # options_key)`` where *options_key* is the value of
+    # __options_key() when *packed* was generated.  Cleared by the
+    # property setters.
+    #
+    # __validated: The value of __options_key() when validate() last
+    # succeeded, or None if it has not succeeded since the message was
+    # changed.
+    __slots__ = ('__type', '__code', '__messageID', '__token', '__options',
+                 '__packed_options', '__payload', '__packed', '__validated',
+                 '__source_endpoint', '__destination_endpoint')
+
     CodeClass = None
     """Identifier for message class.
 
@@ -202,9 +257,22 @@ class Message(object):
             self.name = name
             self.constructor = constructor
 
-    # Registry from code tuples to assorted information about messages
-    # with that code.
-    __CodeRegistry = {}
+    # Registry from packed codes to assorted information about
+    # messages with that code.  Entries are None for unregistered
+    # codes.
+    __CodeRegistry = [None] * 256
+
+    # Registry from code classes to the primary Python type used for
+    # messages in that class.  This is for fall-backs when the details
+    # is unrecognized but we still have to do class-specific actions
+    # on the message.
+    __CodeClassRegistry = [None] * 8
+
+    # The constructor for each packed code: that of the registered
+    # code if any, else that of the code class.  Maintained by
+    # RegisterCode and RegisterClassCode so that decoding need not
+    # consult the registries.
+    __ConstructorTable = [None] * 256
 
     @classmethod
     def RegisterClassCode(cls, clazz, constructor=None):
@@ -212,17 +280,19 @@ class Message(object):
         *class*.
 
         This is used when no more specific information can be resolved
-        by using the *details* field of the message code.
+        by using the *details* field of the message code.  The
+        constructor defaults to *cls* if not provided.
         """
         if not isinstance(clazz, int):
             raise TypeError
-        cls.__CodeClassRegistry[clazz] = cls
-
-    # Registry from code classes to the primary Python type used for
-    # messages in that class.  This is for fall-backs when the details
-    # is unrecognized but we still have to do class-specific actions
-    # on the message.
-    __CodeClassRegistry = {}
+        if not ((0 <= clazz) and (clazz <= 7)):
+            raise ValueError(clazz)
+        if constructor is None:
+            constructor = cls
+        cls.__CodeClassRegistry[clazz] = constructor
+        for pc in xrange(clazz << 5, (clazz + 1) << 5):
+            if cls.__CodeRegistry[pc] is None:
+                cls.__ConstructorTable[pc] = constructor
 
     @classmethod
     def RegisterCode(cls, code, name, constructor=None):
@@ -248,25 +318,24 @@ class Message(object):
         assert code == cls.code_as_tuple(code)
         if constructor is None:
             constructor = cls
-        if code in cls.__CodeRegistry:
+        pc = cls.code_as_integer(code)
+        if cls.__CodeRegistry[pc] is not None:
             raise ValueError(code)
         if cls.CodeClass is not None:
             if code[0] != cls.CodeClass:
                 raise ValueError(code)
-            if code[0] not in cls.__CodeClassRegistry:
+            if cls.__CodeClassRegistry[code[0]] is None:
                 cls.RegisterClassCode(cls.CodeClass, cls)
-        cls.__CodeRegistry[code] = cls._CodeSupport(code, name, constructor)
+        cls.__CodeRegistry[pc] = cls._CodeSupport(code, name, constructor)
+        cls.__ConstructorTable[pc] = constructor
 
     @classmethod
     def _code_support(cls, code):
-        return cls.__CodeRegistry.get(cls.code_as_tuple(code))
+        return cls.__CodeRegistry[cls.code_as_integer(code)]
 
     @classmethod
     def _type_for_code(cls, code):
-        cs = cls._code_support(code)
-        if cs is not None:
-            return cs.constructor
-        return cls.__CodeClassRegistry.get(code[0])
+        return cls.__ConstructorTable[cls.code_as_integer(code)]
 
     def code_support(self):
         return self._code_support(self.code)
@@ -371,6 +440,10 @@ class Message(object):
     @staticmethod
     def code_as_tuple(code):
         """Validate *code* and return it as a ``(class, detail)`` tuple."""
+        if isinstance(code, int):
+            if (0 > code) or (255 < code):
+                raise ValueError(code)
+            return _code_tuples[code]
         if isinstance(code, tuple):
             if 2 != len(code):
                 raise ValueError(code)
@@ -379,10 +452,6 @@ class Message(object):
                 raise ValueError(code)
             if not (0 <= detail and detail <= 31):
                 raise ValueError(code)
-        elif isinstance(code, int):
-            if (0 > code) or (255 < code):
-                raise ValueError(code)
-            code = (code >> 5, code & 0x1F)
         else:
             raise TypeError(code)
         return code
@@ -395,6 +464,10 @@ class Message(object):
         class combined with the 5-bit code detail, as: ``(class << 5)
         | detail``.
         """
+        if isinstance(code, int):
+            if (0 > code) or (255 < code):
+                raise ValueError(code)
+            return code
         (clazz, detail) = Message.code_as_tuple(code)
         return (clazz << 5) | detail
 
@@ -415,6 +488,8 @@ class Message(object):
 
     def _set_code(self, code):
         self.__code = self.code_as_tuple(code)
+        self.__packed = None
+        self.__validated = None
 
     code = property(_get_code, _set_code)
 
@@ -447,6 +522,8 @@ class Message(object):
         if not ((0 <= message_id) and (message_id <= 65535)):
             raise ValueError(message_id)
         self.__messageID = message_id
+        self.__packed = None
+        self.__validated = None
 
     messageID = property(_get_messageID, _set_messageID)
 
@@ -465,6 +542,8 @@ class Message(object):
         if len(token) > 8:
             raise ValueError(token)
         self.__token = token
+        self.__packed = None
+        self.__validated = None
 
     token = property(_get_token, _set_token)
 
@@ -474,22 +553,47 @@ class Message(object):
 
         Absence of options is represented by an empty list.  Elements
         of the list must be :class:`coapy.option.UrOption` (subclass)
-        instances.  The list object is owned by the message instance.
-        Assignment to it will replace its contents.  The contents will
-        be rearranged in a stable sort by option
-        :attr:`number<coapy.option.UrOption.number>` as needed by
-        operations performed on the message.
+        instances.  The list is a :class:`coapy.option.OptionList`
+        owned by the message instance.
+        Assignment to it will replace its contents.  The contents are
+        kept in a stable order by option
+        :attr:`number<coapy.option.UrOption.number>` as options are
+        added, so they need not be sorted when the message is
+        validated or encoded.
+
+        For a message decoded by :meth:`from_packed` with *lazy* set,
+        the option instances are created when this attribute is first
+        accessed.
         """
+        if self.__options is None:
+            self.__materialize_options()
         return self.__options
 
     def _set_options(self, value):
-        self.__options[:] = coapy.option.sorted_options(value)
+        if self.__options is None:
+            self.__options = coapy.option.OptionList()
+            self.__packed_options = None
+        self.__options[:] = value
+        self.__packed = None
+        self.__validated = None
 
     def _sort_options(self):
-        """Sort the :attr:`options` list and return a reference to it.
+        """Return a reference to the :attr:`options` list, which is
+        always in canonical order.
         """
-        self.__options[:] = coapy.option.sorted_options(self.__options)
-        return self.__options
+        return coapy.option._sort_options_in_place(self.options)
+
+    def __materialize_options(self):
+        (block, index) = self.__packed_options
+        self.__options = coapy.option.OptionList(coapy.option.options_from_index(block, index))
+        self.__packed_options = None
+
+    def options_materialized(self):
+        """``True`` unless this message was decoded by
+        :meth:`from_packed` with *lazy* set and its :attr:`options`
+        have not yet been accessed.
+        """
+        return self.__options is not None
 
     options = property(_get_options, _set_options)
 
@@ -529,11 +633,18 @@ class Message(object):
         if (payload is not None) and (0 == len(payload)):
             payload = None
         self.__payload = payload
+        self.__packed = None
+        self.__validated = None
 
     payload = property(_get_payload, _set_payload)
 
     def __init__(self, confirmable=False, acknowledgement=False, reset=False,
                  code=None, messageID=None, token=None, options=None, payload=None):
+        self.__packed = None
+        self.__validated = None
+        self.__packed_options = None
+        self.__source_endpoint = None
+        self.__destination_endpoint = None
         if confirmable:
             self.__type = self.Type_CON
         elif acknowledgement:
@@ -554,34 +665,110 @@ class Message(object):
             self.__token = b''
         else:
             self.token = token
-        self.__options = []
+        self.__options = coapy.option.OptionList()
         if options is not None:
             self.options = options
         self.payload = payload
 
+    def __options_key(self):
+        # Options may be added to or removed from the list in place,
+        # and their values may be changed, without going through a
+        # message setter.  Capture enough to detect that.
+        if self.__options is None:
+            return None
+        return tuple((_o, _o.value) for _o in self.__options)
+
     def to_packed(self):
         """Generate the packed representation of the message, per :coapsect:`3`.
 
-        The result is a :class:`bytes` instance.
+        The result is a :class:`bytes` instance.  It is retained by
+        the message, and is returned by subsequent calls until one of
+        the message properties or its options is changed, so
+        retransmitting a message does not re-encode it.
         """
 
+        options_key = self.__options_key()
+        if (self.__packed is not None) and (self.__packed[1] == options_key):
+            return self.__packed[0]
         vttkl = (1 << 6) | (self.__type << 4)
         vttkl |= 0x0F & len(self.__token)
         elements = []
         elements.append(struct.pack(str('!BBH'), vttkl, self.packed_code, self.messageID))
         elements.append(self.__token)
-        if self.options:
-            elements.append(coapy.option.encode_options(self.options))
+        if self.__options is None:
+            # Lazily decoded and not since modified: re-use the
+            # received option block.
+            elements.append(self.__packed_options[0])
+        elif self.__options:
+            elements.append(coapy.option.encode_options(self.__options))
         if self.__payload:
             elements.append(b'\xFF')
             elements.append(self.__payload)
-        return b''.join(elements)
+        packed = b''.join(elements)
+        self.__packed = (packed, options_key)
+        return packed
+
+    def pack_into(self, buffer, offset=0):
+        """Write the packed representation of the message into *buffer*.
+
+        *buffer* must be a writable object supporting the buffer
+        interface, such as a :class:`python:bytearray` or a
+        :class:`python:memoryview` of one, and is not resized.  The
+        octets produced by :meth:`to_packed` are written starting at
+        *offset*, without creating an intermediate :class:`bytes`
+        object unless one is already retained by the message.
+
+        Returns the number of octets written.  Raises
+        :exc:`ValueError<python:exceptions.ValueError>` if the message
+        does not fit in *buffer*.
+        """
+        view = memoryview(buffer)
+        end = len(view)
+        if (self.__packed is not None) and (self.__packed[1] == self.__options_key()):
+            packed = self.__packed[0]
+            nend = offset + len(packed)
+            if nend > end:
+                raise ValueError(buffer)
+            view[offset:nend] = packed
+            return len(packed)
+        start = offset
+        token = self.__token
+        nend = offset + 4 + len(token)
+        if nend > end:
+            raise ValueError(buffer)
+        vttkl = (1 << 6) | (self.__type << 4) | (0x0F & len(token))
+        _pack_header_into(view, offset, vttkl, self.packed_code, self.messageID)
+        view[offset + 4:nend] = token
+        offset = nend
+        if self.__options is None:
+            block = self.__packed_options[0]
+            nend = offset + len(block)
+            if nend > end:
+                raise ValueError(buffer)
+            view[offset:nend] = block
+            offset = nend
+        elif self.__options:
+            offset = coapy.option.encode_options_into(self.__options, view, offset)
+        payload = self.__payload
+        if payload:
+            nend = offset + 1 + len(payload)
+            if nend > end:
+                raise ValueError(buffer)
+            view[offset:offset + 1] = b'\xFF'
+            view[offset + 1:nend] = payload
+            offset = nend
+        return offset - start
 
     @classmethod
-    def from_packed(cls, packed_message):
+    def from_packed(cls, packed_message, lazy=False):
         """Create a :class:`Message` (or subclass) instance from the
         packed representation of a message, per :coapsect:`3`.
 
+        *packed_message* may be :class:`bytes`, a
+        :class:`python:bytearray`, or a :class:`python:memoryview`
+        (for example one referencing a receive buffer or a
+        memory-mapped capture file).  The data is decoded in place.
+
         This will return ``None`` if the first four octets cannot be
         successfully decoded; such messages should be silently ignored.
 
@@ -599,47 +786,65 @@ class Message(object):
         Otherwise it will return an instance of :class:`Message` or a
         refined subclass based on the :attr:`code` within the packed
         representation.
+
+        If *lazy* is ``True`` the header, token, and payload are decoded
+        and the option block is checked for structural errors, but the
+        :class:`coapy.option.UrOption` instances are not created until
+        :attr:`options` is first used (possibly indirectly, e.g. by
+        :meth:`validate`).  This saves the cost of decoding options
+        for messages that are dropped or routed based only on their
+        header or token.
         """
 
-        if not isinstance(packed_message, bytes):
+        if not isinstance(packed_message, (bytes, bytearray, memoryview)):
             raise TypeError(packed_message)
-        data = bytearray(packed_message)
-        vttkl = data.pop(0)
+        # Walk a single view of the data using offsets.  Only the
+        # token, the option values, and the payload are copied, each
+        # exactly once.
+        view = memoryview(packed_message)
+        end = len(view)
+        if 4 > end:
+            # 3: Too short to hold the fixed header: silently ignore
+            return None
+        (vttkl, packed_code, message_id) = _unpack_header(view, 0)
         ver = (vttkl >> 6)
         if ver != cls.Ver:
             # 3: Unknown version number: silently ignore
             return None
         message_type = 0x03 & (vttkl >> 4)
         tkl = 0x0F & vttkl
-        code = cls.code_as_tuple(data.pop(0))
-        message_id = data.pop(0)
-        message_id = (message_id << 8) | data.pop(0)
+        code = _code_tuples[packed_code]
         dkw = {'type': message_type,
                'code': code,
                'messageID': message_id}
         if 9 <= tkl:
             raise MessageFormatError(MessageFormatError.TOKEN_TOO_LONG, dkw)
-        if ((cls.Empty == code) and ((0 != tkl) or (0 < len(data)))):
+        if ((cls.Empty == code) and ((0 != tkl) or (4 < end))):
             raise MessageFormatError(MessageFormatError.EMPTY_MESSAGE_NOT_EMPTY, dkw)
-        token = bytes(data[:tkl])
-        if 0 < tkl:
-            data[:tkl] = b''
+        offset = 4 + tkl
+        if offset > end:
+            raise MessageFormatError(MessageFormatError.TOKEN_TRUNCATED, dkw)
+        token = view[4:offset].tobytes()
+        ostart = offset
         try:
-            (options, remainder) = coapy.option.decode_options(bytes(data))
+            (index, offset) = coapy.option.index_options_from(view, offset)
         except coapy.option.OptionDecodeError as e:
             # This can be an invalid delta or length in the first byte,
             # or a value field that does not conform to the requirements.
             # @todo@ refine this
             raise MessageFormatError(MessageFormatError.INVALID_OPTION, dkw)
+        oend = offset
         payload = None
-        if 0 < len(remainder):
-            data = bytearray(remainder)
-            if 0xFF != data[0]:
-                # This should have been interpreted as an option decode error
-                raise MessageFormatError(MessageFormatError.INVALID_OPTION, dkw)
-            payload = remainder[1:]
-            if 0 == len(payload):
+        if offset < end:
+            # Option decoding stops only at the end of the data or at
+            # a Payload Marker.
+            offset += 1
+            if offset == end:
                 raise MessageFormatError(MessageFormatError.ZERO_LENGTH_PAYLOAD, dkw)
+            payload = view[offset:].tobytes()
+        options = None
+        if index and not lazy:
+            options = coapy.option.options_from_index(view, index)
         kw = {'confirmable': (cls.Type_CON == message_type),
               'acknowledgement': (cls.Type_ACK == message_type),
               'reset': (cls.Type_RST == message_type),
@@ -649,18 +854,34 @@ class Message(object):
               'options': options,
               'payload': payload
               }
-        constructor = cls._type_for_code(code)
+        constructor = cls.__ConstructorTable[packed_code]
         if constructor is None:
             raise MessageFormatError(MessageFormatError.UNRECOGNIZED_CODE_CLASS, dkw)
-        return constructor(**kw)
-
-    __source_endpoint = None
+        m = constructor(**kw)
+        if index and lazy:
+            # Retain a private copy of the option block, with the index
+            # rebased to it.
+            m._set_packed_options(view[ostart:oend].tobytes(),
+                                  tuple((_n, _s - ostart, _e - ostart) for (_n, _s, _e) in index))
+        return m
+
+    def _set_packed_options(self, block, index):
+        """Replace the options with the packed option *block*.
+
+        *index* is the result of :func:`coapy.option.index_options_from`
+        on *block*, which must be a non-empty :class:`bytes` instance.
+        The options will be created from *block* if :attr:`options` is
+        used.
+        """
+        self.__options = None
+        self.__packed_options = (block, index)
+        self.__packed = None
+        self.__validated = None
 
     def _set_source_endpoint(self, ep):
-        import coapy.endpoint
         if (ep is None) and (self.__source_endpoint is None):
             return
-        if not isinstance(ep, coapy.endpoint.Endpoint):
+        if not isinstance(ep, _Endpoint or _endpoint_class()):
             raise TypeError
         if (self.__source_endpoint is not None) and (self.__source_endpoint is not ep):
             raise ValueError
@@ -681,13 +902,10 @@ class Message(object):
 
     source_endpoint = property(_get_source_endpoint, _set_source_endpoint)
 
-    __destination_endpoint = None
-
     def _set_destination_endpoint(self, ep):
-        import coapy.endpoint
         if (ep is None) and (self.__destination_endpoint is None):
             return
-        if not isinstance(ep, coapy.endpoint.Endpoint):
+        if not isinstance(ep, _Endpoint or _endpoint_class()):
             raise TypeError
         if (self.__destination_endpoint is not None) and (self.__destination_endpoint is not ep):
             raise ValueError
@@ -718,8 +936,14 @@ class Message(object):
         Diagnostics will be emitted for any
         :class:`coapy.option.UnrecognizedOption` remaining in the
         message after validation.
+
+        A message that passed validation is not checked again until
+        one of its properties or options is changed.
         """
 
+        if (self.__validated is not None) and (self.__validated == self.__options_key()):
+            return
+
         if self.code is None:
             raise MessageValidationError(MessageValidationError.CODE_UNDEFINED, self)
 
@@ -743,26 +967,47 @@ class Message(object):
             if (ctor is not None) and not isinstance(self, ctor):
                 raise MessageValidationError(MessageValidationError.CODE_INSTANCE_CONFLICT, self)
 
-        if isinstance(self, (Response, Request)):
-            self.options[:] = coapy.option.replace_unacceptable_options(self.options,
-                                                                        isinstance(self, Request))
+        # Check the options in a single pass over the sorted list,
+        # replacing those that are not acceptable in this message (see
+        # coapy.option.replace_unacceptable_options) with equivalent
+        # unrecognized options.
         opts = self._sort_options()
-        if isinstance(self, Request):
-            opt = coapy.option.ProxyUri.first_match(opts)
-            if opt is not None:
-                bad_opts = [_o for _o in opts if isinstance(_o,
-                                                            (coapy.option.UriHost,
-                                                             coapy.option.UriPort,
-                                                             coapy.option.UriPath,
-                                                             coapy.option.UriQuery,
-                                                             ))]
-                if 0 < len(bad_opts):
-                    raise MessageValidationError(MessageValidationError.PROXY_URI_CONFLICT, self)
-        for opt in opts:
-            if isinstance(opt, coapy.option.UnrecognizedOption):
-                if opt.is_critical():
-                    raise MessageValidationError(MessageValidationError.UNRECOGNIZED_CRITICAL_OPTION, self, opt)
-                _log.warn('Unrecognized option in message: {0!s}'.format(opt))
+        is_request = isinstance(self, Request)
+        valid_bit = multiple_bit = 0
+        if is_request:
+            valid_bit = coapy.option._F_REQUEST
+            multiple_bit = coapy.option._F_MULTIPLE_REQUEST
+        elif isinstance(self, Response):
+            valid_bit = coapy.option._F_RESPONSE
+            multiple_bit = coapy.option._F_MULTIPLE_RESPONSE
+        unrecognized_bit = coapy.option._F_UNRECOGNIZED
+        proxy_uri_number = coapy.option.ProxyUri.number
+        has_proxy_uri = has_proxy_conflict = False
+        unrecognized = []
+        last_number = None
+        for i in xrange(len(opts)):
+            opt = opts[i]
+            flags = opt._flags
+            number = opt.number
+            if valid_bit and (not (flags & valid_bit)
+                              or ((number == last_number) and not (flags & multiple_bit))):
+                opt = opts[i] = coapy.option.UnrecognizedOption.from_option(opt)
+                flags = opt._flags
+            last_number = number
+            if flags & unrecognized_bit:
+                unrecognized.append(opt)
+            elif number == proxy_uri_number:
+                has_proxy_uri = True
+            elif number in _proxy_conflict_numbers:
+                has_proxy_conflict = True
+        if is_request and has_proxy_uri and has_proxy_conflict:
+            raise MessageValidationError(MessageValidationError.PROXY_URI_CONFLICT, self)
+        for opt in unrecognized:
+            if opt.is_critical():
+                raise MessageValidationError(MessageValidationError.UNRECOGNIZED_CRITICAL_OPTION,
+                                             self, opt)
+            _log.warn('Unrecognized option in message: {0!s}'.format(opt))
+        self.__validated = self.__options_key()
 
     def create_reply(self, reset=False):
         """Create a message-layer reply to this message.
@@ -821,6 +1066,45 @@ class Message(object):
 Message.RegisterCode(Message.Empty, 'Empty')
 
 
+MessageHeader = collections.namedtuple('MessageHeader',
+                                       ('version', 'type', 'token_length',
+                                        'code', 'messageID', 'token'))
+"""The fixed header and token of a packed message, as returned by
+:func:`peek_header`.
+
+*type* is the :attr:`Message.messageType`, *code* the
+:attr:`Message.code` tuple, and *messageID* the
+:attr:`Message.messageID`.  *token* is the token as :class:`bytes`, or
+``None`` if *token_length* is not valid or the data is too short to
+hold the token.
+"""
+
+
+def peek_header(packed_message):
+    """Decode the fixed header and token of a packed message without
+    creating a :class:`Message`.
+
+    *packed_message* is anything accepted by
+    :meth:`Message.from_packed`.  Returns ``None`` if it is too short
+    to hold the fixed header, and otherwise a :class:`MessageHeader`.
+    Nothing beyond the token is examined, so this is suitable for
+    filtering or routing datagrams before committing to a full decode.
+    Note that the *version* is not checked: datagrams for which it is
+    not :attr:`Message.Ver` are silently ignored by
+    :meth:`Message.from_packed`.
+    """
+    view = memoryview(packed_message)
+    if 4 > len(view):
+        return None
+    (vttkl, packed_code, message_id) = _unpack_header(view, 0)
+    tkl = 0x0F & vttkl
+    token = None
+    if (9 > tkl) and (4 + tkl <= len(view)):
+        token = view[4:4 + tkl].tobytes()
+    return MessageHeader(vttkl >> 6, 0x03 & (vttkl >> 4), tkl,
+                         _code_tuples[packed_code], message_id, token)
+
+
 class Request (Message):
     """Subclass for messages that are requests.
 
@@ -838,6 +1122,8 @@ class Request (Message):
 
     """
 
+    __slots__ = ()
+
     CodeClass = coapy.util.ClassReadOnly(0)
     """The :attr:`Message.code` *class* component for :class:`Request`
     messages.
@@ -909,7 +1195,7 @@ class Response (Message):
     handling of :class:`SuccessResponse`,
     :class:`ClientErrorResponse`, and :class:`ServerErrorResponse`.
     """
-    pass
+    __slots__ = ()
 
 
 class SuccessResponse (Response):
@@ -930,6 +1216,9 @@ class SuccessResponse (Response):
     (2, 5)   :attr:`Content`   :coapsect:`5.9.1.4`
     =======  ================  ====================
     """
+
+    __slots__ = ()
+
     CodeClass = coapy.util.ClassReadOnly(2)
     """The :attr:`Message.code` *class* component for
     :class:`SuccessResponse` messages."""
@@ -963,6 +1252,8 @@ class Class3Response (Message):
     fails to define any unreserved code in the class.
     """
 
+    __slots__ = ()
+
     CodeClass = coapy.util.ClassReadOnly(3)
     """The :attr:`Message.code` *class* component for
     :class:`Class3Response` messages.
@@ -994,6 +1285,8 @@ class ClientErrorResponse (Response):
     ========  =================================  =====================
     """
 
+    __slots__ = ()
+
     CodeClass = coapy.util.ClassReadOnly(4)
     """The :attr:`Message.code` *class* component for
     :class:`ClientErrorResponse` messages."""
@@ -1059,6 +1352,8 @@ class ServerErrorResponse (Response):
     ========  =================================  =====================
     """
 
+    __slots__ = ()
+
     CodeClass = coapy.util.ClassReadOnly(5)
     """The :attr:`Message.code` *class* component for
     :class:`ServerErrorResponse` messages."""
@@ -1088,6 +1383,137 @@ ServerErrorResponse.RegisterCode(ServerErrorResponse.GatewayTimeout, 'Gateway Ti
 ServerErrorResponse.RegisterCode(ServerErrorResponse.ProxyingNotSupported, 'Proxying Not Supported')  # nopep8
 
 
+class RequestTemplate(object):
+    """A :class:`Request` that is sent repeatedly, with its options
+    encoded once.
+
+    *confirmable*, *code*, and *options* are as for :class:`Request`.
+    The options are validated and encoded when the template is
+    created; each message produced from it differs only in its
+    :attr:`Message.messageID`, :attr:`Message.token`, and
+    :attr:`Message.payload`.  *destination_endpoint* is assigned to
+    the :attr:`Message.destination_endpoint` of requests created from
+    the template.
+
+    Use :meth:`create_request` to obtain a :class:`Request` that
+    shares the encoded options (e.g. for
+    :meth:`coapy.endpoint.LocalEndpoint.send`, which also accepts a
+    template directly), or :meth:`to_packed` and :meth:`pack_into` to
+    produce the wire format without creating a message.
+
+    See also :meth:`coapy.endpoint.Endpoint.create_request_template`.
+    """
+
+    __slots__ = ('__vtt', '__packed_code', '__code', '__options',
+                 '__packed_options', '__index', '__destination_endpoint')
+
+    def __init__(self, confirmable=False, code=Request.GET, options=None,
+                 destination_endpoint=None):
+        m = Request(confirmable=confirmable, code=code, options=options)
+        m.validate()
+        self.__vtt = (Message.Ver << 6) | (m.messageType << 4)
+        self.__code = m.code
+        self.__packed_code = m.packed_code
+        self.__options = coapy.option.freeze_options(m.options)
+        self.__packed_options = coapy.option.encode_options(self.__options)
+        (self.__index, _) = coapy.option.index_options_from(self.__packed_options)
+        self.__destination_endpoint = destination_endpoint
+
+    @property
+    def confirmable(self):
+        """``True`` if requests from this template are :attr:`CON<Message.Type_CON>`."""
+        return Message.Type_CON == (0x03 & (self.__vtt >> 4))
+
+    @property
+    def code(self):
+        """The :attr:`Message.code` of requests from this template."""
+        return self.__code
+
+    @property
+    def options(self):
+        """The validated options of requests from this template, as a tuple."""
+        return self.__options
+
+    @property
+    def packed_options(self):
+        """The encoded option block, as :class:`bytes`."""
+        return self.__packed_options
+
+    @property
+    def destination_endpoint(self):
+        """The endpoint to which requests from this template are sent,
+        or ``None``."""
+        return self.__destination_endpoint
+
+    def create_request(self, messageID=None, token=None, payload=None):
+        """Create a :class:`Request` from the template.
+
+        *messageID*, *token*, and *payload* are as for
+        :class:`Message`.  The :attr:`Message.options` of the request
+        are not created unless they are used.
+        """
+        m = Request(confirmable=self.confirmable, code=self.__code,
+                    messageID=messageID, token=token, payload=payload)
+        if self.__packed_options:
+            m._set_packed_options(self.__packed_options, self.__index)
+        if self.__destination_endpoint is not None:
+            m.destination_endpoint = self.__destination_endpoint
+        return m
+
+    def __header(self, messageID, token, payload):
+        if not isinstance(messageID, int):
+            raise TypeError(messageID)
+        if not ((0 <= messageID) and (messageID <= 65535)):
+            raise ValueError(messageID)
+        if not isinstance(token, bytes):
+            raise TypeError(token)
+        if len(token) > 8:
+            raise ValueError(token)
+        if (payload is not None) and not isinstance(payload, bytes):
+            raise TypeError(payload)
+        return (self.__vtt | len(token), self.__packed_code, messageID)
+
+    def to_packed(self, messageID, token=b'', payload=None):
+        """Return the packed representation of a request from this
+        template with the given *messageID*, *token*, and *payload*.
+
+        The result is identical to
+        ``create_request(messageID, token, payload).to_packed()``.
+        """
+        elements = [struct.pack(str('!BBH'), *self.__header(messageID, token, payload)),
+                    token, self.__packed_options]
+        if payload:
+            elements.append(b'\xFF')
+            elements.append(payload)
+        return b''.join(elements)
+
+    def pack_into(self, buffer, offset, messageID, token=b'', payload=None):
+        """Write the packed representation of a request from this
+        template into *buffer* at *offset*, as with
+        :meth:`Message.pack_into`.
+
+        Returns the number of octets written.
+        """
+        header = self.__header(messageID, token, payload)
+        view = memoryview(buffer)
+        start = offset
+        block = self.__packed_options
+        nend = offset + 4 + len(token) + len(block)
+        if payload:
+            nend += 1 + len(payload)
+        if nend > len(view):
+            raise ValueError(buffer)
+        _pack_header_into(view, offset, *header)
+        offset += 4
+        for field in (token, block):
+            view[offset:offset + len(field)] = field
+            offset += len(field)
+        if payload:
+            view[offset:offset + 1] = b'\xFF'
+            view[offset + 1:nend] = payload
+        return nend - start
+
+
 class TransmissionParameters(object):
     """The :coapsect:`transmission parameters<4.8>` that support
     message transmission behavior including :coapsect:`congestion
@@ -33,10 +33,30 @@ import logging
 _log = logging.getLogger(__name__)
 
 import coapy
+import operator
 import struct
 import unicodedata
 import coapy.util
 
+# Pre-compiled accessors used to read option header fields in place
+# from a buffer without slicing it.
+_unpack_B = struct.Struct(str('B')).unpack_from
+_unpack_H = struct.Struct(str('!H')).unpack_from
+_pack_B_into = struct.Struct(str('B')).pack_into
+
+# Fixed-width converters used by format_uint.
+_pack_H = struct.Struct(str('!H')).pack
+_pack_Q = struct.Struct(str('!Q')).pack
+_unpack_I = struct.Struct(str('!I')).unpack
+_unpack_Q = struct.Struct(str('!Q')).unpack
+
+# The single-octet bytes string for each octet value.
+_octets = tuple(struct.pack(str('B'), _v) for _v in xrange(256))
+
+# Zero octets prepended to a packed uint of length n to make it eight
+# octets long, indexed by n.
+_uint_padding = tuple(b'\x00' * (8 - _n) for _n in xrange(9))
+
 
 class OptionError (coapy.InfrastructureError):
     pass
@@ -274,19 +294,27 @@ class format_uint (_format_base):
         super(format_uint, self).__init__(max_length, 0)
 
     def _to_packed(self, value):
-        if 0 == value:
-            return b''
-        pv = bytearray(struct.pack(str('!Q'), value))
-        for i in xrange(len(pv)):
-            if pv[i] != 0:
-                break
-        return bytes(pv[i:])
+        if 0 <= value < 256:
+            return _uint_packed[value]
+        if 65536 > value:
+            return _pack_H(value)
+        return _pack_Q(value).lstrip(b'\x00')
 
     def _from_packed(self, data):
+        n = len(data)
+        if 2 == n:
+            return _unpack_H(data)[0]
+        if 1 == n:
+            return ord(data)
+        if 0 == n:
+            return 0
+        if 4 == n:
+            return _unpack_I(data)[0]
+        if 8 >= n:
+            return _unpack_Q(_uint_padding[n] + data)[0]
         value = 0
-        data = bytearray(data)
-        for i in xrange(len(data)):
-            value = (value * 256) + data[i]
+        for octet in bytearray(data):
+            value = (value * 256) + octet
         return value
 
     def option_encoding(self, value):
@@ -294,20 +322,7 @@ class format_uint (_format_base):
             raise TypeError(value)
         if (0 > value):
             raise ValueError(value)
-        if value < 13:
-            ov = value
-            ovx = b''
-        elif value < 269:
-            ov = 13
-            ovx = self.to_packed(value - 13)
-            while len(ovx) < 1:
-                ovx = b'\x00' + ovx
-        else:
-            ov = 14
-            ovx = self.to_packed(value - 269)
-            while len(ovx) < 2:
-                ovx = b'\x00' + ovx
-        return (ov, ovx)
+        return _option_field(value)
 
     def option_decoding(self, ov, data):
         if 15 <= ov:
@@ -322,6 +337,61 @@ class format_uint (_format_base):
         return '{0:d}'.format(value)
 
 
+# The packed format_uint representation of values below 256.
+_uint_packed = (b'',) + _octets[1:]
+
+# The (4-bit code, extension octets) encoding of each option delta or
+# length value below 269; larger values use a two-octet extension.
+_option_fields = (tuple((_v, b'') for _v in xrange(13))
+                  + tuple((13, _octets[_v - 13]) for _v in xrange(13, 269)))
+
+
+def _option_field(value):
+    # Encode a non-negative option delta or length as (4-bit code,
+    # extension octets).
+    if 269 > value:
+        return _option_fields[value]
+    if 65805 > value:
+        return (14, _pack_H(value - 269))
+    raise OptionLengthError(value - 269)
+
+
+def _option_header_decoder(odl):
+    # Build the entry of _option_header_decoders for the header octet
+    # odl: ``(delta, length, unpack_from, size, delta_extended,
+    # length_extended)`` where *delta* and *length* are the values, or
+    # the bases to which the unpacked extension fields are added, and
+    # *unpack_from* (None if there are no extension octets) reads the
+    # *size* extension octets.
+    fmt = ''
+    bases = []
+    extended = []
+    for nibble in (odl >> 4, odl & 0x0F):
+        if 15 == nibble:
+            return None
+        if 14 == nibble:
+            fmt += 'H'
+            bases.append(269)
+        elif 13 == nibble:
+            fmt += 'B'
+            bases.append(13)
+        else:
+            bases.append(nibble)
+        extended.append(13 <= nibble)
+    unpack_from = None
+    size = 0
+    if fmt:
+        st = struct.Struct(str('!' + fmt))
+        (unpack_from, size) = (st.unpack_from, st.size)
+    return (bases[0], bases[1], unpack_from, size, extended[0], extended[1])
+
+
+# Decoding instructions for each option header octet, or None for
+# octets that include the reserved code 15 (including the payload
+# marker).
+_option_header_decoders = tuple(_option_header_decoder(_odl) for _odl in xrange(256))
+
+
 class format_string (_format_base):
     """Supports options with text values.
 
@@ -350,6 +420,12 @@ class format_string (_format_base):
 
 _OptionRegistry = {}
 
+# Dense table mirroring _OptionRegistry for option numbers below
+# _OPTION_TABLE_SIZE, which covers all options defined by the base
+# protocol.  Larger numbers are resolved through _OptionRegistry.
+_OPTION_TABLE_SIZE = 64
+_OptionTable = [None] * _OPTION_TABLE_SIZE
+
 
 # Internal function used to register option classes as their
 # definitions are processed by Python.
@@ -373,9 +449,19 @@ def _register_option(option_class):
     if option_class.number in _OptionRegistry:
         raise OptionRegistryConflictError(option_class)
     _OptionRegistry[option_class.number] = option_class
+    if option_class.number < _OPTION_TABLE_SIZE:
+        _OptionTable[option_class.number] = option_class
     return option_class
 
 
+# Internal unchecked variant of find_option for use in decoding, where
+# *number* is known to be a non-negative integer.
+def _lookup_option(number):
+    if number < _OPTION_TABLE_SIZE:
+        return _OptionTable[number]
+    return _OptionRegistry.get(number)
+
+
 def find_option(number):
     """Look up an option by number.
 
@@ -387,7 +473,7 @@ def find_option(number):
         raise TypeError(number)
     if not ((0 <= number) and (number <= 65535)):
         raise ValueError(number)
-    return _OptionRegistry.get(number, None)
+    return _lookup_option(number)
 
 
 def all_options():
@@ -413,6 +499,38 @@ def all_options():
 # The concepts in this approach derive from:
 # http://stackoverflow.com/questions/1735434/class-level-read-only-properties-in-python
 #
+# Bits in UrOption._flags, which _MetaUrOption computes for each option
+# class from its number and cardinality so that message validation can
+# check an option with a single attribute access.
+_F_REQUEST = 0x01
+_F_MULTIPLE_REQUEST = 0x02
+_F_RESPONSE = 0x04
+_F_MULTIPLE_RESPONSE = 0x08
+_F_CRITICAL = 0x10
+_F_UNSAFE = 0x20
+_F_UNRECOGNIZED = 0x40
+
+
+def _option_flags(number, repeatable):
+    flags = 0
+    if isinstance(repeatable, tuple) and (2 == len(repeatable)):
+        (request, response) = repeatable
+        if request is not None:
+            flags |= _F_REQUEST
+        if request is True:
+            flags |= _F_MULTIPLE_REQUEST
+        if response is not None:
+            flags |= _F_RESPONSE
+        if response is True:
+            flags |= _F_MULTIPLE_RESPONSE
+    if isinstance(number, int):
+        if is_critical_option(number):
+            flags |= _F_CRITICAL
+        if is_unsafe_option(number):
+            flags |= _F_UNSAFE
+    return flags
+
+
 # Note that coapy.util.ReadOnlyMeta does something similar but only to
 # the class in which the attribute is introduced, while this works only
 # on subclasses of UrOption.
@@ -425,7 +543,7 @@ class _MetaUrOption(type):
 
     # The set of attributes in types that are to be made immutable if
     # the type provides a non-None value for the attribute.
-    __ReadOnlyAttrs = ('number', '_repeatable', 'format', 'name')
+    __ReadOnlyAttrs = ('number', '_repeatable', 'format', 'name', '_flags')
 
     @classmethod
     def SetUrOption(cls, ur_option):
@@ -441,8 +559,13 @@ class _MetaUrOption(type):
 
         # Only subclasses of UrOption have read-only attributes.  Make
         # those attributes immutable at both the class and instance
-        # levels.
+        # levels, and unless the subclass says otherwise give it no
+        # per-instance state beyond what UrOption provides.
         if (cls.__UrOption is not None):
+            namespace.setdefault('__slots__', ())
+            if '_flags' not in namespace:
+                lookup = lambda _n: namespace.get(_n, getattr(bases[0], _n, None))
+                namespace['_flags'] = _option_flags(lookup('number'), lookup('_repeatable'))
             for n in cls.__ReadOnlyAttrs:
                 v = namespace.get(n, None)
                 if (v is not None) and not isinstance(v, property):
@@ -498,10 +621,21 @@ class UrOption (object):
     :attr:`value` will be initialized with the corresponding unpacked
     value; otherwise :attr:`value` will be ``None`` until a valid
     value is assigned.
+
+    Option instances have no ``__dict__``.  Subclasses that do not
+    define ``__slots__`` are given an empty one by the metaclass, so a
+    subclass that needs per-instance state must list it in
+    ``__slots__``.
+
+    Instances obtained from :meth:`interned` or :func:`intern_option`
+    are shared and :meth:`frozen<is_frozen>`: their :attr:`value`
+    cannot be changed.
     """
 
     __metaclass__ = _MetaUrOption
 
+    __slots__ = ('__value', '__packed_value', '__frozen')
+
     number = None
     """The option number.
 
@@ -546,6 +680,13 @@ class UrOption (object):
     string value.
     """
 
+    # Combination of _F_* bits derived from number and _repeatable.
+    # Read-only; computed by the metaclass for each subclass.
+    _flags = 0
+
+    # True for option types whose decoded instances are interned.
+    _intern_decoded = False
+
     def is_critical(self):
         """Passes ``self.number`` to :func:`is_critical_option`."""
         return is_critical_option(self.number)
@@ -576,6 +717,8 @@ class UrOption (object):
 
     def __init__(self, unpacked_value=None, packed_value=None):
         super(UrOption, self).__init__()
+        self.__frozen = False
+        self.__packed_value = None
         if unpacked_value is not None:
             self._set_value(unpacked_value)
         elif packed_value is not None:
@@ -584,7 +727,11 @@ class UrOption (object):
             self.__value = None
 
     def _set_value(self, unpacked_value):
-        self.__value = self.format.from_packed(self.format.to_packed(unpacked_value))
+        if self.__frozen:
+            raise AttributeError('value')
+        packed_value = self.format.to_packed(unpacked_value)
+        self.__value = self.format.from_packed(packed_value)
+        self.__packed_value = packed_value
 
     def _get_value(self):
         """Contains the value of the option.  This is an instance of
@@ -592,12 +739,40 @@ class UrOption (object):
         Only values that pass the restrictions of :attr:`format` may
         be assigned to this property.  Unacceptable values result in
         :exc:`TypeError<python:exceptions.TypeError>` or
-        :exc:`OptionLengthError`.
+        :exc:`OptionLengthError`.  Assignment to a
+        :meth:`frozen<is_frozen>` option raises
+        :exc:`AttributeError<python:exceptions.AttributeError>`.
         """
         return self.__value
 
     value = property(_get_value, _set_value)
 
+    def is_frozen(self):
+        """Return ``True`` iff this is a shared instance whose
+        :attr:`value` cannot be changed."""
+        return self.__frozen
+
+    def _freeze(self):
+        self.__frozen = True
+
+    @classmethod
+    def interned(cls, unpacked_value):
+        """Return a shared :meth:`frozen<is_frozen>` instance of *cls*
+        with value *unpacked_value*.
+
+        Repeated calls with an equal value return the same instance
+        while it remains in :data:`interned_options`, without
+        re-validating or re-packing the value.  This is intended for
+        values that are used constantly, such as common
+        :class:`UriPath` segments or :class:`ContentFormat` values.
+        """
+        key = (cls, type(unpacked_value), unpacked_value)
+        opt = interned_options.get(key)
+        if opt is None:
+            opt = intern_option(cls(unpacked_value))
+            interned_options[key] = opt
+        return opt
+
     @classmethod
     def first_match(cls, options):
         """Return the first option in *options* that's an instance of
@@ -607,7 +782,14 @@ class UrOption (object):
         of *cls*.  Note that the test is specifically for instances of
         the class; an instance of :class:`UnrecognizedOption` will not
         be returned just because the :attr:`number` matches.
+
+        If *options* is an :class:`OptionList` (e.g. the
+        :attr:`options<coapy.message.Message.options>` of a message)
+        only the options with the number of *cls* are examined.
         """
+        candidates = _indexed_candidates(cls, options)
+        if candidates is not None:
+            options = candidates
         for o in options:
             if isinstance(o, cls):
                 return o
@@ -621,7 +803,13 @@ class UrOption (object):
         Note that the test is specifically for instances of the class;
         an instance of :class:`UnrecognizedOption` will not be
         returned just because the :attr:`number` matches.
+
+        As with :meth:`first_match` an :class:`OptionList` is searched
+        through its index.
         """
+        candidates = _indexed_candidates(cls, options)
+        if candidates is not None:
+            options = candidates
         rv = []
         for o in options:
             if isinstance(o, cls):
@@ -630,8 +818,13 @@ class UrOption (object):
 
     @property
     def packed_value(self):
-        """The :attr:`value` of the option in its packed representation."""
-        return self.format.to_packed(self.value)
+        """The :attr:`value` of the option in its packed representation.
+
+        This is computed when first needed and retained until
+        :attr:`value` is changed."""
+        if self.__packed_value is None:
+            self.__packed_value = self.format.to_packed(self.__value)
+        return self.__packed_value
 
     def __unicode__(self):
         if isinstance(self.format, format_empty):
@@ -646,10 +839,7 @@ class UrOption (object):
 # Register the UrOption so subclasses can
 _MetaUrOption.SetUrOption(UrOption)
 
-# A utility instance used to encode and decode variable-length
-# integers in options, which comprise a 4-bit code with zero to two
-# bytes of offset.
-_optionint_helper = format_uint(2)
+_option_number = operator.attrgetter('number')
 
 
 def sorted_options(options):
@@ -660,7 +850,25 @@ def sorted_options(options):
     options with the same number remain in their original order.  This
     operation is used for duplicate detection and to calculate the
     delta required to encode options."""
-    return sorted(options, key=lambda _o: _o.number)
+    if isinstance(options, OptionList):
+        return list(options)
+    return sorted(options, key=_option_number)
+
+
+# Sort *options* in place unless it is already in canonical order, and
+# return it.  Used where the caller owns the list, to avoid building a
+# new one in the common case where nothing has changed.
+def _sort_options_in_place(options):
+    if isinstance(options, OptionList):
+        return options
+    last_number = -1
+    for opt in options:
+        number = opt.number
+        if number < last_number:
+            options.sort(key=_option_number)
+            break
+        last_number = number
+    return options
 
 
 def replace_unacceptable_options(options, is_request):
@@ -686,24 +894,275 @@ def replace_unacceptable_options(options, is_request):
     based on *is_request* and each option's restrictions.  The
     resulting list of options is returned.
     """
-    newopts = []
+    newopts = sorted_options(options)
+    _replace_unacceptable_sorted(newopts, is_request)
+    return newopts
+
+
+# Implementation of replace_unacceptable_options that updates the
+# already-sorted list *options* in place.  Returns ``True`` iff any
+# option was replaced.
+def _replace_unacceptable_sorted(options, is_request):
     if is_request:
-        valid = lambda _o: _o.valid_in_request()
-        valid_multiple = lambda _o: _o.valid_multiple_in_request()
+        valid_bit = _F_REQUEST
+        multiple_bit = _F_MULTIPLE_REQUEST
     else:
-        valid = lambda _o: _o.valid_in_response()
-        valid_multiple = lambda _o: _o.valid_multiple_in_response()
-    last_number = 0
-    for opt in sorted_options(options):
-        delta = opt.number - last_number
-        last_number = opt.number
-        if not valid(opt):
-            newopts.append(UnrecognizedOption.from_option(opt))
-        elif (0 == delta) and not valid_multiple(opt):
-            newopts.append(UnrecognizedOption.from_option(opt))
+        valid_bit = _F_RESPONSE
+        multiple_bit = _F_MULTIPLE_RESPONSE
+    replaced = False
+    last_number = None
+    for i in xrange(len(options)):
+        opt = options[i]
+        flags = opt._flags
+        number = opt.number
+        if not (flags & valid_bit) or ((number == last_number) and not (flags & multiple_bit)):
+            options[i] = UnrecognizedOption.from_option(opt)
+            replaced = True
+        last_number = number
+    return replaced
+
+
+class OptionList (list):
+    """A :class:`python:list` of options that is kept in canonical
+    order and maintains an index of its contents by option
+    :attr:`number<UrOption.number>`.
+
+    Options are ordered by number as they are added: :meth:`append`
+    places an option after any others with the same number, and
+    :meth:`extend` performs a stable sort that is linear when the
+    added options are already in order.  The *index* argument of
+    :meth:`insert` is ignored, and item or slice assignment that would
+    disturb the order is followed by a stable sort.  :meth:`sort` and
+    :meth:`reverse` therefore affect only the relative order of options
+    with the same number.  Consumers such as :func:`encode_options`
+    rely on this to avoid sorting.
+
+    The index is built when first needed by :meth:`with_number` and
+    discarded when the list is modified, so
+    :meth:`UrOption.first_match` and :meth:`UrOption.all_match` on an
+    :class:`OptionList` do not depend on the total number of options.
+    Changing the :attr:`value<UrOption.value>` of a contained option
+    does not affect the index.
+    """
+
+    __slots__ = ('__index',)
+
+    def __init__(self, options=()):
+        super(OptionList, self).__init__(options)
+        self.__index = None
+        self.__restore_order()
+
+    def with_number(self, number):
+        """Return a sequence of the options in the list with option
+        number *number*, in list order."""
+        index = self.__index
+        if index is None:
+            index = {}
+            for opt in self:
+                index.setdefault(opt.number, []).append(opt)
+            self.__index = index
+        return index.get(number, ())
+
+    def _invalidate(self):
+        self.__index = None
+
+    def __restore_order(self):
+        last_number = -1
+        for opt in self:
+            number = opt.number
+            if number < last_number:
+                list.sort(self, key=_option_number)
+                break
+            last_number = number
+
+    def append(self, opt):
+        """Add *opt* following the last option with a number no
+        greater than its own."""
+        self.__index = None
+        number = opt.number
+        i = len(self)
+        while i and self[i - 1].number > number:
+            i -= 1
+        list.insert(self, i, opt)
+
+    def insert(self, index, opt):
+        """Equivalent to :meth:`append`; *index* is ignored."""
+        self.append(opt)
+
+    def extend(self, options):
+        self.__index = None
+        list.extend(self, options)
+        self.__restore_order()
+
+    def __iadd__(self, options):
+        self.extend(options)
+        return self
+
+    def __imul__(self, count):
+        self.__index = None
+        list.__imul__(self, count)
+        self.__restore_order()
+        return self
+
+    def __setitem__(self, key, value):
+        self.__index = None
+        list.__setitem__(self, key, value)
+        self.__restore_order()
+
+    def __setslice__(self, i, j, options):
+        self.__index = None
+        list.__setslice__(self, i, j, options)
+        self.__restore_order()
+
+    def sort(self, *args, **kw):
+        self.__index = None
+        list.sort(self, *args, **kw)
+        list.sort(self, key=_option_number)
+
+    def reverse(self):
+        self.__index = None
+        list.reverse(self)
+        list.sort(self, key=_option_number)
+
+
+def _invalidating(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kw):
+        self._invalidate()
+        return method(self, *args, **kw)
+    wrapper.__name__ = str(name)
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+# Removing options does not affect the order of those that remain.
+for _name in ('__delitem__', '__delslice__', 'pop', 'remove'):
+    setattr(OptionList, _name, _invalidating(_name))
+del _name
+
+
+# Return the options in *options* that may be instances of *cls*,
+# using the index of an OptionList, or None if *options* must be
+# scanned.  The index is usable only when every instance of *cls* has
+# the registered number of *cls*, which is not the case for UrOption
+# or UnrecognizedOption, or for classes that have been subclassed.
+def _indexed_candidates(cls, options):
+    if isinstance(options, OptionList):
+        number = cls.number
+        if isinstance(number, int) and not cls.__subclasses__():
+            return options.with_number(number)
+    return None
+
+
+interned_options = coapy.util.LRUCache(1024)
+"""The :class:`coapy.util.LRUCache` holding shared option instances
+for :func:`intern_option`, :meth:`UrOption.interned`, and the decoding
+of options for which interning is enabled (:class:`UriHost`,
+:class:`UriPort`, :class:`UriPath`, :class:`ContentFormat`,
+:class:`MaxAge`, and :class:`Accept`).  Its
+:attr:`capacity<coapy.util.LRUCache.capacity>` bounds the number of
+retained instances.
+"""
+
+
+def intern_option(opt):
+    """Return the shared :meth:`frozen<UrOption.is_frozen>` instance
+    equivalent to *opt*.
+
+    The result has the same type, :attr:`number<UrOption.number>`,
+    and :attr:`packed_value<UrOption.packed_value>` as *opt*.  If no
+    such instance is in :data:`interned_options` a frozen copy of
+    *opt* is added.  *opt* itself is returned if it is already frozen.
+    """
+    if opt.is_frozen():
+        return opt
+    option_type = type(opt)
+    number = opt.number
+    packed_value = opt.packed_value
+    key = (option_type, number, packed_value)
+    rv = interned_options.get(key)
+    if rv is None:
+        if option_type is UnrecognizedOption:
+            rv = UnrecognizedOption(number, packed_value=packed_value)
         else:
-            newopts.append(opt)
-    return newopts
+            rv = option_type(packed_value=packed_value)
+        rv._freeze()
+        interned_options[key] = rv
+    return rv
+
+
+# Return the interned option of the registered *option_type* decoded
+# from *packed*, creating it if necessary.
+def _interned_from_packed(option_type, packed):
+    key = (option_type, option_type.number, packed)
+    rv = interned_options.get(key)
+    if rv is None:
+        rv = option_type(packed_value=packed)
+        rv._freeze()
+        interned_options[key] = rv
+    return rv
+
+
+class FrozenOptions (tuple):
+    """An immutable, :func:`sorted<sorted_options>` sequence of options.
+
+    Instances are created by :func:`freeze_options`.  The elements are
+    the :func:`interned<intern_option>` equivalents of the original
+    options, so they cannot be modified.  The canonical :attr:`key` of
+    the options is computed once, so :func:`encode_options` finds the
+    packed form of a :class:`FrozenOptions` instance in
+    :data:`encoded_options_cache` without examining the options.
+    """
+
+    @property
+    def key(self):
+        """A tuple of ``(number, packed_value)`` pairs, one for each
+        option in order, that determines the encoded form of the
+        options."""
+        return self.__key
+
+    def __new__(cls, options):
+        options = [intern_option(_o) for _o in sorted_options(options)]
+        instance = super(FrozenOptions, cls).__new__(cls, options)
+        instance.__key = tuple((_o.number, _o.packed_value) for _o in instance)
+        return instance
+
+
+def freeze_options(options):
+    """Return *options* as a :class:`FrozenOptions` instance.
+
+    Use this for option sets that are sent repeatedly, such as the
+    options of a :class:`coapy.message.RequestTemplate` or a fixed set
+    of response options, to avoid re-encoding them.  *options* is
+    returned unchanged if it is already frozen.
+    """
+    if isinstance(options, FrozenOptions):
+        return options
+    return FrozenOptions(options)
+
+
+encoded_options_cache = coapy.util.LRUCache(256)
+"""A :class:`coapy.util.LRUCache` used by :func:`encode_options`.
+Keys are the :attr:`FrozenOptions.key` of the options being encoded,
+and values are their packed representation.  Only option sets that
+are frozen or consist of :func:`interned<intern_option>` options are
+cached, so that one-off option sets do not displace those that recur.  Its
+:attr:`capacity<coapy.util.LRUCache.capacity>` may be changed, and
+its statistics show how effective it is for an application's traffic.
+"""
+
+
+def _encode_key(key):
+    # Encode options given as (number, packed_value) pairs in
+    # canonical order.
+    last_number = 0
+    packed = []
+    for (number, pvalue) in key:
+        (od, odx) = _option_field(number - last_number)
+        (ol, olx) = _option_field(len(pvalue))
+        last_number = number
+        packed.extend((_octets[(od << 4) | ol], odx, olx, pvalue))
+    return b''.join(packed)
 
 
 def encode_options(options):
@@ -713,32 +1172,166 @@ def encode_options(options):
     of *options* after they have been :func:`sorted<sorted_options>`.
     It may raise an exception if an option's value cannot be encoded,
     but performs no semantic
-    validation."""
+    validation.
+
+    If *options* is a :class:`FrozenOptions` instance, or all of its
+    options are :meth:`frozen<UrOption.is_frozen>` (e.g.
+    :func:`interned<intern_option>`), the result is retained in
+    :data:`encoded_options_cache`, so encoding an equivalent set of
+    options again costs only the construction of the cache key, or
+    nothing beyond a lookup for a :class:`FrozenOptions` instance."""
+    if isinstance(options, FrozenOptions):
+        key = options.key
+    else:
+        if not isinstance(options, OptionList):
+            options = sorted_options(options)
+        key = tuple((_o.number, _o.packed_value) for _o in options)
+        for opt in options:
+            if not opt.is_frozen():
+                return _encode_key(key)
+    packed = encoded_options_cache.get(key)
+    if packed is None:
+        packed = _encode_key(key)
+        encoded_options_cache[key] = packed
+    return packed
+
+
+def encode_options_into(options, buffer, offset=0):
+    """Encode a set of options directly into *buffer*.
+
+    This writes the same octets as :func:`encode_options` into
+    *buffer*, which must be a writable object supporting the buffer
+    interface such as :class:`python:bytearray` or a
+    :class:`python:memoryview` of one, starting at *offset*.  It
+    returns the offset following the last octet written.
+
+    *buffer* is not resized.  If the encoded options do not fit
+    :exc:`ValueError<python:exceptions.ValueError>` is raised; the
+    content of *buffer* following *offset* is then unspecified.
+    """
+    view = memoryview(buffer)
+    end = len(view)
+    if not isinstance(options, (OptionList, FrozenOptions)):
+        options = sorted_options(options)
     last_number = 0
-    packed = []
-    for opt in sorted_options(options):
-        delta = opt.number - last_number
-        last_number = opt.number
+    for opt in options:
+        number = opt.number
         pvalue = opt.packed_value
-        (od, odx) = _optionint_helper.option_encoding(delta)
-        (ol, olx) = _optionint_helper.option_encoding(len(pvalue))
-        encoded = struct.pack(str('B'), (od << 4) | ol)
-        encoded += odx + olx + pvalue
-        packed.append(encoded)
-    return b''.join(packed)
+        (od, odx) = _option_field(number - last_number)
+        (ol, olx) = _option_field(len(pvalue))
+        last_number = number
+        if (offset + 1 + len(odx) + len(olx) + len(pvalue)) > end:
+            raise ValueError(buffer)
+        _pack_B_into(view, offset, (od << 4) | ol)
+        offset += 1
+        for field in (odx, olx, pvalue):
+            if field:
+                nend = offset + len(field)
+                view[offset:nend] = field
+                offset = nend
+    return offset
+
+
+def index_options_from(buffer, offset=0):
+    """Locate the options encoded in *buffer* starting at *offset*
+    without creating any option instances.
+
+    *buffer* is as with :func:`decode_options_from`.  Returns ``(index,
+    offset)`` where *index* is a tuple with one entry ``(number,
+    start, end)`` per option, giving the option number and the
+    position of its packed value within *buffer*, and *offset* is as
+    with :func:`decode_options_from`.  The index may be passed with
+    the same *buffer* to :func:`options_from_index` to create the
+    options.
+
+    This will raise :exc:`OptionDecodeError` if the option data is
+    malformed, including when an option extends past the end of
+    *buffer*.
+    """
+    view = memoryview(buffer)
+    end = len(view)
+    option_number = 0
+    index = []
+    while offset < end:
+        odl = _unpack_B(view, offset)[0]
+        if 0xFF == odl:
+            break
+        offset += 1
+        decoder = _option_header_decoders[odl]
+        if decoder is None:
+            raise OptionDecodeError(odl, view[offset:].tobytes())
+        (delta, length, unpack_from, size, delta_extended, length_extended) = decoder
+        vstart = offset
+        if unpack_from is not None:
+            vstart += size
+            if vstart > end:
+                raise OptionDecodeError(odl, view[offset:].tobytes())
+            ext = unpack_from(view, offset)
+            if delta_extended:
+                delta += ext[0]
+            if length_extended:
+                length += ext[-1]
+        vend = vstart + length
+        if vend > end:
+            raise OptionDecodeError(odl, view[offset:].tobytes())
+        option_number += delta
+        index.append((option_number, vstart, vend))
+        offset = vend
+    return (tuple(index), offset)
+
+
+def options_from_index(buffer, index):
+    """Create the options located by :func:`index_options_from`.
+
+    *buffer* must be the buffer that was indexed, and *index* the
+    resulting index.  Returns a list of :class:`UrOption` (subclass)
+    instances, in which options that are unknown to the infrastructure
+    or that do not satisfy the length constraints of their registered
+    type are instances of :class:`UnrecognizedOption`.
+    """
+    view = memoryview(buffer)
+    options = []
+    for (number, vstart, vend) in index:
+        option_type = _lookup_option(number)
+        packed = view[vstart:vend].tobytes()
+        opt = None
+        if option_type is not None:
+            try:
+                if option_type._intern_decoded:
+                    opt = _interned_from_packed(option_type, packed)
+                else:
+                    opt = option_type(packed_value=packed)
+            except OptionLengthError:
+                pass
+        if opt is None:
+            opt = UnrecognizedOption(number, packed_value=packed)
+        options.append(opt)
+    return options
+
+
+def decode_options_from(buffer, offset=0):
+    """Extract a list of options from *buffer* starting at *offset*.
 
+    *buffer* may be :class:`bytes`, a :class:`python:bytearray`, or a
+    :class:`python:memoryview`.  The option headers are decoded in
+    place; the only data copied are the packed values of the options
+    themselves, each of which is sliced out once to construct the
+    option instance.
 
-def _decode_one_option(data):
-    if 0xFF == data[0]:
-        return (None, None, data)
-    odl = data.pop(0)
-    od = (odl >> 4)
-    ol = (odl & 0x0F)
-    if (15 == od) or (15 == ol):
-        raise OptionDecodeError(odl, bytes(data))
-    (delta, data) = _optionint_helper.option_decoding(od, data)
-    (length, data) = _optionint_helper.option_decoding(ol, data)
-    return (delta, length, data)
+    Returns ``(options, offset)`` where *options* is as with
+    :func:`decode_options` and *offset* is the position in *buffer* of
+    the first octet that was not consumed, i.e. either the payload
+    marker or the end of *buffer*.
+
+    This will raise :exc:`OptionDecodeError` if the option data is
+    malformed, including when an option extends past the end of
+    *buffer*.
+    """
+    (index, offset) = index_options_from(buffer, offset)
+    options = None
+    if index:
+        options = options_from_index(buffer, index)
+    return (options, offset)
 
 
 def decode_options(data):
@@ -751,31 +1344,10 @@ def decode_options(data):
     *data* that was not consumed when unpacking the options.
 
     This will raise :exc:`OptionDecodeError` or other exceptions if
-    the option data is malformed, but does no semantic validation"""
-    idx = 0
-    option_number = 0
-    options = []
-    data = bytearray(data)      # avoid 2to3 ord/chr issues
-    while 0 < len(data):
-        (delta, length, data) = _decode_one_option(data)
-        if delta is None:
-            break
-        option_number += delta
-        option_type = find_option(option_number)
-        packed = bytes(data[:length])
-        data = data[length:]
-        opt = None
-        if option_type is not None:
-            try:
-                opt = option_type(packed_value=packed)
-            except OptionLengthError:
-                pass
-        if opt is None:
-            opt = UnrecognizedOption(option_number, packed_value=packed)
-        options.append(opt)
-    if 0 == len(options):
-        options = None
-    return (options, bytes(data))
+    the option data is malformed, but does no semantic validation.
+    See :func:`decode_options_from` for the underlying implementation."""
+    (options, offset) = decode_options_from(data)
+    return (options, memoryview(data)[offset:].tobytes())
 
 
 class UnrecognizedOption (UrOption):
@@ -798,8 +1370,12 @@ class UnrecognizedOption (UrOption):
        recognized option.
     """
 
+    __slots__ = ('__number',)
+
     _RegisterOption = False
     _repeatable = (True, True)
+    _flags = (_F_REQUEST | _F_MULTIPLE_REQUEST | _F_RESPONSE
+              | _F_MULTIPLE_RESPONSE | _F_UNRECOGNIZED)
     format = format_opaque(1034)
     """Unknown options carry their payload as uninterpreted
     :class:`bytes` objects with a maximum length of 1034 octets."""
@@ -852,6 +1428,7 @@ class UriHost (UrOption):
     _repeatable = (False, None)
     format = format_string(255, min_length=1)
     name = 'Uri-Host'
+    _intern_decoded = True
 
 
 class ETag (UrOption):
@@ -888,6 +1465,7 @@ class UriPort (UrOption):
     _repeatable = (False, None)
     format = format_uint(2)
     name = 'Uri-Port'
+    _intern_decoded = True
 
 
 class LocationPath (UrOption):
@@ -910,6 +1488,7 @@ class UriPath (UrOption):
     _repeatable = (True, None)
     format = format_string(255)
     name = 'Uri-Path'
+    _intern_decoded = True
 
 
 class ContentFormat (UrOption):
@@ -920,6 +1499,7 @@ class ContentFormat (UrOption):
     _repeatable = (False, False)
     format = format_uint(2)
     name = 'Content-Format'
+    _intern_decoded = True
 
     media_type_for_content = {}
     """A map from integer content format values
@@ -962,6 +1542,7 @@ class MaxAge (UrOption):
     _repeatable = (None, False)
     format = format_uint(4)
     name = 'Max-Age'
+    _intern_decoded = True
 
 
 class UriQuery (UrOption):
@@ -983,6 +1564,7 @@ class Accept (UrOption):
     _repeatable = (False, None)
     format = format_uint(2)
     name = 'Accept'
+    _intern_decoded = True
 
 
 class LocationQuery (UrOption):
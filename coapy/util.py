@@ -32,6 +32,8 @@ import coapy
 import unicodedata
 import functools
 import bisect
+import itertools
+import math
 import time
 import datetime
 import calendar
@@ -99,12 +101,15 @@ class TimeDueOrdinal(object):
     The intent is that information related to an activity that should
     occur at or after a particular time be held in a subclass of
     :class:`TimeDueOrdinal`.  The priority queue of upcoming activity
-    is implemented using a sorted list, as instances of (subclasses
-    of) :class:`TimeDueOrdinal` are ordered by increasing value of
-    :attr:`time_due` using the features of :mod:`python:bisect`.
-    Insertion, removal, and repositioning of elements in the priority
-    queue may be accomplished using :meth:`queue_insert`,
-    :meth:`queue_remove`, and :meth:`queue_reposition`.
+    is either a :class:`TimeDueQueue` or a sorted list, as instances
+    of (subclasses of) :class:`TimeDueOrdinal` are ordered by
+    increasing value of :attr:`time_due` using the features of
+    :mod:`python:bisect`.  Insertion, removal, and repositioning of
+    elements in the priority queue may be accomplished using
+    :meth:`queue_insert`, :meth:`queue_remove`, and
+    :meth:`queue_reposition`.  These take time proportional to the
+    length of a list, but only to its logarithm for a
+    :class:`TimeDueQueue`.
 
     *time_due* as a keyword parameter initializes :attr:`time_due` and
     is removed from *kw*.  Any positional parameters and remaining
@@ -138,11 +143,17 @@ class TimeDueOrdinal(object):
         *self* must already be in the queue; only its position changes
         (if necessary).
         """
-        bisect.insort(queue, queue.pop(queue.index(self)))
+        if isinstance(queue, TimeDueQueue):
+            queue.reposition(self)
+        else:
+            bisect.insort(queue, queue.pop(queue.index(self)))
 
     def queue_insert(self, queue):
         """Insert this entry into *queue*."""
-        bisect.insort(queue, self)
+        if isinstance(queue, TimeDueQueue):
+            queue.insert(self)
+        else:
+            bisect.insort(queue, self)
 
     def queue_remove(self, queue):
         """Remove this entry from *queue*."""
@@ -152,11 +163,14 @@ class TimeDueOrdinal(object):
     def queue_ready_prefix(queue, now=None):
         """Return the elements of *queue* that are due.
 
-        *queue* is a sorted list of :class:`TimeDueOrdinal` instances.
-        *now* is the timestamp, and defaults to :func:`coapy.clock`.
-        Elements are due when :attr:`time_due` <= *now*.
+        *queue* is a :class:`TimeDueQueue` or a sorted list of
+        :class:`TimeDueOrdinal` instances.  *now* is the timestamp,
+        and defaults to :func:`coapy.clock`.  Elements are due when
+        :attr:`time_due` <= *now*.
         """
 
+        if isinstance(queue, TimeDueQueue):
+            return queue.ready(now)
         if now is None:
             now = coapy.clock()
         ub = 0
@@ -165,6 +179,589 @@ class TimeDueOrdinal(object):
         return list(queue[:ub])
 
 
+class TimeDueQueue (object):
+    """A priority queue of :class:`TimeDueOrdinal` instances.
+
+    Elements are held in a binary heap ordered by the
+    :attr:`TimeDueOrdinal.time_due` they had when last placed, with
+    ties resolved in favor of the element placed first.  The position
+    of each element is indexed, so :meth:`insert`, :meth:`remove`,
+    and :meth:`reposition` take logarithmic time and membership tests
+    take constant time.  :meth:`ready` examines only the due elements
+    and their immediate successors in the heap.
+
+    The queue may be used as a read-only sequence in order of
+    increasing :attr:`time_due`.  Obtaining the first element is
+    cheap; any other index, or iteration, sorts a copy of the queue.
+
+    The elements are compared by identity.  An element may be in at
+    most one position in the queue, and must be repositioned whenever
+    its :attr:`time_due` changes.
+    """
+
+    # Each heap node is a list [time_due, sequence, element].  The
+    # sequence is unique, so comparisons of nodes never compare
+    # elements.  __position maps the id of each element to the index
+    # of its node in __heap.
+
+    def __init__(self, elements=()):
+        self.__heap = []
+        self.__position = {}
+        self.__sequence = itertools.count()
+        for elt in elements:
+            self.insert(elt)
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def __contains__(self, element):
+        pos = self.__position.get(id(element))
+        return (pos is not None) and (self.__heap[pos][2] is element)
+
+    def __iter__(self):
+        return iter(self.sorted())
+
+    def __getitem__(self, index):
+        if 0 == index:
+            if not self.__heap:
+                raise IndexError(index)
+            return self.__heap[0][2]
+        return self.sorted()[index]
+
+    def sorted(self):
+        """Return a list of the elements in the order they will become
+        due."""
+        return [_n[2] for _n in sorted(self.__heap)]
+
+    def insert(self, element):
+        """Add *element* to the queue at the position determined by
+        its :attr:`time_due<TimeDueOrdinal.time_due>`.
+
+        :exc:`ValueError<python:exceptions.ValueError>` is raised if
+        *element* is already in the queue."""
+        if element in self:
+            raise ValueError(element)
+        heap = self.__heap
+        heap.append([element.time_due, next(self.__sequence), element])
+        self.__sift_up(len(heap) - 1)
+
+    def remove(self, element):
+        """Remove *element* from the queue.
+
+        :exc:`ValueError<python:exceptions.ValueError>` is raised if
+        *element* is not in the queue."""
+        if element not in self:
+            raise ValueError(element)
+        pos = self.__position.pop(id(element))
+        heap = self.__heap
+        last = heap.pop()
+        if pos < len(heap):
+            heap[pos] = last
+            self.__restore(pos)
+
+    def reposition(self, element):
+        """Move *element*, which must be in the queue, to the position
+        determined by its current :attr:`time_due
+        <TimeDueOrdinal.time_due>`.  It is placed after other elements
+        with the same :attr:`time_due<TimeDueOrdinal.time_due>`."""
+        if element not in self:
+            raise ValueError(element)
+        pos = self.__position[id(element)]
+        node = self.__heap[pos]
+        node[0] = element.time_due
+        node[1] = next(self.__sequence)
+        self.__restore(pos)
+
+    def ready(self, now=None):
+        """Return a list of the elements that are due, in order.
+
+        *now* is the timestamp, and defaults to :func:`coapy.clock`.
+        Elements are due when :attr:`time_due<TimeDueOrdinal.time_due>`
+        <= *now*.  The elements remain in the queue."""
+        if now is None:
+            now = coapy.clock()
+        heap = self.__heap
+        limit = len(heap)
+        due = []
+        stack = [0] if heap else []
+        while stack:
+            pos = stack.pop()
+            node = heap[pos]
+            if node[0] <= now:
+                due.append(node)
+                child = 2 * pos + 1
+                if child < limit:
+                    stack.append(child)
+                    if child + 1 < limit:
+                        stack.append(child + 1)
+        due.sort()
+        return [_n[2] for _n in due]
+
+    def clear(self):
+        """Remove all elements from the queue."""
+        self.__heap[:] = []
+        self.__position.clear()
+
+    def __restore(self, pos):
+        heap = self.__heap
+        if (0 < pos) and (heap[pos] < heap[(pos - 1) >> 1]):
+            self.__sift_up(pos)
+        else:
+            self.__sift_down(pos)
+
+    def __sift_up(self, pos):
+        heap = self.__heap
+        position = self.__position
+        node = heap[pos]
+        while 0 < pos:
+            parent = (pos - 1) >> 1
+            pnode = heap[parent]
+            if not (node < pnode):
+                break
+            heap[pos] = pnode
+            position[id(pnode[2])] = pos
+            pos = parent
+        heap[pos] = node
+        position[id(node[2])] = pos
+
+    def __sift_down(self, pos):
+        heap = self.__heap
+        position = self.__position
+        limit = len(heap)
+        node = heap[pos]
+        child = 2 * pos + 1
+        while child < limit:
+            right = child + 1
+            if (right < limit) and (heap[right] < heap[child]):
+                child = right
+            cnode = heap[child]
+            if not (cnode < node):
+                break
+            heap[pos] = cnode
+            position[id(cnode[2])] = pos
+            pos = child
+            child = 2 * pos + 1
+        heap[pos] = node
+        position[id(node[2])] = pos
+
+
+class TimerWheel (object):
+    """A hierarchical timing wheel of :class:`TimeDueOrdinal` instances.
+
+    Time is divided into ticks of *granularity* in the units of
+    :func:`coapy.clock`, and each element is due at the first tick
+    boundary at or after its :attr:`time_due<TimeDueOrdinal.time_due>`.
+    Elements due in the same tick are coalesced and returned together
+    by :meth:`expire`; they are never returned early, but may be
+    returned up to one tick late.  Elements that are already due when
+    scheduled are returned by the next :meth:`expire`.
+
+    The wheel has *levels* rings of *slots* slots each.  A slot in the
+    first ring holds the elements due in one tick, and a slot in each
+    subsequent ring spans as many ticks as the whole of the preceding
+    ring.  Elements beyond the span of the last ring are held
+    separately.  Elements move to a lower ring as time advances, so
+    :meth:`schedule` and :meth:`cancel` take constant time, and
+    :meth:`expire` takes time proportional to the number of elements
+    due, plus a bounded amount per occupied slot passed.
+
+    Elements are compared by identity.  Each element is scheduled at
+    most once; scheduling it again moves it to the tick determined by
+    its current :attr:`time_due<TimeDueOrdinal.time_due>`.
+    """
+
+    @property
+    def granularity(self):
+        """The duration of a tick."""
+        return self.__granularity
+
+    @property
+    def slots(self):
+        """The number of slots in each ring."""
+        return self.__slots
+
+    @property
+    def levels(self):
+        """The number of rings."""
+        return self.__levels
+
+    # Each scheduled element is held in a slot dictionary, or in
+    # __ready if it was due in a tick that has already passed, or in
+    # __overflow, as a map from the element id to a node [tick,
+    # sequence, element].  __location maps the element id to the ring
+    # level (-1 for __ready, levels for __overflow) and the slot
+    # dictionary.  __tick is the last tick processed, or None while
+    # the wheel is empty and not anchored to a time.  __earliest
+    # caches the earliest scheduled tick, and is None when it must be
+    # recalculated.  Bit n of __occupied is set when slot n of the
+    # first ring is not empty.
+
+    def __init__(self, granularity=0.1, slots=256, levels=3):
+        if not (0 < granularity):
+            raise ValueError(granularity)
+        if not (2 <= slots):
+            raise ValueError(slots)
+        if not (1 <= levels):
+            raise ValueError(levels)
+        self.__granularity = granularity
+        self.__slots = slots
+        self.__levels = levels
+        self.__rings = [[{} for _ in xrange(slots)] for _ in xrange(levels)]
+        self.__counts = [0] * levels
+        self.__occupied = 0
+        self.__ready = {}
+        self.__overflow = {}
+        self.__location = {}
+        self.__sequence = itertools.count()
+        self.__tick = None
+        self.__earliest = None
+
+    def __len__(self):
+        return len(self.__location)
+
+    def __contains__(self, element):
+        loc = self.__location.get(id(element))
+        return (loc is not None) and (loc[1][id(element)][2] is element)
+
+    def __tick_at(self, when):
+        # The last tick that has ended at or before *when*.
+        granularity = self.__granularity
+        tick = int(math.floor(when / granularity))
+        if (tick + 1) * granularity <= when:
+            tick += 1
+        return tick
+
+    def schedule(self, element):
+        """Schedule *element* to become due at its
+        :attr:`time_due<TimeDueOrdinal.time_due>`, which must not be
+        ``None``.  If *element* is already scheduled it is moved.  An
+        element that is already due is returned by the next
+        :meth:`expire` without waiting for a tick boundary."""
+        time_due = element.time_due
+        if time_due is None:
+            raise ValueError(element)
+        self.cancel(element)
+        now = coapy.clock()
+        if self.__tick is None:
+            self.__tick = self.__tick_at(now)
+        tick = int(math.ceil(time_due / self.__granularity))
+        if time_due <= now:
+            tick = min(tick, self.__tick)
+        self.__place([tick, next(self.__sequence), element])
+        if (self.__earliest is not None) and (tick < self.__earliest):
+            self.__earliest = tick
+
+    def cancel(self, element):
+        """Remove *element* from the wheel.
+
+        Returns ``True`` if *element* was scheduled and ``False`` if it
+        was not."""
+        if element not in self:
+            return False
+        key = id(element)
+        (level, slot) = self.__location.pop(key)
+        node = slot.pop(key)
+        if 0 <= level < self.__levels:
+            self.__counts[level] -= 1
+            if (0 == level) and not slot:
+                self.__occupied &= ~(1 << (node[0] % self.__slots))
+        if node[0] == self.__earliest:
+            self.__earliest = None
+        if not self.__location:
+            self.__clear()
+        return True
+
+    def __place(self, node):
+        key = id(node[2])
+        delta = node[0] - self.__tick
+        if 0 >= delta:
+            level = -1
+            slot = self.__ready
+        else:
+            slots = self.__slots
+            span = 1
+            level = 0
+            while level < self.__levels:
+                if delta < span * slots:
+                    index = (node[0] // span) % slots
+                    slot = self.__rings[level][index]
+                    self.__counts[level] += 1
+                    if 0 == level:
+                        self.__occupied |= 1 << index
+                    break
+                span *= slots
+                level += 1
+            else:
+                slot = self.__overflow
+        slot[key] = node
+        self.__location[key] = (level, slot)
+
+    def __clear(self):
+        # Detach the empty wheel from time, so the next element to be
+        # scheduled re-anchors it to the clock.
+        self.__tick = None
+        self.__earliest = None
+
+    def next_deadline(self):
+        """Return the time at which :meth:`expire` will next return
+        elements, or ``None`` if no elements are scheduled.
+
+        The value is the end of the tick in which the earliest
+        scheduled element is due, and may be in the past."""
+        if not self.__location:
+            return None
+        earliest = self.__earliest
+        if earliest is None:
+            earliest = self.__earliest = self.__find_earliest()
+        return earliest * self.__granularity
+
+    def __find_earliest(self):
+        candidates = [_n[0] for _n in self.__ready.itervalues()]
+        slots = self.__slots
+        tick = self.__tick
+        span = 1
+        for level in xrange(self.__levels):
+            if self.__counts[level]:
+                ring = self.__rings[level]
+                block = tick // span
+                for offset in xrange(1, slots + 1):
+                    slot = ring[(block + offset) % slots]
+                    if slot:
+                        candidates.extend(_n[0] for _n in slot.itervalues())
+                        break
+            span *= slots
+        candidates.extend(_n[0] for _n in self.__overflow.itervalues())
+        return min(candidates)
+
+    def __next_occupied(self, tick):
+        # The first tick after *tick* whose slot in the first ring is
+        # occupied.  Occupied slots hold the ticks in the following
+        # ring span, so this is found by rotating the bitmap.
+        slots = self.__slots
+        index = (tick + 1) % slots
+        occupied = self.__occupied
+        upper = occupied >> index
+        if upper:
+            return tick + 1 + (upper & -upper).bit_length() - 1
+        lower = occupied & ((1 << index) - 1)
+        return tick + 1 + slots - index + (lower & -lower).bit_length() - 1
+
+    def expire(self, now=None):
+        """Remove and return the elements that are due at *now*.
+
+        *now* defaults to :func:`coapy.clock`.  The elements are
+        returned in order of :attr:`time_due<TimeDueOrdinal.time_due>`,
+        elements with the same value being in the order they were
+        scheduled."""
+        if self.__tick is None:
+            return []
+        if now is None:
+            now = coapy.clock()
+        target = self.__tick_at(now)
+        due = []
+        slots = self.__slots
+        levels = self.__levels
+        counts = self.__counts
+        rings = self.__rings
+        while self.__tick < target:
+            # Skip ticks in which nothing can happen: those before
+            # the next occupied slot of the first ring and before the
+            # next boundary of the lowest occupied higher ring.
+            following = None
+            if counts[0]:
+                following = self.__next_occupied(self.__tick)
+            span = slots
+            for level in xrange(1, levels + 1):
+                if (counts[level] if level < levels else self.__overflow):
+                    boundary = (self.__tick // span + 1) * span
+                    if (following is None) or (boundary < following):
+                        following = boundary
+                    break
+                span *= slots
+            if (following is None) or (following > target):
+                self.__tick = target
+                break
+            tick = self.__tick = following
+            # Cascade the higher rings whose slot begins with this tick.
+            span = slots
+            level = 1
+            while (level <= levels) and (0 == tick % span):
+                if level < levels:
+                    slot = rings[level][(tick // span) % slots]
+                    counts[level] -= len(slot)
+                else:
+                    slot = self.__overflow
+                nodes = list(slot.itervalues())
+                slot.clear()
+                for node in nodes:
+                    self.__place(node)
+                span *= slots
+                level += 1
+            slot = rings[0][tick % slots]
+            if slot:
+                counts[0] -= len(slot)
+                self.__occupied &= ~(1 << (tick % slots))
+                due.extend(slot.itervalues())
+                slot.clear()
+        if self.__ready:
+            due.extend(self.__ready.itervalues())
+            self.__ready.clear()
+        if not due:
+            return []
+        location = self.__location
+        for node in due:
+            del location[id(node[2])]
+        self.__earliest = None
+        if not location:
+            self.__clear()
+        due.sort(key=lambda _n: (_n[2].time_due, _n[1]))
+        return [_n[2] for _n in due]
+
+    def clear(self):
+        """Remove all elements from the wheel."""
+        for ring in self.__rings:
+            for slot in ring:
+                slot.clear()
+        self.__counts = [0] * self.__levels
+        self.__occupied = 0
+        self.__ready.clear()
+        self.__overflow.clear()
+        self.__location.clear()
+        self.__clear()
+
+
+class LRUCache (object):
+    """A bounded mapping that discards its least recently used entries.
+
+    At most *capacity* entries are retained.  Adding an entry to a full
+    cache discards the entry that was least recently added, assigned,
+    or retrieved by :meth:`get`.  Retrievals and discards are counted in
+    :attr:`hits`, :attr:`misses`, and :attr:`evictions`.
+
+    Keys must be hashable.  The cache does not copy keys or values, so
+    both should be immutable.
+    """
+
+    # Entries are held in a dictionary mapping each key to a link
+    # [prev, next, key, value] in a circular doubly-linked list
+    # anchored by __root, in order from least to most recently used.
+
+    @property
+    def capacity(self):
+        """The maximum number of entries retained.  Reducing this
+        discards least recently used entries as necessary.  A
+        capacity of zero disables the cache."""
+        return self.__capacity
+
+    @capacity.setter
+    def capacity(self, value):
+        if 0 > value:
+            raise ValueError(value)
+        self.__capacity = value
+        while len(self.__dict) > value:
+            self.__evict()
+
+    @property
+    def hits(self):
+        """The number of :meth:`get` calls that found their key."""
+        return self.__hits
+
+    @property
+    def misses(self):
+        """The number of :meth:`get` calls that did not find their key."""
+        return self.__misses
+
+    @property
+    def evictions(self):
+        """The number of entries discarded to respect :attr:`capacity`."""
+        return self.__evictions
+
+    def __init__(self, capacity):
+        self.__dict = {}
+        self.__root = root = []
+        root[:] = [root, root, None, None]
+        self.__capacity = 0
+        self.capacity = capacity
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Set :attr:`hits`, :attr:`misses`, and :attr:`evictions` to zero."""
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get(self, key, default=None):
+        """Return the value for *key* and mark it most recently used,
+        or return *default* if *key* is not in the cache."""
+        link = self.__dict.get(key)
+        if link is None:
+            self.__misses += 1
+            return default
+        self.__hits += 1
+        self.__mark_used(link)
+        return link[3]
+
+    def __mark_used(self, link):
+        # Move link to the most recently used end of the list.
+        (prev, next_) = link[:2]
+        prev[1] = next_
+        next_[0] = prev
+        root = self.__root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def __setitem__(self, key, value):
+        link = self.__dict.get(key)
+        if link is not None:
+            link[3] = value
+            self.__mark_used(link)
+            return
+        if 0 == self.__capacity:
+            return
+        if len(self.__dict) >= self.__capacity:
+            self.__evict()
+        root = self.__root
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self.__dict[key] = link
+
+    def __evict(self):
+        root = self.__root
+        oldest = root[1]
+        root[1] = oldest[1]
+        oldest[1][0] = root
+        del self.__dict[oldest[2]]
+        self.__evictions += 1
+
+    def __contains__(self, key):
+        return key in self.__dict
+
+    def __len__(self):
+        return len(self.__dict)
+
+    def clear(self):
+        """Remove all entries.  The statistics are not changed."""
+        self.__dict.clear()
+        root = self.__root
+        root[:] = [root, root, None, None]
+
+
+net_unicode_cache = LRUCache(256)
+"""The :class:`LRUCache` used by :func:`to_net_unicode` for text that
+is not entirely ASCII.  Keys are the original text and values the
+encoded Net-Unicode data."""
+
+url_quote_cache = LRUCache(512)
+"""The :class:`LRUCache` used by :func:`url_quote`.  Keys combine the
+type and value of the text with the *safe* characters."""
+
+url_unquote_cache = LRUCache(512)
+"""The :class:`LRUCache` used by :func:`url_unquote`.  Keys combine
+the type and value of the quoted text."""
+
+
 def to_net_unicode(text):
     """Convert text to Net-Unicode (:rfc:`5198`) data.
 
@@ -176,9 +773,23 @@ def to_net_unicode(text):
     (section 2 item 2), since its use in CoAP is currently limited to
     values of options with format :class:`coapy.option.format_string`
     and diagnostic payloads.
+
+    Text that is entirely ASCII is encoded without normalization.
+    Results for other text are retained in :data:`net_unicode_cache`.
     """
+    if isinstance(text, unicode):
+        # ASCII text is its own NFC form.
+        try:
+            return text.encode('ascii')
+        except UnicodeError:
+            pass
+        data = net_unicode_cache.get(text)
+        if data is not None:
+            return data
     # At first blush, this is Net-Unicode.
-    return unicodedata.normalize('NFC', text).encode('utf-8')
+    data = unicodedata.normalize('NFC', text).encode('utf-8')
+    net_unicode_cache[text] = data
+    return data
 
 
 def to_display_text(data):
@@ -227,14 +838,23 @@ def url_quote(text, safe='/'):
     corresponding :func:`python:urllib.quote` does not tolerate
     Unicode characters and does not like *safe* to be a Unicode
     string as it is since we use unicode_literals).
+
+    Results are retained in :data:`url_quote_cache`.
     """
 
+    # Text and data keys are distinguished because in Python 2 they
+    # may compare equal.
+    key = (type(text), text, safe)
+    quoted = url_quote_cache.get(key)
+    if quoted is not None:
+        return quoted
     if isinstance(text, unicode):
         text = to_net_unicode(text)
     if sys.version_info < (3, 0):
         # Python 2 quote does not like having a Unicode safe string
         safe = str(safe)
     quoted = urllib.quote(text, safe)
+    url_quote_cache[key] = quoted
     return quoted
 
 
@@ -246,13 +866,20 @@ def url_unquote(quoted):
     strings, while in Python 2 the corresponding
     :func:`python:urllib.unquote` does not tolerate Unicode
     characters.
+
+    Results are retained in :data:`url_unquote_cache`.
     """
+    key = (type(quoted), quoted)
+    text = url_unquote_cache.get(key)
+    if text is not None:
+        return text
     if sys.version_info < (3, 0):
         data = bytes(quoted)
         encoded = urllib.unquote(data)
         text = encoded.decode('utf-8')
     else:
         text = urllib.unquote(quoted)
+    url_unquote_cache[key] = text
     return text
 
 
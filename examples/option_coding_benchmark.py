@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Microbenchmark of option and :class:`coapy.option.format_uint` coding.
+
+The option set includes extended deltas and lengths, so every form of
+option header is exercised.  Each operation is timed with
+:mod:`python:timeit` and the best of several repetitions is reported
+in microseconds per call.
+
+  PYTHONPATH=. python examples/option_coding_benchmark.py
+
+:copyright: Copyright 2013, Peter A. Bigot
+:license: Apache-2.0
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import timeit
+import coapy.option
+
+OPTIONS = [coapy.option.UriHost('example.com'),
+           coapy.option.UriPort(5683),
+           coapy.option.UriPath('sensors'),
+           coapy.option.UriPath('temp'),
+           coapy.option.ContentFormat(50),
+           coapy.option.Accept(60),
+           coapy.option.UriQuery('a=1'),
+           coapy.option.Size1(70000),
+           coapy.option.UnrecognizedOption(2000, b'x' * 300)]
+PACKED = coapy.option.encode_options(OPTIONS)
+UINT = coapy.option.format_uint(4)
+
+CASES = (('encode_options', 'O.encode_options(OPTIONS)'),
+         ('index_options_from', 'O.index_options_from(PACKED)'),
+         ('decode_options', 'O.decode_options(PACKED)'),
+         ('uint to_packed x3',
+          'UINT.to_packed(70000); UINT.to_packed(12); UINT.to_packed(0)'),
+         ('uint from_packed x3',
+          "UINT.from_packed(b'\\x01\\x11\\x70'); UINT.from_packed(b'\\x0c');"
+          " UINT.from_packed(b'')"))
+
+
+def main(number=20000, repeat=5):
+    setup = str('import coapy.option as O\n'
+                'from __main__ import OPTIONS, PACKED, UINT')
+    for (label, stmt) in CASES:
+        best = min(timeit.repeat(str(stmt), setup, number=number, repeat=repeat))
+        print('{0:<20s} {1:7.2f} us'.format(label, 1e6 * best / number))
+
+
+if '__main__' == __name__:
+    main()
@@ -91,6 +91,19 @@ class FIFOEndpoint (coapy.endpoint.LocalEndpoint):
             raise socket.error(errno.EAGAIN, 'Resource temporarily unavailable')
         return self.fifo.pop(0)
 
+    def _rawrecvfrom_many(self, bufsize, max_batch):
+        """Remove and return up to *max_batch* tuples from the head of
+        :attr:`fifo`.  If the fifo is empty, raises
+        :exc:`python:socket.error`.
+
+        Overrides :meth:`coapy.endpoint.LocalEndpoint._rawrecvfrom_many`.
+        """
+        if 0 == len(self.fifo):
+            raise socket.error(errno.EAGAIN, 'Resource temporarily unavailable')
+        rv = self.fifo[:max_batch]
+        del self.fifo[:max_batch]
+        return rv
+
 
 class LogHandler_mixin(object):
     """Extension that registers a
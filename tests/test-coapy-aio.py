@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+
+import sys
+import types
+import socket
+import itertools
+import collections
+import unittest
+import coapy
+import coapy.message
+import coapy.option
+import coapy.endpoint
+from coapy.message import *
+from tests.support import *
+
+
+class _Future (object):
+    # The subset of asyncio.Future used by coapy.aio, for running the
+    # FakeLoop tests where neither asyncio nor Trollius is installed.
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._callbacks = []
+        self._state = 'PENDING'
+        self._result = None
+        self._exception = None
+
+    def __complete(self, state):
+        self._state = state
+        callbacks = self._callbacks
+        self._callbacks = []
+        for cb in callbacks:
+            self._loop.call_soon(cb, self)
+
+    def cancel(self):
+        if self.done():
+            return False
+        self.__complete('CANCELLED')
+        return True
+
+    def cancelled(self):
+        return 'CANCELLED' == self._state
+
+    def done(self):
+        return 'PENDING' != self._state
+
+    def result(self):
+        if not self.done() or self.cancelled():
+            raise RuntimeError(self._state)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        if not self.done() or self.cancelled():
+            raise RuntimeError(self._state)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        if self.done():
+            self._loop.call_soon(fn, self)
+        else:
+            self._callbacks.append(fn)
+
+    def set_result(self, result):
+        if self.done():
+            raise RuntimeError(self._state)
+        self._result = result
+        self.__complete('FINISHED')
+
+    def set_exception(self, exception):
+        if self.done():
+            raise RuntimeError(self._state)
+        self._exception = exception
+        self.__complete('FINISHED')
+
+
+try:
+    from coapy.aio import *
+    from coapy.aio import asyncio
+except ImportError:
+    asyncio = None
+    _standin = types.ModuleType(str('asyncio'))
+    _standin.Future = _Future
+    _standin.DatagramProtocol = object
+    _standin.ensure_future = lambda future, loop=None: future
+    sys.modules[str('asyncio')] = _standin
+    try:
+        from coapy.aio import *
+    finally:
+        del sys.modules[str('asyncio')]
+    asyncio = None
+Future = coapy.aio.asyncio.Future
+
+
+class FakeHandle (object):
+    # A callback scheduled on a FakeLoop.
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeTransport (object):
+    # A datagram transport that records what is sent through it.
+
+    def __init__(self, sockname):
+        self.sockname = sockname
+        self.sent = []
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        if 'sockname' == name:
+            return self.sockname
+        return default
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLoop (object):
+    # An event loop whose time is coapy.clock, run explicitly by
+    # run_ready() and advance().
+
+    def __init__(self):
+        self.ready = collections.deque()
+        self.timers = []
+        self.datagram_endpoints = []
+        self.error = None
+
+    def time(self):
+        return coapy.clock()
+
+    def get_debug(self):
+        return False
+
+    def call_soon(self, callback, *args, **kw):
+        handle = FakeHandle(self.time(), callback, args)
+        self.ready.append(handle)
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        handle = FakeHandle(self.time() + delay, callback, args)
+        self.timers.append(handle)
+        return handle
+
+    def pending_timers(self):
+        self.timers = [_h for _h in self.timers if not _h.cancelled]
+        return self.timers
+
+    def create_datagram_endpoint(self, protocol_factory, local_addr=None, family=0):
+        future = Future(loop=self)
+        if self.error is not None:
+            future.set_exception(self.error)
+            return future
+        transport = FakeTransport(local_addr)
+        protocol = protocol_factory()
+        self.datagram_endpoints.append((transport, protocol))
+        future.set_result((transport, protocol))
+        return future
+
+    def run_ready(self):
+        while self.ready:
+            handle = self.ready.popleft()
+            if not handle.cancelled:
+                handle.callback(*handle.args)
+
+    def advance(self, delay=0):
+        coapy.clock.adjust(delay)
+        self.run_ready()
+        while True:
+            due = [_h for _h in self.pending_timers() if _h.when <= self.time()]
+            if not due:
+                break
+            handle = min(due, key=lambda _h: _h.when)
+            self.timers.remove(handle)
+            handle.callback(*handle.args)
+            self.run_ready()
+
+    def advance_to_timer(self):
+        when = min(_h.when for _h in self.pending_timers())
+        self.advance(max(0, when - self.time()))
+
+
+@unittest.skipIf(asyncio is None, 'asyncio not available')
+class TestAsyncioEndpoint (unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.create('127.0.0.1', self.serve)
+        self.client = self.create('127.0.0.1')
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+        self.loop.close()
+
+    def create(self, host, handler=None):
+        future = AsyncioEndpoint.create_endpoint(host=host, port=0,
+                                                 handler=handler, loop=self.loop)
+        return self.loop.run_until_complete(future)
+
+    def serve(self, entry):
+        path = coapy.option.UriPath.first_match(entry.message.options).value
+        if 'ignore' == path:
+            return
+        if 'reset' == path:
+            entry.reply(reset=True)
+            return
+        if 'separate' == path:
+            entry.reply()
+            rsp = entry.message.create_response(SuccessResponse, piggy_backed=False,
+                                                confirmable=True,
+                                                code=SuccessResponse.Content)
+            self.separate = self.server.send_async(rsp, entry.message.source_endpoint)
+            return
+        rsp = entry.message.create_response(SuccessResponse,
+                                            code=SuccessResponse.Content)
+        rsp.payload = path.encode('utf-8')
+        entry.reply(message=rsp)
+
+    def wait(self, future):
+        return self.loop.run_until_complete(asyncio.wait_for(future, 5, loop=self.loop))
+
+    def testRequest(self):
+        self.assertTrue(self.server.loop is self.loop)
+        req = self.server.create_request('/hello', confirmable=True)
+        rsp = self.wait(self.client.request(req))
+        self.assertTrue(isinstance(rsp, SuccessResponse))
+        self.assertEqual(b'hello', rsp.payload)
+        self.assertEqual(req.token, rsp.token)
+
+    def testSeparateResponse(self):
+        req = self.server.create_request('/separate', confirmable=True)
+        rsp = self.wait(self.client.request(req))
+        self.assertTrue(rsp.is_confirmable())
+        self.assertEqual(req.token, rsp.token)
+        ce = self.wait(self.separate)
+        self.assertTrue(ce.reply_message.is_acknowledgement())
+
+    def testSendAsync(self):
+        req = self.server.create_request('/ignore', confirmable=False, token=b'n')
+        ce = self.wait(self.client.send_async(req))
+        self.assertEqual(ce.ST_completed, ce.state)
+        self.assertEqual(1, ce.transmissions)
+        self.assertTrue(ce.reply_message is None)
+
+    def testReset(self):
+        req = self.server.create_request('/reset', confirmable=True)
+        with self.assertRaises(RequestError) as cm:
+            self.wait(self.client.request(req))
+        self.assertEqual(RequestError.RESET, cm.exception.args[0])
+
+
+_ports = itertools.count(40000)
+
+
+class TestFakeLoop (DeterministicBEBO_mixin,
+                    ManagedClock_mixin,
+                    unittest.TestCase):
+    def setUp(self):
+        super(TestFakeLoop, self).setUp()
+        self.loop = FakeLoop()
+        self.remote = coapy.endpoint.Endpoint(host='127.0.0.1', port=coapy.COAP_PORT)
+        self.received = []
+
+    def create(self, handler=None):
+        future = AsyncioEndpoint.create_endpoint(host='127.0.0.1', port=next(_ports),
+                                                 handler=handler, loop=self.loop)
+        self.loop.run_ready()
+        return future.result()
+
+    def deliver(self, ep, msg):
+        (transport, protocol) = self.loop.datagram_endpoints[-1]
+        protocol.datagram_received(msg.to_packed(), self.remote.sockaddr)
+        self.loop.run_ready()
+
+    def sent(self, ep):
+        return [Message.from_packed(_d) for (_d, _a) in ep.transport.sent]
+
+    def testCreateEndpoint(self):
+        future = AsyncioEndpoint.create_endpoint(host='127.0.0.1', port=next(_ports),
+                                                 handler=self.received.append,
+                                                 loop=self.loop)
+        self.assertFalse(future.done())
+        (transport, protocol) = self.loop.datagram_endpoints[0]
+        # A datagram that arrives before the endpoint is attached is
+        # held until it is.
+        req = self.remote.create_request('/early', confirmable=False)
+        req.messageID = 1
+        protocol.datagram_received(req.to_packed(), self.remote.sockaddr)
+        self.loop.run_ready()
+        ep = future.result()
+        self.assertTrue(ep.loop is self.loop)
+        self.assertTrue(ep.transport is transport)
+        self.assertEqual(transport.sockname, ep.sockaddr[:2])
+        self.assertEqual(1, len(self.received))
+        self.assertEqual(1, self.received[0].message_id)
+        self.assertTrue(self.received[0].message.source_endpoint is self.remote)
+        ep.close()
+        self.assertTrue(transport.closed)
+        self.assertTrue(ep.transport is None)
+
+        # Failure to create the transport is passed to the future.
+        self.loop.error = socket.error('no transport')
+        future = AsyncioEndpoint.create_endpoint(host='127.0.0.1', port=next(_ports),
+                                                 loop=self.loop)
+        self.loop.run_ready()
+        self.assertTrue(future.exception() is self.loop.error)
+
+        # A transport created after the endpoint future is cancelled
+        # is closed.
+        self.loop.error = None
+        future = AsyncioEndpoint.create_endpoint(host='127.0.0.1', port=next(_ports),
+                                                 loop=self.loop)
+        future.cancel()
+        self.loop.run_ready()
+        self.assertTrue(self.loop.datagram_endpoints[-1][0].closed)
+
+    def testRequest(self):
+        ep = self.create()
+        future = ep.request(self.remote.create_request('/path', confirmable=True))
+        # Transmission waits for the loop, through a single timer.
+        self.assertEqual(1, len(self.loop.pending_timers()))
+        self.assertEqual([], ep.transport.sent)
+        self.loop.advance()
+        [req] = self.sent(ep)
+        self.assertEqual(self.remote.sockaddr, ep.transport.sent[0][1])
+        self.assertTrue(req.is_confirmable())
+        self.assertFalse(future.done())
+        # A response with another token does not complete the
+        # request.
+        other = req.create_response(SuccessResponse, piggy_backed=False,
+                                    code=SuccessResponse.Content)
+        other.token = b'other'
+        other.messageID = 100
+        self.deliver(ep, other)
+        self.assertFalse(future.done())
+        rsp = req.create_response(SuccessResponse, code=SuccessResponse.Content)
+        rsp.payload = b'data'
+        self.deliver(ep, rsp)
+        self.assertTrue(future.done())
+        self.assertEqual(b'data', future.result().payload)
+        self.assertEqual(req.token, future.result().token)
+        # Nothing remains to be done until the cache entries expire.
+        [timer] = self.loop.pending_timers()
+        self.assertTrue(timer.when > coapy.clock())
+        while self.loop.pending_timers():
+            self.loop.advance_to_timer()
+        self.assertEqual(0, len(ep.timer_wheel))
+
+    def testSeparateResponse(self):
+        ep = self.create()
+        future = ep.request(self.remote.create_request('/path', confirmable=True))
+        self.loop.advance()
+        [req] = self.sent(ep)
+        self.deliver(ep, req.create_reply())
+        self.assertFalse(future.done())
+        # Retransmission stops once the request is acknowledged.
+        self.loop.advance(coapy.transmissionParameters.MAX_TRANSMIT_WAIT)
+        self.assertEqual(1, len(ep.transport.sent))
+        rsp = req.create_response(SuccessResponse, piggy_backed=False, confirmable=True,
+                                  code=SuccessResponse.Content)
+        rsp.messageID = 200
+        self.deliver(ep, rsp)
+        self.assertEqual(req.token, future.result().token)
+        ack = self.sent(ep)[-1]
+        self.assertTrue(ack.is_acknowledgement())
+        self.assertEqual(200, ack.messageID)
+
+    def testTimeout(self):
+        tp = coapy.transmissionParameters
+        ep = self.create()
+        future = ep.request(self.remote.create_request('/path', confirmable=True))
+        sent_clk = []
+        while not future.done():
+            self.assertEqual(1, len(self.loop.pending_timers()))
+            self.loop.advance_to_timer()
+            sent_clk.extend([coapy.clock()] * (len(ep.transport.sent) - len(sent_clk)))
+        # Retransmissions follow the binary exponential backoff.
+        to = tp.ACK_TIMEOUT
+        expected = [0.0]
+        for _ in xrange(tp.MAX_RETRANSMIT):
+            expected.append(expected[-1] + to)
+            to += to
+        self.assertEqual(expected, sent_clk[:len(expected)])
+        self.assertTrue(coapy.clock() >= tp.MAX_TRANSMIT_WAIT)
+        self.assertTrue(isinstance(future.exception(), RequestError))
+        self.assertEqual(RequestError.TIMEOUT, future.exception().args[0])
+
+    def testReset(self):
+        ep = self.create()
+        future = ep.request(self.remote.create_request('/path', confirmable=True))
+        self.loop.advance()
+        [req] = self.sent(ep)
+        self.deliver(ep, req.create_reply(reset=True))
+        self.assertEqual(RequestError.RESET, future.exception().args[0])
+
+    def testSendAsync(self):
+        ep = self.create()
+        future = ep.send_async(self.remote.create_request('/path', confirmable=False))
+        self.assertFalse(future.done())
+        self.loop.advance()
+        ce = future.result()
+        self.assertEqual(ce.ST_completed, ce.state)
+        self.assertEqual(1, ce.transmissions)
+        # The entry leaves the sent cache when it expires.
+        while self.loop.pending_timers():
+            self.loop.advance_to_timer()
+        self.assertTrue(ce.cache is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
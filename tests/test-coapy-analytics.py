@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+
+import unittest
+import random
+import coapy.option
+from coapy.message import *
+
+try:
+    import numpy
+    from coapy.analytics import *
+except ImportError:
+    numpy = None
+
+
+def corpus():
+    """Datagrams covering each outcome of Message.from_packed."""
+    rng = random.Random(23)
+    opts = [coapy.option.UriPath('sensor'), coapy.option.UriPath('t' * 20),
+            coapy.option.ContentFormat(0), coapy.option.Size1(70000),
+            coapy.option.UnrecognizedOption(2000, b'x' * 300)]
+    data = [b'', b'\x40\x01\x12', b'\x80\x01\x12\x34',
+            b'\x49\x01\x12\x34',
+            b'\x40\x00\x12\x34', b'\x40\x00\x12\x34x', b'\x41\x00\x12\x34x',
+            b'\x43\x01\x12\x3412',
+            b'\x40\x01\x12\x34\xf1', b'\x40\x01\x12\x34\x1f', b'\x40\x01\x12\x34\xd0',
+            b'\x40\x01\x12\x34\xe0\x01', b'\x40\x01\x12\x34\x13ab',
+            b'\x40\x01\x12\x34\xff', b'\x40\x01\x12\x34\xb1s\xff',
+            b'\x40\x21\x12\x34', b'\x40\xc1\x12\x34\xb1s',
+            b'\x40\x01\x12\x34\xb1\xff', b'\x40\x01\x12\x34\xb2\xc3\xa9',
+            b'\x40\xc1\x12\x34\xb1\xff', b'\x40\x01\x12\x34\x81\xff',
+            b'\x60\x00\x12\x34', b'\x70\x00\x12\x34']
+    for i in xrange(200):
+        m = Request(confirmable=rng.choice((True, False)),
+                    code=rng.choice((Request.GET, Request.POST)),
+                    messageID=rng.randint(0, 3),
+                    token=bytes(bytearray(rng.randint(0, 255) for _ in xrange(rng.randint(0, 8)))),
+                    options=rng.sample(opts, rng.randint(0, len(opts))),
+                    payload=rng.choice((None, b'p', b'payload' * 10)))
+        data.append(m.to_packed())
+    return data
+
+
+@unittest.skipIf(numpy is None, 'NumPy not available')
+class TestDecodeHeaders (unittest.TestCase):
+    def testMatchesFromPacked(self):
+        data = corpus()
+        records = [(float(_i), ('10.0.0.{0:d}'.format(_i % 3), 5683), ('::1', 5683), _d)
+                   for (_i, _d) in enumerate(data)]
+        batch = DatagramBatch(records)
+        self.assertEqual(len(data), len(batch))
+        self.assertEqual(4, len(batch.peers))
+        self.assertEqual(data[30], batch.datagram(30))
+        hc = decode_headers(batch)
+        seen = set()
+        for (i, d) in enumerate(data):
+            try:
+                m = Message.from_packed(d)
+            except MessageFormatError as e:
+                self.assertEqual(e.args[0], STATUS_DIAGNOSTICS[hc.status[i]], d)
+                self.assertEqual(e.args[1]['messageID'], hc.messageID[i])
+                self.assertEqual(e.args[1]['type'], hc.type[i])
+                seen.add(e.args[0])
+                continue
+            except UnicodeDecodeError:
+                self.assertEqual(STATUS_INVALID_UTF8, hc.status[i], d)
+                seen.add(STATUS_INVALID_UTF8)
+                continue
+            if m is None:
+                self.assertEqual(STATUS_IGNORED, hc.status[i])
+                continue
+            self.assertEqual(STATUS_OK, hc.status[i], d)
+            self.assertEqual(m.messageType, hc.type[i])
+            self.assertEqual(m.packed_code, hc.code[i])
+            self.assertEqual(m.messageID, hc.messageID[i])
+            self.assertEqual(len(m.token), hc.token_length[i])
+            self.assertEqual(len(m.payload or b''), hc.payload_length[i])
+            self.assertEqual(len(m.options), hc.option_count[i])
+            sel = hc.option_message == i
+            self.assertEqual([_o.number for _o in m.options], list(hc.option_number[sel]))
+            self.assertEqual([len(_o.packed_value) for _o in m.options],
+                             list(hc.option_length[sel]))
+        self.assertEqual(set(STATUS_DIAGNOSTICS[2:-1] + (STATUS_INVALID_UTF8,)), seen)
+        self.assertEqual(len(hc.option_message), hc.option_count[hc.status == STATUS_OK].sum())
+
+    def testStatistics(self):
+        records = []
+        for (i, (src, mid)) in enumerate([('a', 1), ('a', 2), ('b', 1), ('a', 1), ('a', 1)]):
+            m = Request(confirmable=True, code=Request.GET, messageID=mid,
+                        options=[coapy.option.UriPath('p')])
+            records.append((10.0 * i, (src, 1), ('c', 2), m.to_packed()))
+        records.append((60.0, ('a', 1), ('c', 2), b'\x60\x00\x00\x01'))
+        batch = DatagramBatch(records)
+        hc = decode_headers(batch)
+        self.assertEqual([5, 0, 1, 0], list(type_counts(hc)))
+        self.assertEqual([4, 0, 1, 0], list(type_counts(hc, batch.source == 0)))
+        self.assertEqual(5, code_counts(hc)[1])
+        self.assertEqual(6, token_length_counts(hc)[0])
+        (numbers, counts) = option_number_counts(hc)
+        self.assertEqual([coapy.option.UriPath.number], list(numbers))
+        self.assertEqual([5], list(counts))
+        intervals = messageID_reuse_intervals(hc, batch)
+        self.assertTrue(numpy.isnan(intervals[[0, 1, 2, 5]]).all())
+        self.assertEqual([30.0, 10.0], list(intervals[3:5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright 2013, Peter A. Bigot
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain a
+# copy of the License at:
+#
+#            http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+
+import unittest
+import io
+import os
+import socket
+import struct
+import tempfile
+import coapy.message
+from coapy.capture import *
+
+GET = b'\x40\x01\x12\x34\xb6sensor'
+ACK = b'\x60\x45\x12\x34\xffdata'
+
+
+def udp4(src, dst, sport, dport, payload, fragment=0):
+    udp = struct.pack(str('!HHHH'), sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack(str('!BBHHHBBH4s4s'), 0x45, 0, 20 + len(udp), 0, fragment, 64, 17, 0,
+                     socket.inet_pton(socket.AF_INET, src),
+                     socket.inet_pton(socket.AF_INET, dst))
+    return ip + udp
+
+
+def udp6(src, dst, sport, dport, payload):
+    udp = struct.pack(str('!HHHH'), sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack(str('!IHBB16s16s'), 6 << 28, len(udp), 17, 64,
+                     socket.inet_pton(socket.AF_INET6, src),
+                     socket.inet_pton(socket.AF_INET6, dst))
+    return ip + udp
+
+
+def ethernet(packet, ethertype=0x0800, vlan=False):
+    hdr = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb'
+    if vlan:
+        hdr += struct.pack(str('!HH'), 0x8100, 7)
+    return hdr + struct.pack(str('!H'), ethertype) + packet
+
+
+def pcap(linktype, frames, order='<'):
+    order = str(order)
+    data = struct.pack(order + str('IHHiIII'), 0xa1b2c3d4, 2, 4, 0, 0, 65535, linktype)
+    for (ts, frame) in frames:
+        data += struct.pack(order + str('IIII'), int(ts), int(round((ts % 1) * 1e6)),
+                            len(frame), len(frame))
+        data += frame
+    return data
+
+
+def pcapng_block(block_type, body):
+    length = 12 + len(body)
+    return struct.pack(str('<II'), block_type, length) + body + struct.pack(str('<I'), length)
+
+
+def pcapng(linktype, frames, tsresol=None):
+    data = pcapng_block(0x0a0d0d0a, struct.pack(str('<IHHq'), 0x1a2b3c4d, 1, 0, -1))
+    options = b''
+    if tsresol is not None:
+        options = struct.pack(str('<HHB3x'), 9, 1, tsresol) + struct.pack(str('<HH'), 0, 0)
+    data += pcapng_block(1, struct.pack(str('<HHI'), linktype, 0, 0) + options)
+    data += pcapng_block(2989, b'skipped!')
+    for (ticks, frame) in frames:
+        pad = b'\x00' * (-len(frame) % 4)
+        if ticks is None:
+            data += pcapng_block(3, struct.pack(str('<I'), len(frame)) + frame + pad)
+        else:
+            data += pcapng_block(6, struct.pack(str('<IIIII'), 0, ticks >> 32, ticks & 0xFFFFFFFF,
+                                                len(frame), len(frame)) + frame + pad)
+    return data
+
+
+class TestPcap (unittest.TestCase):
+    def testEthernet(self):
+        data = pcap(1, [(1000.5, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683, GET))),
+                        (1001.0, ethernet(udp6('::1', 'fe80::2', 5683, 40000, ACK), 0x86dd, True)),
+                        (1002.0, ethernet(b'\x00' * 28, 0x0806)),
+                        (1003.0, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683,
+                                               GET, 0x2000)))])
+        dgs = list(datagrams(data))
+        self.assertEqual(2, len(dgs))
+        (ts, src, dst, dg) = dgs[0]
+        self.assertAlmostEqual(1000.5, ts)
+        self.assertEqual(('10.0.0.1', 40000), src)
+        self.assertEqual(('10.0.0.2', 5683), dst)
+        self.assertEqual(GET, bytes(dg))
+        (ts, src, dst, dg) = dgs[1]
+        self.assertEqual(('::1', 5683), src)
+        self.assertEqual(('fe80::2', 40000), dst)
+        self.assertEqual(ACK, bytes(dg))
+
+    def testBigEndianRaw(self):
+        data = pcap(101, [(3.25, udp4('10.0.0.1', '10.0.0.2', 1, 2, GET))], '>')
+        self.assertEqual([(3.25, ('10.0.0.1', 1), ('10.0.0.2', 2), GET)],
+                         [(_t, _s, _d, bytes(_g)) for (_t, _s, _d, _g) in pcap_datagrams(data)])
+
+    def testTruncated(self):
+        data = pcap(101, [(3.25, udp4('10.0.0.1', '10.0.0.2', 1, 2, GET))])
+        with self.assertRaises(CaptureFormatError) as cm:
+            list(datagrams(data[:-1]))
+        self.assertEqual(CaptureFormatError.TRUNCATED, cm.exception.args[0])
+        with self.assertRaises(CaptureFormatError) as cm:
+            list(datagrams(b'\x00' * 32))
+        self.assertEqual(CaptureFormatError.UNRECOGNIZED_FORMAT, cm.exception.args[0])
+
+
+class TestPcapng (unittest.TestCase):
+    def testBasic(self):
+        data = pcapng(1, [(1500000000, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683, GET))),
+                          (None, ethernet(udp4('10.0.0.2', '10.0.0.1', 5683, 40000, ACK)))])
+        dgs = list(datagrams(data))
+        self.assertEqual(2, len(dgs))
+        self.assertAlmostEqual(1500.0, dgs[0][0])
+        self.assertEqual(('10.0.0.1', 40000), dgs[0][1])
+        self.assertEqual(GET, bytes(dgs[0][3]))
+        self.assertTrue(dgs[1][0] is None)
+        self.assertEqual(ACK, bytes(dgs[1][3]))
+
+    def testResolution(self):
+        data = pcapng(228, [(3 << 20, udp4('10.0.0.1', '10.0.0.2', 1, 2, GET))], 0x80 | 20)
+        self.assertEqual([3.0], [_r[0] for _r in pcapng_datagrams(data)])
+        data = pcapng(228, [(2500, udp4('10.0.0.1', '10.0.0.2', 1, 2, GET))], 3)
+        self.assertEqual([2.5], [_r[0] for _r in pcapng_datagrams(data)])
+
+
+class TestCoAPyCapture (unittest.TestCase):
+    def testRoundTrip(self):
+        out = io.BytesIO()
+        cw = CaptureWriter(out)
+        cw.write(12.5, ('10.0.0.1', 40000), ('::1', 5683), GET)
+        cw.write(13.0, ('::1', 5683), ('10.0.0.1', 40000),
+                 coapy.message.Message.from_packed(ACK))
+        data = out.getvalue()
+        self.assertEqual(COAPY_CAPTURE_MAGIC, data[:8])
+        recs = list(messages(memoryview(data)))
+        self.assertEqual(2, len(recs))
+        (ts, src, dst, m) = recs[0]
+        self.assertEqual(12.5, ts)
+        self.assertEqual(('10.0.0.1', 40000), src)
+        self.assertEqual(('::1', 5683), dst)
+        self.assertTrue(isinstance(m, coapy.message.Request))
+        self.assertFalse(m.options_materialized())
+        self.assertEqual('sensor', m.options[0].value)
+        self.assertEqual(ACK, recs[1][3].to_packed())
+        self.assertRaises(ValueError, cw.write, 1.0, ('host', 1), ('::1', 2), GET)
+
+
+class TestReadCapture (unittest.TestCase):
+    def testFile(self):
+        data = pcap(1, [(1.0, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683, GET))),
+                        (2.0, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683, b'\x40'))),
+                        (3.0, ethernet(udp4('10.0.0.1', '10.0.0.2', 40000, 5683,
+                                            b'\x41\x01\x12\x34'))),
+                        (4.0, ethernet(udp4('10.0.0.2', '10.0.0.1', 5683, 40000, ACK))),
+                        (5.0, ethernet(udp4('10.0.0.3', '10.0.0.4', 53, 53, GET)))])
+        (fd, path) = tempfile.mkstemp()
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            recs = list(read_capture(path, lazy=False, ports=(5683,)))
+            self.assertEqual([1.0, 4.0], [_r[0] for _r in recs])
+            self.assertTrue(recs[0][3].options_materialized())
+            self.assertEqual(3, len(list(read_capture(path))))
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,7 @@ from coapy.endpoint import *
 from tests.support import *
 import coapy.option
 import urlparse
+import struct
 
 
 class TestEndpoint (unittest.TestCase):
@@ -228,6 +229,40 @@ class TestURLConversion (unittest.TestCase):
         self.assertTrue(isinstance(opt, coapy.option.UriPath))
         self.assertEqual('core', opt.value)
 
+    def testCache(self):
+        ep = Endpoint(host='2001:db8::2:3')
+        # The caches are created only when URIs are converted.
+        self.assertTrue(ep._Endpoint__uri_options_cache is None)
+        self.assertTrue(ep._Endpoint__uri_text_cache is None)
+        url = 'coap://example.net/a/b?q'
+        opts = ep.uri_to_options(url)
+        self.assertTrue(all(_o.is_frozen() for _o in opts))
+        cache = ep.uri_options_cache
+        hits = cache.hits
+        opts2 = ep.uri_to_options(url)
+        self.assertEqual(hits + 1, cache.hits)
+        self.assertFalse(opts is opts2)
+        self.assertEqual([id(_o) for _o in opts], [id(_o) for _o in opts2])
+        opts2.append(coapy.option.UriPath('c'))
+        self.assertEqual(len(opts), len(ep.uri_to_options(url)))
+        self.assertEqual(opts, ep.uri_to_options('b?q', 'coap://example.net/a/'))
+
+        cache = ep.uri_text_cache
+        self.assertEqual(url, ep.uri_from_options(opts))
+        hits = cache.hits
+        extra = [coapy.option.ContentFormat(0), coapy.option.UriPath('a'),
+                 coapy.option.UriPath('b'), coapy.option.UriQuery('q'),
+                 coapy.option.UriHost('example.net')]
+        self.assertEqual(url, ep.uri_from_options(extra))
+        self.assertEqual(hits + 1, cache.hits)
+        extra[1].value = 'z'
+        self.assertEqual('coap://example.net/z/b?q', ep.uri_from_options(extra))
+
+        ep._reset()
+        self.assertTrue(ep._Endpoint__uri_options_cache is None)
+        self.assertEqual(0, len(ep.uri_options_cache))
+        self.assertEqual(0, len(ep.uri_text_cache))
+
     def testInvalidToOpts(self):
         ep = Endpoint(host='::1')
         with self.assertRaises(URIError) as cm:
@@ -274,6 +309,42 @@ class TestEndpointInterface (unittest.TestCase):
         self.assertEqual('path', opt.value)
         self.assertTrue(m.payload is None)
 
+    def testCreateRequestTemplate(self):
+        ep = Endpoint(host='::1')
+        rt = ep.create_request_template('/path/sub?q=1', confirmable=True,
+                                        options=[coapy.option.Accept(0)])
+        self.assertTrue(isinstance(rt, coapy.message.RequestTemplate))
+        self.assertTrue(rt.destination_endpoint is ep)
+        self.assertTrue(rt.confirmable)
+        self.assertEqual(coapy.message.Request.GET, rt.code)
+        ref = ep.create_request('/path/sub?q=1', confirmable=True, messageID=0x1234,
+                                token=b'tk', options=[coapy.option.Accept(0)],
+                                payload=b'data')
+        self.assertEqual(ref.to_packed(), rt.to_packed(0x1234, b'tk', b'data'))
+        buf = bytearray(64)
+        n = rt.pack_into(buf, 2, 0x1234, b'tk', b'data')
+        self.assertEqual(ref.to_packed(), bytes(buf[2:2 + n]))
+        self.assertRaises(ValueError, rt.pack_into, bytearray(n - 1), 0, 0x1234, b'tk', b'data')
+        self.assertRaises(ValueError, rt.to_packed, 65536)
+        self.assertRaises(ValueError, rt.to_packed, 1, b'123456789')
+        m = rt.create_request(messageID=0x1234, token=b'tk', payload=b'data')
+        self.assertTrue(isinstance(m, coapy.message.Request))
+        self.assertTrue(m.destination_endpoint is ep)
+        self.assertFalse(m.options_materialized())
+        self.assertEqual(ref.to_packed(), m.to_packed())
+        self.assertEqual([type(_o) for _o in ref.options], [type(_o) for _o in m.options])
+
+    def testSendTemplate(self):
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        rt = dep.create_request_template('/path')
+        ce = sep.send(rt)
+        self.assertTrue(isinstance(ce.message, coapy.message.Request))
+        self.assertTrue(ce.destination_endpoint is dep)
+        ce.process_timeout()
+        self.assertEqual(1, len(dep.fifo))
+        self.assertEqual(rt.to_packed(ce.message.messageID), dep.fifo[0][0])
+
 
 class TestBoundEndpoints (unittest.TestCase):
     def testBasic(self):
@@ -312,6 +383,138 @@ class TestSocketSendRecv (unittest.TestCase):
         s1 = ep1.set_bound_socket(None)
         s1.close()
 
+    def testBatch(self):
+        ep1 = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        ep2 = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        ep2.bound_socket.setblocking(0)
+        datagrams = [(struct.pack(str('!H'), _i), ep2) for _i in xrange(5)]
+        self.assertEqual(5, ep1.rawsendto_many(datagrams))
+        self.assertEqual(5, ep1.remote_state(ep2).tx_messages)
+        rx = ep2.rawrecvfrom_many(2)
+        buffers = ep2._SocketEndpoint__recv_buffers
+        rx.extend(ep2.rawrecvfrom_many(2))
+        if buffers is not None:
+            self.assertTrue(buffers is ep2._SocketEndpoint__recv_buffers)
+        rx.extend(ep2.rawrecvfrom_many(8))
+        self.assertEqual([_d for (_d, _) in datagrams], [_d for (_d, _) in rx])
+        self.assertTrue(all(_ep is ep1 for (_, _ep) in rx))
+        self.assertEqual(5, ep2.remote_state(ep1).rx_messages)
+        self.assertRaises(socket.error, ep2.rawrecvfrom_many)
+        # Blocking sockets wait only for the first datagram.
+        ep2.bound_socket.setblocking(1)
+        ep1.rawsendto(b'x', ep2)
+        self.assertEqual([(b'x', ep1)], ep2.rawrecvfrom_many())
+        for ep in (ep1, ep2):
+            ep.set_bound_socket(None).close()
+
+    def testSockaddr(self):
+        import coapy.endpoint
+        for (family, sockaddr) in ((socket.AF_INET, ('192.0.2.1', 5683)),
+                                   (socket.AF_INET6, ('2001:db8::1', 61616, 0, 3))):
+            packed = coapy.endpoint._pack_sockaddr(family, sockaddr)
+            self.assertEqual(sockaddr, coapy.endpoint._unpack_sockaddr(packed))
+
+
+class TestEndpointLoop (LogHandler_mixin,
+                        unittest.TestCase):
+    def testExchange(self):
+        import coapy.message
+        cep = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        sep = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        received = []
+
+        def server(entry):
+            received.append(entry)
+            entry.reply()
+        loop = EndpointLoop()
+        loop.add(cep)
+        loop.add(sep, server)
+        self.assertEqual(set([cep, sep]), set(loop.endpoints))
+        self.assertRaises(ValueError, loop.add, sep)
+        self.assertRaises(TypeError, loop.add, Endpoint(host='127.0.0.1', port=1))
+        self.assertEqual(0, loop.run_once(0))
+
+        ce = cep.send(sep.create_request('/path', confirmable=True, token=b'x'), sep)
+        self.assertFalse(loop.next_deadline() is None)
+        loop.run_once(1.0)
+        while not received:
+            loop.run_once(1.0)
+        self.assertEqual(1, len(received))
+        opt = coapy.option.UriPath.first_match(received[0].message.options)
+        self.assertEqual('path', opt.value)
+        while ce.ST_completed != ce.state:
+            loop.run_once(1.0)
+        self.assertTrue(isinstance(ce.reply_message, coapy.message.Message))
+        self.assertTrue(ce.reply_message.is_acknowledgement())
+        self.assertEqual(1, ce.transmissions)
+
+        loop.remove(cep)
+        loop.remove(sep)
+        self.assertEqual([], loop.endpoints)
+        for ep in (cep, sep):
+            ep.set_bound_socket(None).close()
+
+    def testReceiveFailure(self):
+        sep = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        loop = EndpointLoop()
+        loop.add(sep)
+        calls = []
+
+        def receive_many():
+            calls.append(None)
+            raise RuntimeError('persistent')
+        sep.receive_many = receive_many
+        # An unexpected failure ends the pass rather than retrying.
+        self.assertEqual(0, loop.receive(sep))
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, len(self.log_handler.buffer))
+        self.log_handler.flush()
+        loop.remove(sep)
+        sep.set_bound_socket(None).close()
+
+    def testPollerTimeout(self):
+        import time
+        import coapy.endpoint
+        poller = coapy.endpoint._Poller()
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        poller.register(s.fileno())
+        # Fractional milliseconds must not wake the poller early.
+        for timeout in (0.0004, 0.0025):
+            t0 = time.time()
+            self.assertEqual([], poller.wait(timeout))
+            self.assertTrue(time.time() - t0 >= timeout)
+        poller.unregister(s.fileno())
+        s.close()
+
+    def testMalformed(self):
+        import coapy.message
+        sep = SocketEndpoint.create_bound_endpoint(host='127.0.0.1', port=0)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        cep = Endpoint(sockaddr=s.getsockname(), family=socket.AF_INET)
+        received = []
+        loop = EndpointLoop()
+        loop.add(sep, received.append)
+        # A confirmable request with a Uri-Path that is not UTF-8
+        s.sendto(b'\x40\x01\x12\x34\xb1\xff', sep.sockaddr)
+        rm = sep.create_request('/path', confirmable=False)
+        rm.messageID = 0x1235
+        s.sendto(rm.to_packed(), sep.sockaddr)
+        while 2 > sep.remote_state(cep).rx_messages:
+            loop.run_once(1.0)
+        self.assertEqual(1, len(received))
+        self.assertEqual(0x1235, received[0].message_id)
+        self.assertEqual(1, sep.remote_state(cep).rx_malformed)
+        (data, _) = s.recvfrom(64)
+        rst = coapy.message.Message.from_packed(data)
+        self.assertTrue(rst.is_reset())
+        self.assertEqual(0x1234, rst.messageID)
+        self.assertEqual(1, len(self.log_handler.buffer))
+        self.log_handler.flush()
+        loop.remove(sep)
+        sep.set_bound_socket(None).close()
+        s.close()
+
 
 class TestMessageCache (ManagedClock_mixin,
                         unittest.TestCase):
@@ -540,6 +743,139 @@ class TestSentCache (DeterministicBEBO_mixin,
         self.assertEqual(0, len(cache))
         self.assertTrue(ce.cache is None)
 
+    def testProcessTimeouts(self):
+        tp = coapy.transmissionParameters
+        clk = coapy.clock
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        oep = FIFOEndpoint()
+        self.assertTrue(sep.next_deadline() is None)
+        ce = sep.send(dep.create_request('/path', confirmable=True, token=b'x'))
+        sep.send(oep.create_request('/path', confirmable=False, token=b'y'))
+        rm = sep.create_request('/other', confirmable=False)
+        rm.messageID = 7
+        oep.rawsendto(rm.to_packed(), sep)
+        self.assertTrue(sep.receive() is not None)
+        rcvd_cache = sep.remote_state(oep).rcvd_cache
+        self.assertTrue(rcvd_cache.timer_wheel is sep.timer_wheel)
+        self.assertTrue(rcvd_cache.queue() is None)
+        self.assertEqual(1, len(rcvd_cache))
+        self.assertEqual(2, len(sep._sent_cache))
+        self.assertEqual(3, len(sep.timer_wheel))
+        self.assertEqual(0, sep.next_deadline())
+        self.assertEqual(2, sep.process_timeouts())
+        self.assertEqual(1, len(dep.fifo))
+        self.assertEqual(1, len(oep.fifo))
+        self.assertEqual(0, sep.process_timeouts())
+        to = tp.ACK_TIMEOUT
+        for s in xrange(tp.MAX_RETRANSMIT):
+            self.assertAlmostEqual(clk() + to, sep.next_deadline())
+            clk.adjust(to)
+            self.assertEqual(1, sep.process_timeouts())
+            self.assertEqual(2 + s, len(dep.fifo))
+            to += to
+        clk.adjust(to)
+        self.assertEqual(1, sep.process_timeouts())
+        self.assertEqual(ce.ST_completed, ce.state)
+        clk.adjust(tp.EXCHANGE_LIFETIME - clk())
+        self.assertEqual(3, sep.process_timeouts())
+        self.assertEqual(0, len(rcvd_cache))
+        self.assertEqual(0, len(sep._sent_cache))
+        self.assertTrue(sep.next_deadline() is None)
+        sep.send(dep.create_request('/path', confirmable=True))
+        self.assertEqual(1, len(sep.timer_wheel))
+        sep._sent_cache.clear()
+        self.assertEqual(0, len(sep._sent_cache))
+        self.assertEqual(0, len(sep.timer_wheel))
+
+    def testProcessTimeoutsImmediate(self):
+        clk = coapy.clock
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        # A message sent between tick boundaries is transmitted by
+        # the next pass, not at the end of the tick.
+        clk.adjust(sep.TIMER_GRANULARITY / 2)
+        ce = sep.send(dep.create_request('/path', confirmable=True, token=b'x'))
+        self.assertTrue(sep.next_deadline() <= clk())
+        self.assertEqual(1, sep.process_timeouts(clk()))
+        self.assertEqual(1, ce.transmissions)
+        self.assertEqual(1, len(dep.fifo))
+
+    def testReceiveMany(self):
+        sep = FIFOEndpoint()
+        oep = FIFOEndpoint()
+        batches = []
+        rawsendto_many = sep._rawsendto_many
+
+        def record_batch(datagrams):
+            batches.append(len(datagrams))
+            return rawsendto_many(datagrams)
+        sep._rawsendto_many = record_batch
+        packed = []
+        for mid in xrange(3):
+            rm = sep.create_request('/path', confirmable=True)
+            rm.messageID = mid
+            packed.append(rm.to_packed())
+            oep.rawsendto(packed[-1], sep)
+        entries = sep.receive_many(2)
+        self.assertEqual([0, 1], [_e.message_id for _e in entries])
+        entries.extend(sep.receive_many())
+        self.assertEqual([2], [_e.message_id for _e in entries[2:]])
+        self.assertRaises(socket.error, sep.receive_many)
+        for e in entries:
+            e.reply()
+        self.assertEqual(3, len(oep.fifo))
+        self.assertEqual([], batches)
+        # Retransmissions of the requests are acknowledged in one batch.
+        del oep.fifo[:]
+        for data in packed:
+            oep.rawsendto(data, sep)
+        self.assertEqual([], sep.receive_many())
+        self.assertEqual([3], batches)
+        self.assertEqual(3, len(oep.fifo))
+        state = sep.remote_state(oep)
+        self.assertEqual(3, state.rx_duplicates)
+        self.assertEqual(6, state.tx_messages)
+
+    def testReceiveManyFailure(self):
+        from coapy.message import Message
+        sep = FIFOEndpoint()
+        oep = FIFOEndpoint()
+        for mid in xrange(2):
+            rm = sep.create_request('/path', confirmable=True)
+            rm.messageID = mid
+            oep.rawsendto(rm.to_packed(), sep)
+        from_packed = Message.__dict__['from_packed']
+
+        def fail_first(cls, data):
+            if 0 == coapy.message.peek_header(data).messageID:
+                raise RuntimeError('decode')
+            return from_packed.__get__(None, cls)(data)
+        Message.from_packed = classmethod(fail_first)
+        try:
+            entries = sep.receive_many()
+        finally:
+            Message.from_packed = from_packed
+        self.assertEqual([1], [_e.message_id for _e in entries])
+        self.assertEqual(2, sep.remote_state(oep).rx_messages)
+        self.assertEqual(0, len(sep.fifo))
+        self.assertEqual(1, len(self.log_handler.buffer))
+        self.log_handler.flush()
+
+    def testBatchSendFailure(self):
+        sep = FIFOEndpoint()
+        dep1 = FIFOEndpoint()
+        dep2 = FIFOEndpoint()
+        bad = Endpoint(host='192.0.2.1')
+        for dep in (dep1, bad, dep2):
+            sep.send(dep.create_request('/path', confirmable=False))
+        self.assertEqual(3, sep.process_timeouts())
+        self.assertEqual(1, len(dep1.fifo))
+        self.assertEqual(1, len(dep2.fifo))
+        self.assertEqual(0, sep.remote_state(bad).tx_messages)
+        self.assertEqual(1, len(self.log_handler.buffer))
+        self.log_handler.flush()
+
     def testNONNoAck(self):
         tp = coapy.transmissionParameters
         self.assertEqual(tp.ACK_RANDOM_FACTOR, 1.0)
@@ -674,6 +1010,77 @@ class TestSentCache (DeterministicBEBO_mixin,
         self.assertEqual(ce.ST_completed, ce.state)
         self.assertEqual(ce.time_due, tp.EXCHANGE_LIFETIME)
 
+    def testIgnoredHeader(self):
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        for data in (b'\x40\x01\x12', b'\x80\x01\x12\x34\xff\x00'):
+            dep.fifo.append((data, sep))
+            self.assertTrue(dep.receive() is None)
+            self.assertEqual(0, len(dep.fifo))
+        self.assertEqual(0, len(dep.remote_state(sep).rcvd_cache))
+
+    def testDuplicateNotDecoded(self):
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        sm = dep.create_request('/path', confirmable=True, token=b'x')
+        ce = sep.send(sm)
+        ce.process_timeout()
+        data = dep.fifo[0][0]
+        rce = dep.receive()
+        rce.reply()
+        self.assertEqual(1, len(sep.fifo))
+        dstate = dep.remote_state(sep)
+        self.assertEqual(0, dstate.rx_decodes_avoided)
+
+        # A retransmission gets the same ACK without being decoded,
+        # even if it could not have been decoded.
+        dep.fifo.append((data[:-1] + b'\xff', sep))
+        self.assertTrue(dep.receive() is None)
+        self.assertEqual(2, rce.reception_count)
+        self.assertEqual(1, dstate.rx_duplicates)
+        self.assertEqual(1, dstate.rx_decodes_avoided)
+        self.assertEqual(2, len(sep.fifo))
+        self.assertEqual(sep.fifo[0][0], sep.fifo[1][0])
+
+        # An ACK for an unknown message ID is dropped.
+        ack = coapy.message.Message(acknowledgement=True, messageID=sm.messageID + 1,
+                                    code=coapy.message.Message.Empty)
+        dep.fifo.append((ack.to_packed(), sep))
+        self.assertTrue(dep.receive() is None)
+        self.assertEqual(1, dstate.rx_duplicates)
+        self.assertEqual(2, dstate.rx_decodes_avoided)
+        self.assertEqual(['Received duplicate', 'Reply to unrecognized message'],
+                         [_r.getMessage() for _r in self.log_handler.buffer])
+        self.log_handler.flush()
+
+    def testEmptyReply(self):
+        sep = FIFOEndpoint()
+        dep = FIFOEndpoint()
+        sm = dep.create_request('/path', confirmable=False, token=b'x')
+        sep.send(sm).process_timeout()
+        rce = dep.receive()
+        with self.assertRaises(coapy.message.MessageReplyError) as cm:
+            rce.reply()
+        self.assertEqual(cm.exception.args[0], cm.exception.ACK_FOR_NON)
+        self.assertTrue(rce.reply_message is None)
+        rce.reply(reset=True)
+        self.assertEqual([(b'\x70\x00' + struct.pack(str('!H'), sm.messageID), dep)],
+                         list(sep.fifo))
+        rm = rce.reply_message
+        self.assertTrue(rm.is_reset())
+        self.assertEqual(sm.messageID, rm.messageID)
+        self.assertTrue(rm.source_endpoint is dep)
+        self.assertTrue(rm.destination_endpoint is sep)
+        self.assertTrue(rm is rce.reply_message)
+
+        # A confirmable message that cannot be decoded is rejected.
+        sep.fifo.pop(0)
+        dep.fifo.append((b'\x40\x01\x56\x78\xf0', sep))
+        self.assertTrue(dep.receive() is None)
+        self.assertEqual([(b'\x70\x00\x56\x78', dep)], list(sep.fifo))
+        self.assertEqual(1, len(self.log_handler.buffer))
+        self.log_handler.flush()
+
     def testCONPBReply(self):
         from coapy.message import Message, Request, SuccessResponse
 
@@ -105,6 +105,38 @@ class TestCodeSupport (unittest.TestCase):
         self.assertTrue(m.code_support() is None)
         self.assertTrue(Message._type_for_code(m.code) is None)
 
+    def testPackedCodes(self):
+        self.assertTrue(Message._code_support(0x01) is Message._code_support(Request.GET))
+        self.assertEqual(Request, Message._type_for_code(0x1F))
+        self.assertEqual(ClientErrorResponse, Message._type_for_code((4, 31)))
+        self.assertRaises(ValueError, Message._type_for_code, 256)
+        self.assertRaises(TypeError, Message._type_for_code, None)
+
+    def testRegisterCode(self):
+        class ExtRequest (Request):
+            __slots__ = ()
+        self.assertEqual(Request, Message._type_for_code((0, 30)))
+        # The registries are process-wide; restore them afterwards.
+        registries = (Message._Message__CodeRegistry,
+                      Message._Message__CodeClassRegistry,
+                      Message._Message__ConstructorTable)
+        saved = [list(_r) for _r in registries]
+        try:
+            Request.RegisterCode((0, 30), 'EXT', ExtRequest)
+            self.assertRaises(ValueError, Request.RegisterCode, (0, 30), 'EXT')
+            self.assertRaises(ValueError, Request.RegisterCode, (2, 30), 'EXT')
+            self.assertEqual(ExtRequest, Message._type_for_code((0, 30)))
+            self.assertEqual('EXT', Message._code_support(0x1E).name)
+            m = Message.from_packed(b'\x40\x1e\x12\x34')
+            self.assertTrue(isinstance(m, ExtRequest))
+            self.assertEqual((0, 30), m.code)
+            self.assertEqual(Request, type(Message.from_packed(b'\x40\x1f\x12\x34')))
+        finally:
+            for (registry, contents) in zip(registries, saved):
+                registry[:] = contents
+        self.assertEqual(Request, Message._type_for_code((0, 30)))
+        self.assertTrue(Message._code_support(0x1E) is None)
+
 
 class TestMessage (unittest.TestCase):
     def testType(self):
@@ -394,6 +426,26 @@ class TestMessageValidation (tests.support.LogHandler_mixin,
         #                 'Unrecognized option in message: UnrecognizedOption<3>: bogus')
         #self.log_handler.flush()
 
+    def testValidationCached(self):
+        m = Request(code=Request.GET, options=[coapy.option.UriPath('b'),
+                                               coapy.option.UriHost('h'),
+                                               coapy.option.UriPath('a')])
+        m.validate()
+        self.assertEqual(['h', 'b', 'a'], [_o.value for _o in m.options])
+        m.validate()
+        m.options.append(coapy.option.ProxyUri('coap://localhost/foo'))
+        with self.assertRaises(MessageValidationError) as cm:
+            m.validate()
+        self.assertEqual(cm.exception.args[0], MessageValidationError.PROXY_URI_CONFLICT)
+        m.options = [coapy.option.MaxAge(3)]
+        m.validate()
+        self.assertTrue(isinstance(m.options[0], coapy.option.UnrecognizedOption))
+        m.validate()
+        m.code = SuccessResponse.Content
+        with self.assertRaises(MessageValidationError) as cm:
+            m.validate()
+        self.assertEqual(cm.exception.args[0], MessageValidationError.CODE_INSTANCE_CONFLICT)
+
 
 class TestMessageEndpoints (unittest.TestCase):
     def testBasic(self):
@@ -461,6 +513,10 @@ class TestRequest (unittest.TestCase):
 
     def testImmutable(self):
         req = Request()
+        for m in (req, Message(), SuccessResponse(), ClientErrorResponse()):
+            self.assertFalse(hasattr(m, '__dict__'))
+            with self.assertRaises(AttributeError):
+                m.extra = 1
         with self.assertRaises(AttributeError):
             Request.CodeClass = 8
         with self.assertRaises(AttributeError):
@@ -566,6 +622,126 @@ class TestMessageEncodeDecode (unittest.TestCase):
             Message.from_packed(packed)
         self.assertEqual(cm.exception.args[0], MessageFormatError.TOKEN_TOO_LONG)
 
+    def testBuffers(self):
+        pm = b'\x43\x01\x12\x34123\xb6sensor\xffpayload'
+        ref = Message.from_packed(pm)
+        for data in (bytearray(pm), memoryview(pm), memoryview(b'pfx' + pm)[3:]):
+            m = Message.from_packed(data)
+            self.assertTrue(isinstance(m, Request))
+            self.assertEqual(ref.messageID, m.messageID)
+            self.assertTrue(isinstance(m.token, bytes))
+            self.assertEqual(b'123', m.token)
+            self.assertEqual(1, len(m.options))
+            self.assertEqual('sensor', m.options[0].value)
+            self.assertTrue(isinstance(m.payload, bytes))
+            self.assertEqual(b'payload', m.payload)
+
+    def testTruncated(self):
+        self.assertTrue(Message.from_packed(b'') is None)
+        self.assertTrue(Message.from_packed(b'\x40\x01\x12') is None)
+        with self.assertRaises(MessageFormatError) as cm:
+            Message.from_packed(b'\x43\x01\x12\x3412')
+        self.assertEqual(cm.exception.args[0], MessageFormatError.TOKEN_TRUNCATED)
+        self.assertEqual(cm.exception.args[1]['messageID'], 0x1234)
+        with self.assertRaises(MessageFormatError) as cm:
+            Message.from_packed(b'\x40\x01\x12\x34\xb6sens')
+        self.assertEqual(cm.exception.args[0], MessageFormatError.INVALID_OPTION)
+
+    def testPeekHeader(self):
+        pm = b'\x63\x45\x12\x34123\xb6sensor'
+        for data in (pm, bytearray(pm), memoryview(b'pfx' + pm)[3:]):
+            hdr = peek_header(data)
+            self.assertEqual(Message.Ver, hdr.version)
+            self.assertEqual(Message.Type_ACK, hdr.type)
+            self.assertEqual(3, hdr.token_length)
+            self.assertEqual(SuccessResponse.Content, hdr.code)
+            self.assertEqual(0x1234, hdr.messageID)
+            self.assertTrue(isinstance(hdr.token, bytes))
+            self.assertEqual(b'123', hdr.token)
+        self.assertTrue(peek_header(b'\x40\x01\x12') is None)
+        self.assertEqual(2, peek_header(b'\x80\x01\x12\x34').version)
+        self.assertTrue(peek_header(b'\x43\x01\x12\x3412').token is None)
+        hdr = peek_header(b'\x49\x01\x12\x34123456789')
+        self.assertEqual(9, hdr.token_length)
+        self.assertTrue(hdr.token is None)
+
+    def testLazy(self):
+        pm = b'\x43\x01\x12\x34123\xb6sensor\x04temp\xffpayload'
+        ref = Message.from_packed(pm)
+        self.assertTrue(ref.options_materialized())
+        m = Message.from_packed(memoryview(b'pfx' + pm)[3:], lazy=True)
+        self.assertTrue(isinstance(m, Request))
+        self.assertFalse(m.options_materialized())
+        self.assertEqual(b'123', m.token)
+        self.assertEqual(b'payload', m.payload)
+        self.assertEqual(pm, m.to_packed())
+        self.assertFalse(m.options_materialized())
+        self.assertEqual(2, len(m.options))
+        self.assertTrue(m.options_materialized())
+        self.assertEqual(['sensor', 'temp'], [_o.value for _o in m.options])
+        self.assertEqual(pm, m.to_packed())
+
+        m = Message.from_packed(pm, lazy=True)
+        m.options = [coapy.option.UriPath('other')]
+        self.assertTrue(m.options_materialized())
+        self.assertEqual(b'\x43\x01\x12\x34123\xb5other\xffpayload', m.to_packed())
+
+        m = Message.from_packed(b'\x40\x01\x12\x34', lazy=True)
+        self.assertTrue(m.options_materialized())
+        self.assertEqual([], m.options)
+
+        with self.assertRaises(MessageFormatError) as cm:
+            Message.from_packed(b'\x40\x01\x12\x34\xb6sens', lazy=True)
+        self.assertEqual(cm.exception.args[0], MessageFormatError.INVALID_OPTION)
+
+    def testPackedCache(self):
+        m = Request(confirmable=True, code=Request.GET, messageID=0x1234,
+                    token=b'123', options=[coapy.option.UriPath('sensor')])
+        pm = m.to_packed()
+        self.assertEqual(b'\x43\x01\x12\x34123\xb6sensor', pm)
+        self.assertTrue(pm is m.to_packed())
+        m.messageID = 0x1235
+        self.assertEqual(b'\x43\x01\x12\x35123\xb6sensor', m.to_packed())
+        m.token = b'4'
+        self.assertEqual(b'\x41\x01\x12\x354\xb6sensor', m.to_packed())
+        m.code = Request.POST
+        self.assertEqual(b'\x41\x02\x12\x354\xb6sensor', m.to_packed())
+        m.payload = b'x'
+        self.assertEqual(b'\x41\x02\x12\x354\xb6sensor\xffx', m.to_packed())
+        m.options[0].value = 'temp'
+        self.assertEqual(b'\x41\x02\x12\x354\xb4temp\xffx', m.to_packed())
+        m.options.append(coapy.option.UriPath('c'))
+        self.assertEqual(b'\x41\x02\x12\x354\xb4temp\x01c\xffx', m.to_packed())
+        self.assertTrue(isinstance(m.options, coapy.option.OptionList))
+        self.assertEqual(2, len(coapy.option.UriPath.all_match(m.options)))
+        m.options = []
+        self.assertEqual(b'\x41\x02\x12\x354\xffx', m.to_packed())
+
+    def testPackInto(self):
+        m = Request(confirmable=True, code=Request.GET, messageID=0x1234,
+                    token=b'123', options=[coapy.option.UriPath('sensor')],
+                    payload=b'payload')
+        pm = b'\x43\x01\x12\x34123\xb6sensor\xffpayload'
+        buf = bytearray(64)
+        self.assertEqual(len(pm), m.pack_into(buf, 5))
+        self.assertEqual(pm, bytes(buf[5:5 + len(pm)]))
+        self.assertEqual(pm, m.to_packed())
+        buf = bytearray(len(pm))
+        self.assertEqual(len(pm), m.pack_into(memoryview(buf)))
+        self.assertEqual(pm, bytes(buf))
+        self.assertRaises(ValueError, m.pack_into, buf, 1)
+        lm = Message.from_packed(pm, lazy=True)
+        buf = bytearray(len(pm))
+        self.assertEqual(len(pm), lm.pack_into(buf))
+        self.assertEqual(pm, bytes(buf))
+        self.assertFalse(lm.options_materialized())
+        m = Message(acknowledgement=True, code=0, messageID=0x1234)
+        for n in (0, 3):
+            self.assertRaises(ValueError, m.pack_into, bytearray(n))
+        buf = bytearray(4)
+        self.assertEqual(4, m.pack_into(buf))
+        self.assertEqual(b'\x60\x00\x12\x34', bytes(buf))
+
     def testUnrecognizedCodes(self):
         m = Message.from_packed(b'\x40\x8A\x12\x34')
         self.assertEqual((4, 10), m.code)
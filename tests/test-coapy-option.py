@@ -20,6 +20,7 @@ from __future__ import division
 
 
 import unittest
+import struct
 from coapy.option import *
 
 
@@ -46,6 +47,10 @@ class TestOptionInfrastructure (unittest.TestCase):
             im.format = format_empty
         with self.assertRaises(AttributeError):
             im.name = 'Something-Else'
+        self.assertFalse(hasattr(im, '__dict__'))
+        with self.assertRaises(AttributeError):
+            im.extra = 1
+        self.assertFalse(hasattr(UnrecognizedOption(65000), '__dict__'))
         uh = UriHost()
         self.assertEqual(uh.number, 3)
         self.assertTrue(isinstance(uh.format, format_string))
@@ -86,6 +91,54 @@ class TestOptionInfrastructure (unittest.TestCase):
         self.assertRaises(ValueError, find_option, -3)
         self.assertTrue(find_option(0) is None)
 
+    def testFlags(self):
+        self.assertEqual(coapy.option._F_REQUEST
+                         | coapy.option._F_CRITICAL | coapy.option._F_UNSAFE,
+                         UriHost._flags)
+        self.assertEqual(coapy.option._F_REQUEST | coapy.option._F_MULTIPLE_REQUEST
+                         | coapy.option._F_CRITICAL | coapy.option._F_UNSAFE,
+                         UriPath._flags)
+        self.assertEqual(coapy.option._F_RESPONSE, MaxAge._flags & 0x0F)
+        self.assertTrue(UnrecognizedOption(65000)._flags & coapy.option._F_UNRECOGNIZED)
+        with self.assertRaises(AttributeError):
+            UriHost._flags = 0
+        with self.assertRaises(AttributeError):
+            UriHost()._flags = 0
+        opts = [UriHost('h'), UriHost('x'), MaxAge(3), UriPath('p')]
+        nopts = replace_unacceptable_options(opts, True)
+        self.assertEqual([UriHost, UnrecognizedOption, UriPath, UnrecognizedOption],
+                         [type(_o) for _o in nopts])
+        self.assertEqual(UriHost, type(opts[1]))
+
+    def testRegisterLater(self):
+        self.assertTrue(find_option(62) is None)
+        self.assertTrue(find_option(65002) is None)
+        # The registry is process-wide; restore it afterwards.
+        registry = dict(coapy.option._OptionRegistry)
+        table = list(coapy.option._OptionTable)
+        try:
+            class TableOption(UrOption):
+                number = 62
+                name = 'Table-Option'
+                format = format_opaque(8)
+                _repeatable = (False, False)
+
+            class RegistryOption(UrOption):
+                number = 65002
+                name = 'Registry-Option'
+                format = format_opaque(8)
+                _repeatable = (False, False)
+            self.assertEqual(TableOption, find_option(62))
+            self.assertEqual(RegistryOption, find_option(65002))
+            (opts, _) = decode_options(encode_options([RegistryOption(b'r'), TableOption(b't')]))
+            self.assertEqual([TableOption, RegistryOption], [type(_o) for _o in opts])
+        finally:
+            coapy.option._OptionRegistry.clear()
+            coapy.option._OptionRegistry.update(registry)
+            coapy.option._OptionTable[:] = table
+        self.assertTrue(find_option(62) is None)
+        self.assertTrue(find_option(65002) is None)
+
     def testUnrecognizedOption(self):
         instance = UnrecognizedOption(IfMatch.number)
         self.assertEqual(instance.number, IfMatch.number)
@@ -446,6 +499,17 @@ class TestUintFormat (unittest.TestCase):
         self.assertEqual((14, b'\x00\xff'), uint2.option_encoding(269 + 255))
         self.assertEqual((14, b'\xff\xff'), uint2.option_encoding(269 + 65535))
         self.assertRaises(ValueError, uint2.option_decoding, 15, b'')
+        self.assertRaises(OptionLengthError, uint2.option_encoding, 269 + 65536)
+
+    def testWideValues(self):
+        uint8 = format_uint(8)
+        for value in (0x80, 0x100, 0xFFFF, 0x10000, 0x123456, 0xFFFFFFFF, 0x100000000,
+                      0x123456789ABCDE, 0x7FFFFFFFFFFFFFFF):
+            pv = uint8.to_packed(value)
+            self.assertNotEqual(b'\x00', pv[:1])
+            self.assertEqual(value, uint8.from_packed(pv))
+            self.assertEqual(value, uint8.from_packed(b'\x00' * (8 - len(pv)) + pv))
+        self.assertRaises(struct.error, uint8.to_packed, -1)
 
 
 class TestOpaqueFormat (unittest.TestCase):
@@ -674,6 +738,171 @@ class TestEncodeDecodeOptions (unittest.TestCase):
         self.assertTrue(opt.is_critical())
         self.assertEqual(b'val', opt.value)
 
+    def testDecodeFrom(self):
+        popt = encode_options([UriPath('sensor'), UriPath('temp')])
+        data = b'hdr' + popt + b'\xffpayload'
+        (opts, offset) = decode_options_from(memoryview(data), 3)
+        self.assertEqual(2, len(opts))
+        self.assertEqual('sensor', opts[0].value)
+        self.assertEqual('temp', opts[1].value)
+        self.assertEqual(3 + len(popt), offset)
+        self.assertEqual(b'\xff', data[offset:offset+1])
+        (opts, offset) = decode_options_from(data, len(data))
+        self.assertTrue(opts is None)
+        self.assertEqual(len(data), offset)
+
+    def testEncodeInto(self):
+        opts = [UriPath('sensor'), Size1(1000), UriHost('h' * 20)]
+        popt = encode_options(opts)
+        buf = bytearray(3 + len(popt) + 2)
+        self.assertEqual(3 + len(popt), encode_options_into(opts, buf, 3))
+        self.assertEqual(popt, bytes(buf[3:3 + len(popt)]))
+        self.assertEqual(b'\0\0', bytes(buf[-2:]))
+        self.assertEqual(2, encode_options_into([], buf, 2))
+        buf = bytearray(len(popt) - 1)
+        self.assertRaises(ValueError, encode_options_into, opts, buf)
+        self.assertEqual(len(popt) - 1, len(buf))
+
+    def testDecodeTruncated(self):
+        self.assertRaises(OptionDecodeError, decode_options, b'\x46123')
+        self.assertRaises(OptionDecodeError, decode_options, b'\xd0')
+        self.assertRaises(OptionDecodeError, decode_options, b'\xe0\x01')
+
+    def testExtendedHeaders(self):
+        # Every combination of inline, one-octet, and two-octet delta
+        # and length fields.
+        for number in (12, 13, 268, 269, 5000):
+            for length in (0, 12, 13, 268, 269, 600):
+                opt = UnrecognizedOption(number, b'v' * length)
+                popt = encode_options([opt])
+                (index, offset) = index_options_from(popt + b'\xff')
+                self.assertEqual(((number, len(popt) - length, len(popt)),), index)
+                self.assertEqual(len(popt), offset)
+                if 1 < len(popt):
+                    self.assertRaises(OptionDecodeError, index_options_from, popt[:-1])
+                header_length = len(popt) - length
+                if 1 < header_length:
+                    self.assertRaises(OptionDecodeError, index_options_from,
+                                      popt[:header_length - 1])
+
+    def testFrozenOptions(self):
+        opts = [MaxAge(60), ContentFormat(50), ETag(b'tag')]
+        frozen = freeze_options(opts)
+        self.assertTrue(isinstance(frozen, tuple))
+        self.assertTrue(frozen is freeze_options(frozen))
+        self.assertEqual([4, 12, 14], [_o.number for _o in frozen])
+        self.assertEqual(((4, b'tag'), (12, b'2'), (14, b'<')), frozen.key)
+        cache = encoded_options_cache
+        cache.clear()
+        cache.reset_statistics()
+        # Option sets that are not frozen bypass the cache.
+        packed = encode_options(opts)
+        self.assertEqual((0, 0, 0), (cache.hits, cache.misses, len(cache)))
+        self.assertEqual(packed, encode_options(frozen))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        packed = encode_options(frozen)
+        self.assertTrue(packed is encode_options(list(reversed(frozen))))
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+        self.assertEqual(packed, encode_options([ETag(b'tag'), MaxAge(60), ContentFormat(50)]))
+        self.assertEqual((2, 1, 1), (cache.hits, cache.misses, len(cache)))
+        opts[0].value = 61
+        self.assertNotEqual(packed, encode_options(opts))
+        self.assertEqual(packed, encode_options(frozen))
+
+    def testOptionList(self):
+        ol = OptionList([UriPath('a'), ContentFormat(0), UriPath('b')])
+        self.assertEqual(['a', 'b'], [_o.value for _o in ol.with_number(UriPath.number)])
+        self.assertEqual((), ol.with_number(MaxAge.number))
+        self.assertTrue(MaxAge.first_match(ol) is None)
+        ol.append(MaxAge(5))
+        self.assertEqual(5, MaxAge.first_match(ol).value)
+        ol[2] = UnrecognizedOption(ContentFormat.number, b'')
+        self.assertTrue(ContentFormat.first_match(ol) is None)
+        del ol[0]
+        self.assertEqual(['b'], [_o.value for _o in UriPath.all_match(ol)])
+        ol[:] = [UriPath('c')]
+        self.assertEqual(['c'], [_o.value for _o in UriPath.all_match(ol)])
+        ol.extend([UriPath('d')])
+        ol.sort(key=lambda _o: _o.value, reverse=True)
+        self.assertEqual(['d', 'c'], [_o.value for _o in UriPath.all_match(ol)])
+        ol += [UriPath('e')]
+        self.assertTrue(isinstance(ol, OptionList))
+        self.assertEqual(3, len(UriPath.all_match(ol)))
+        self.assertEqual(1, len(UnrecognizedOption.all_match(ol + [UnrecognizedOption(9)])))
+
+    def testOptionListOrder(self):
+        def values(ol):
+            return [_o.value for _o in ol]
+        ol = OptionList([ContentFormat(0), UriPath('a'), IfMatch(b'x'), UriPath('b')])
+        self.assertEqual([b'x', 'a', 'b', 0], values(ol))
+        ol.append(UriPath('c'))
+        ol.insert(0, MaxAge(5))
+        ol.append(IfMatch(b'y'))
+        self.assertEqual([b'x', b'y', 'a', 'b', 'c', 0, 5], values(ol))
+        ol.extend([Accept(1), UriHost('h'), UriPath('d')])
+        self.assertEqual([b'x', b'y', 'h', 'a', 'b', 'c', 'd', 0, 5, 1], values(ol))
+        ol[0] = Size1(7)
+        self.assertEqual([b'y', 'h', 'a', 'b', 'c', 'd', 0, 5, 1, 7], values(ol))
+        ol.reverse()
+        self.assertEqual([b'y', 'h', 'd', 'c', 'b', 'a', 0, 5, 1, 7], values(ol))
+        ol.sort(key=lambda _o: _o.value)
+        self.assertEqual([b'y', 'h', 'a', 'b', 'c', 'd', 0, 5, 1, 7], values(ol))
+        ol[2:6] = [UriPath('z'), ContentFormat(1)]
+        self.assertEqual([b'y', 'h', 'z', 1, 0, 5, 1, 7], values(ol))
+        ol *= 2
+        self.assertEqual([11, 11, 12, 12, 12, 12], [_o.number for _o in ol[4:10]])
+        self.assertEqual(encode_options(sorted_options(list(ol))), encode_options(ol))
+        buf = bytearray(64)
+        end = encode_options_into(ol, buf)
+        self.assertEqual(encode_options(ol), bytes(buf[:end]))
+
+    def testInterned(self):
+        opt = UriPath.interned('sensor')
+        self.assertTrue(opt.is_frozen())
+        self.assertTrue(opt is UriPath.interned('sensor'))
+        self.assertTrue(opt is intern_option(UriPath('sensor')))
+        self.assertTrue(opt is intern_option(opt))
+        self.assertFalse(UriPath('sensor').is_frozen())
+        with self.assertRaises(AttributeError):
+            opt.value = 'temp'
+        self.assertEqual('sensor', opt.value)
+        self.assertFalse(opt is LocationPath.interned('sensor'))
+        self.assertRaises(TypeError, UriPath.interned, b'\xff')
+        uo = intern_option(UnrecognizedOption(2000, b'x'))
+        self.assertEqual((2000, b'x'), (uo.number, uo.value))
+        self.assertTrue(uo.is_frozen())
+
+    def testInternedDecode(self):
+        packed = encode_options([UriPath('a'), UriPath('b'), ETag(b'tag'), ContentFormat(0)])
+        (opts1, _) = decode_options(packed)
+        (opts2, _) = decode_options(packed)
+        self.assertEqual([False, True, True, True], [_o.is_frozen() for _o in opts1])
+        self.assertEqual([False, True, True, True], [_a is _b for (_a, _b) in zip(opts1, opts2)])
+        self.assertTrue(opts1[1] is UriPath.interned('a'))
+        frozen = freeze_options([UriPath('a'), ETag(b'tag')])
+        self.assertTrue(frozen[1] is opts1[1])
+        self.assertTrue(all(_o.is_frozen() for _o in frozen))
+
+    def testInternCapacity(self):
+        capacity = interned_options.capacity
+        try:
+            interned_options.capacity = 2
+            a = UriPath.interned('a')
+            UriPath.interned('b')
+            self.assertEqual(2, len(interned_options))
+            self.assertFalse(a is UriPath.interned('a'))
+        finally:
+            interned_options.capacity = capacity
+
+    def testPackedValueRetained(self):
+        opt = UriPath('sensor')
+        pv = opt.packed_value
+        self.assertTrue(pv is opt.packed_value)
+        opt.value = 'temp'
+        self.assertEqual(b'temp', opt.packed_value)
+        opt = Size1(packed_value=b'\x00\x01')
+        self.assertEqual(b'\x01', opt.packed_value)
+
     def testLengths(self):
         self.assertRaises(OptionLengthError, ETag, packed_value=b'')
         self.assertRaises(OptionLengthError, ETag, packed_value=b'123456789')
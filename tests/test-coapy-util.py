@@ -22,6 +22,7 @@ from __future__ import division
 import unittest
 import coapy
 from coapy.util import *
+from tests.support import *
 
 
 class TestCoAPy (unittest.TestCase):
@@ -108,6 +109,38 @@ class TestNetUnicode (unittest.TestCase):
         dpath = url_unquote(path_uq)
         self.assertEqual(path, dpath)
 
+    def testCaches(self):
+        self.assertEqual(b'ascii', to_net_unicode('ascii'))
+        self.assertFalse('ascii' in net_unicode_cache)
+        decomposed = 'e\u0301t\u00e9'
+        data = to_net_unicode(decomposed)
+        self.assertEqual('\u00e9t\u00e9'.encode('utf-8'), data)
+        hits = net_unicode_cache.hits
+        self.assertTrue(data is to_net_unicode(decomposed))
+        self.assertEqual(hits + 1, net_unicode_cache.hits)
+        self.assertRaises(TypeError, to_net_unicode, b'data')
+
+        self.assertEqual('a%2Fb', url_quote('a/b', ''))
+        self.assertEqual('a/b', url_quote('a/b'))
+        self.assertEqual('%C3%A9', url_quote('\u00e9'))
+        self.assertEqual('%E9', url_quote(b'\xe9'))
+        hits = url_quote_cache.hits
+        self.assertEqual('a%2Fb', url_quote('a/b', ''))
+        self.assertEqual(hits + 1, url_quote_cache.hits)
+
+        self.assertEqual('\u00e9', url_unquote('%C3%A9'))
+        hits = url_unquote_cache.hits
+        self.assertEqual('\u00e9', url_unquote('%C3%A9'))
+        self.assertEqual(hits + 1, url_unquote_cache.hits)
+
+        capacity = url_quote_cache.capacity
+        try:
+            url_quote_cache.capacity = 0
+            self.assertEqual('x%20y', url_quote('x y'))
+            self.assertEqual(0, len(url_quote_cache))
+        finally:
+            url_quote_cache.capacity = capacity
+
 
 class TestToDisplayText (unittest.TestCase):
     def testBasic(self):
@@ -137,6 +170,198 @@ class TestTimeDueOrdinal (unittest.TestCase):
         self.assertEqual(queue, TimeDueOrdinal.queue_ready_prefix(queue, td2.time_due + 1))
 
 
+class TestTimeDueQueue (unittest.TestCase):
+    def testBasic(self):
+        now = coapy.clock()
+        queue = TimeDueQueue()
+        self.assertRaises(IndexError, queue.__getitem__, 0)
+        td2 = TimeDueOrdinal(time_due=now+1)
+        td1 = TimeDueOrdinal(time_due=now)
+        td0 = TimeDueOrdinal(time_due=now-1)
+        td1b = TimeDueOrdinal(time_due=now)
+        for td in (td2, td1, td0, td1b):
+            td.queue_insert(queue)
+        self.assertEqual(4, len(queue))
+        self.assertTrue(queue[0] is td0)
+        self.assertEqual([td0, td1, td1b, td2], list(queue))
+        self.assertTrue(queue[2] is td1b)
+        self.assertTrue(td1 in queue)
+        self.assertFalse(TimeDueOrdinal(time_due=now) in queue)
+        self.assertRaises(ValueError, queue.insert, td1)
+        self.assertEqual([], TimeDueOrdinal.queue_ready_prefix(queue, now - 2))
+        self.assertEqual([td0, td1, td1b], queue.ready(now))
+        td1.time_due = now
+        td1.queue_reposition(queue)
+        self.assertEqual([td0, td1b, td1], queue.ready(now))
+        td0.time_due = now + 2
+        td0.queue_reposition(queue)
+        self.assertEqual([td1b, td1, td2, td0], queue.sorted())
+        td2.queue_remove(queue)
+        self.assertFalse(td2 in queue)
+        self.assertRaises(ValueError, queue.remove, td2)
+        self.assertEqual([td1b, td1, td0], list(queue))
+        queue.clear()
+        self.assertEqual(0, len(queue))
+
+    def testRandom(self):
+        import random
+        rng = random.Random(21)
+        queue = TimeDueQueue()
+        elements = []
+        for i in xrange(2000):
+            op = rng.randint(0, 3)
+            if (0 == op) or not elements:
+                td = TimeDueOrdinal(time_due=rng.randint(0, 100))
+                queue.insert(td)
+                elements.append(td)
+            elif 1 == op:
+                td = elements.pop(rng.randrange(len(elements)))
+                queue.remove(td)
+            else:
+                td = rng.choice(elements)
+                td.time_due = rng.randint(0, 100)
+                queue.reposition(td)
+            self.assertEqual(len(elements), len(queue))
+            if elements:
+                self.assertEqual(min(_e.time_due for _e in elements), queue[0].time_due)
+        expected = sorted(elements, key=lambda _e: _e.time_due)
+        self.assertEqual([_e.time_due for _e in expected], [_e.time_due for _e in queue])
+        due = queue.ready(50)
+        self.assertEqual([_e.time_due for _e in expected if _e.time_due <= 50],
+                         [_e.time_due for _e in due])
+
+
+class TestTimerWheel (ManagedClock_mixin,
+                      unittest.TestCase):
+    def testBasic(self):
+        clk = coapy.clock
+        wheel = TimerWheel(granularity=0.5, slots=4, levels=2)
+        self.assertTrue(wheel.next_deadline() is None)
+        self.assertEqual([], wheel.expire())
+        td = [TimeDueOrdinal(time_due=_t) for _t in (0.2, 0.4, 3.0, 7.9, 100.0)]
+        for t in td:
+            wheel.schedule(t)
+        self.assertEqual(5, len(wheel))
+        self.assertTrue(td[1] in wheel)
+        self.assertFalse(TimeDueOrdinal(time_due=0.2) in wheel)
+        self.assertEqual(0.5, wheel.next_deadline())
+        self.assertEqual([], wheel.expire(0.49))
+        self.assertEqual(td[:2], wheel.expire(0.5))
+        self.assertEqual(3.0, wheel.next_deadline())
+        self.assertTrue(wheel.cancel(td[2]))
+        self.assertFalse(wheel.cancel(td[2]))
+        self.assertEqual(8.0, wheel.next_deadline())
+        td[4].time_due = 2.0
+        wheel.schedule(td[4])
+        self.assertEqual(2, len(wheel))
+        self.assertEqual(2.0, wheel.next_deadline())
+        self.assertEqual([td[4], td[3]], wheel.expire(9.0))
+        self.assertEqual(0, len(wheel))
+        self.assertRaises(ValueError, wheel.schedule, TimeDueOrdinal())
+
+        # An empty wheel is re-anchored to the clock when an element
+        # is scheduled, and elements already due are returned at once.
+        clk.adjust(50)
+        wheel.schedule(td[0])
+        self.assertEqual(0.5, wheel.next_deadline())
+        self.assertEqual([td[0]], wheel.expire())
+        wheel.schedule(td[1])
+        wheel.clear()
+        self.assertEqual(0, len(wheel))
+        self.assertEqual([], wheel.expire())
+
+    def testRandom(self):
+        self.checkRandom(TimerWheel(granularity=1, slots=4, levels=2))
+
+    def testRandomSparse(self):
+        # Level 0 spans more ticks than elements are scheduled in, so
+        # expire skips runs of empty slots that wrap around the ring.
+        self.checkRandom(TimerWheel(granularity=1, slots=64, levels=2))
+
+    def checkRandom(self, wheel):
+        import random
+        rng = random.Random(22)
+        clk = coapy.clock
+        scheduled = []
+        for i in xrange(3000):
+            op = rng.randint(0, 5)
+            if 0 == op:
+                clk.adjust(rng.choice((1, 1, 2, 3, 7, 20)))
+                due = [_e for _e in scheduled if _e.time_due <= clk()]
+                due.sort(key=lambda _e: _e.time_due)
+                expired = wheel.expire()
+                self.assertEqual([_e.time_due for _e in due], [_e.time_due for _e in expired])
+                self.assertEqual(set(map(id, due)), set(map(id, expired)))
+                scheduled = [_e for _e in scheduled if _e.time_due > clk()]
+            elif (1 == op) and scheduled:
+                td = scheduled.pop(rng.randrange(len(scheduled)))
+                self.assertTrue(wheel.cancel(td))
+            elif (2 == op) and scheduled:
+                td = rng.choice(scheduled)
+                td.time_due = clk() + rng.randint(0, 60)
+                wheel.schedule(td)
+            else:
+                td = TimeDueOrdinal(time_due=clk() + rng.randint(0, 60))
+                wheel.schedule(td)
+                scheduled.append(td)
+            self.assertEqual(len(scheduled), len(wheel))
+            if scheduled:
+                self.assertEqual(min(_e.time_due for _e in scheduled), wheel.next_deadline())
+            else:
+                self.assertTrue(wheel.next_deadline() is None)
+
+
+class TestLRUCache (unittest.TestCase):
+    def testBasic(self):
+        cache = LRUCache(3)
+        self.assertEqual(3, cache.capacity)
+        for k in 'abc':
+            cache[k] = k.upper()
+        self.assertEqual(3, len(cache))
+        self.assertEqual('A', cache.get('a'))
+        cache['d'] = 'D'
+        self.assertFalse('b' in cache)
+        self.assertTrue('a' in cache)
+        self.assertTrue(cache.get('b') is None)
+        self.assertEqual(0, cache.get('b', 0))
+        cache['c'] = 'C2'
+        self.assertEqual('C2', cache.get('c'))
+        self.assertEqual((2, 2, 1), (cache.hits, cache.misses, cache.evictions))
+        cache.reset_statistics()
+        self.assertEqual((0, 0, 0), (cache.hits, cache.misses, cache.evictions))
+
+    def testUpdateRecency(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        # Assigning to an existing key makes it most recently used.
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertFalse('b' in cache)
+        self.assertEqual(3, cache.get('a'))
+        self.assertEqual(4, cache.get('c'))
+
+    def testCapacity(self):
+        cache = LRUCache(4)
+        for k in xrange(4):
+            cache[k] = k
+        cache.get(0)
+        cache.capacity = 2
+        self.assertEqual(2, len(cache))
+        self.assertEqual([True, False, False, True], [_k in cache for _k in xrange(4)])
+        self.assertEqual(2, cache.evictions)
+        cache.capacity = 0
+        cache[9] = 9
+        self.assertEqual(0, len(cache))
+        self.assertRaises(ValueError, setattr, cache, 'capacity', -1)
+        cache.capacity = 2
+        cache[1] = 1
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        cache[2] = 2
+        self.assertEqual(2, cache.get(2))
+
+
 class TestFormatTime (unittest.TestCase):
     def testBasic(self):
         import datetime